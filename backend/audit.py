@@ -0,0 +1,288 @@
+# audit.py
+import os
+import time
+import asyncio
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from fastapi import Request
+from database import engine
+from rate_limit import ip_cliente
+from models import AuditoriaORM
+import metrics
+
+# ============================================================
+# 🔹 Auditoría de acceso a historias clínicas
+# ============================================================
+# Quién leyó o modificó qué paciente/atención. Ningún handler escribe la
+# auditoría en su propia transacción: AuditMiddleware y los handlers dejan
+# el evento en una cola en memoria acotada y una tarea de fondo la vuelca
+# con COPY cada AUDIT_FLUSH_MS o cada AUDIT_BATCH_SIZE eventos, lo que
+# ocurra primero. En el shutdown la cola se drena antes de engine.dispose().
+#
+# Cola llena (la base no da abasto o está caída):
+#   AUDIT_ON_FULL=drop  → el evento se descarta y se cuenta (default: la
+#                         petición nunca espera a la auditoría)
+#   AUDIT_ON_FULL=block → la petición espera hasta AUDIT_BLOCK_TIMEOUT_MS
+#                         un lugar en la cola antes de descartar
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_MS = int(os.getenv("AUDIT_FLUSH_MS", "200"))
+AUDIT_ON_FULL = os.getenv("AUDIT_ON_FULL", "drop")
+AUDIT_BLOCK_TIMEOUT_MS = int(os.getenv("AUDIT_BLOCK_TIMEOUT_MS", "50"))
+AUDIT_DRAIN_TIMEOUT = float(os.getenv("AUDIT_DRAIN_TIMEOUT", "10"))
+
+COLUMNAS = [
+    "ts", "usuario_id", "username", "accion", "recurso", "paciente_id",
+    "recurso_id", "metodo", "ruta", "status", "ip", "detalle",
+]
+
+# Métodos HTTP → acción auditada (rutas con paciente_id en el path)
+ACCIONES = {"GET": "read", "HEAD": "read", "POST": "write", "PUT": "write", "PATCH": "write", "DELETE": "delete"}
+
+_cola: asyncio.Queue | None = None
+_escritor: asyncio.Task | None = None
+_parar = asyncio.Event()
+# lote que falló al escribirse: se reintenta antes que lo nuevo
+_pendiente: list[tuple] = []
+_stats = {"enqueued": 0, "dropped": 0, "blocked": 0, "written": 0, "flushes": 0, "errors": 0}
+
+# petición en curso: {"scope", "ip", "usuario": Principal | None (lo completa auth)}
+_ctx: ContextVar[dict | None] = ContextVar("audit_ctx", default=None)
+
+metrics.definir("audit_events_enqueued_total", "counter", "Eventos de auditoría encolados")
+metrics.definir("audit_events_dropped_total", "counter", "Eventos de auditoría descartados (cola llena)")
+metrics.definir("audit_enqueue_blocked_total", "counter", "Peticiones que esperaron lugar en la cola de auditoría")
+metrics.definir("audit_events_written_total", "counter", "Eventos de auditoría escritos en la base")
+metrics.definir("audit_flush_errors_total", "counter", "Volcados de auditoría fallidos (se reintentan)")
+metrics.definir("audit_flush_seconds", "histogram", "Duración de cada volcado de auditoría", metrics.LATENCY_BUCKETS)
+metrics.definir("audit_queue_depth", "gauge", "Eventos de auditoría esperando volcado")
+
+
+def _obtener_cola() -> asyncio.Queue:
+    global _cola
+    if _cola is None:
+        _cola = asyncio.Queue(maxsize=AUDIT_QUEUE_MAX)
+    return _cola
+
+
+# ============================================================
+# 🔹 Productores
+# ============================================================
+def identificar(usuario):
+    """Llamado por auth al resolver el principal de la petición."""
+    ctx = _ctx.get()
+    if ctx is not None:
+        ctx["usuario"] = usuario
+
+
+async def registrar(
+    accion: str,
+    recurso: str,
+    paciente_id: int | None = None,
+    recurso_id: int | None = None,
+    *,
+    usuario=None,
+    status: int | None = None,
+    detalle: str | None = None,
+):
+    """Encola un evento. Nunca toca la base; ver AUDIT_ON_FULL. Usuario,
+    método, ruta e IP salen de la petición en curso."""
+    ctx = _ctx.get()
+    metodo = ruta = ip = None
+    if ctx is not None:
+        usuario = usuario or ctx["usuario"]
+        scope = ctx["scope"]
+        metodo = scope["method"]
+        ruta = getattr(scope.get("route"), "path", scope["path"])
+        ip = ctx["ip"]
+    fila = (
+        datetime.now(timezone.utc),
+        usuario.id if usuario else None,
+        usuario.username if usuario else None,
+        accion, recurso, paciente_id, recurso_id, metodo, ruta, status, ip, detalle,
+    )
+
+    cola = _obtener_cola()
+    try:
+        cola.put_nowait(fila)
+    except asyncio.QueueFull:
+        if AUDIT_ON_FULL != "block":
+            return _descartar(recurso)
+        metrics.inc("audit_enqueue_blocked_total")
+        _stats["blocked"] += 1
+        try:
+            await asyncio.wait_for(cola.put(fila), AUDIT_BLOCK_TIMEOUT_MS / 1000)
+        except asyncio.TimeoutError:
+            return _descartar(recurso)
+    metrics.inc("audit_events_enqueued_total", recurso=recurso)
+    _stats["enqueued"] += 1
+
+
+def _descartar(recurso: str):
+    metrics.inc("audit_events_dropped_total", recurso=recurso)
+    _stats["dropped"] += 1
+    if _stats["dropped"] % 1000 == 1:
+        print(f"⚠️ Cola de auditoría llena: {_stats['dropped']} evento(s) descartado(s)")
+
+
+class AuditMiddleware:
+    """Middleware ASGI: audita toda ruta con paciente_id en el path (lectura
+    o escritura según el método) con el usuario que resolvió auth. Las rutas
+    que reciben el paciente en el cuerpo o la query auditan desde el handler."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        ctx = {"scope": scope, "ip": ip_cliente(Request(scope)), "usuario": None}
+        token = _ctx.set(ctx)
+        estado = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                estado["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            params = scope.get("path_params") or {}
+            if "paciente_id" in params:
+                recurso, recurso_id = "paciente", None
+                for nombre in ("atencion_id", "cierre_id"):
+                    if nombre in params:
+                        recurso, recurso_id = nombre.removesuffix("_id"), params[nombre]
+                await registrar(
+                    ACCIONES.get(scope["method"], scope["method"].lower()),
+                    recurso,
+                    _entero(params["paciente_id"]),
+                    _entero(recurso_id),
+                    status=estado["status"],
+                )
+            _ctx.reset(token)
+
+
+def _entero(valor) -> int | None:
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+# ============================================================
+# 🔹 Escritor en segundo plano
+# ============================================================
+async def _copy(filas: list[tuple]):
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            AuditoriaORM.__tablename__,
+            schema_name=AuditoriaORM.__table__.schema,
+            columns=COLUMNAS,
+            records=filas,
+        )
+        await conn.commit()
+
+
+async def _volcar(lote: list[tuple]) -> bool:
+    global _pendiente
+    filas = _pendiente + lote
+    t0 = time.perf_counter()
+    try:
+        await _copy(filas)
+    except Exception as e:
+        metrics.inc("audit_flush_errors_total")
+        _stats["errors"] += 1
+        # se conserva para reintentar, sin superar el tamaño de la cola
+        excedente = max(0, len(filas) - AUDIT_QUEUE_MAX)
+        for _ in range(excedente):
+            _descartar("reintento")
+        _pendiente = filas[excedente:]
+        print(f"⚠️ Volcado de auditoría falló ({len(filas)} eventos pendientes): {e}")
+        return False
+    metrics.observe("audit_flush_seconds", time.perf_counter() - t0)
+    metrics.inc("audit_events_written_total", len(filas))
+    _stats["written"] += len(filas)
+    _stats["flushes"] += 1
+    _pendiente = []
+    return True
+
+
+async def _siguiente_lote(cola: asyncio.Queue) -> list[tuple]:
+    """Junta hasta AUDIT_BATCH_SIZE eventos o lo que llegue en AUDIT_FLUSH_MS
+    desde el primero. Cancelar un get() de la cola no pierde eventos."""
+    lote = []
+    limite = None
+    while len(lote) < AUDIT_BATCH_SIZE and not _parar.is_set():
+        espera = AUDIT_FLUSH_MS / 1000 if limite is None else limite - time.monotonic()
+        if espera <= 0:
+            break
+        try:
+            lote.append(await asyncio.wait_for(cola.get(), espera))
+        except asyncio.TimeoutError:
+            if lote:
+                break
+            continue
+        if limite is None:
+            limite = time.monotonic() + AUDIT_FLUSH_MS / 1000
+    if _parar.is_set():
+        lote += _vaciar(cola, AUDIT_BATCH_SIZE - len(lote))
+    return lote
+
+
+def _vaciar(cola: asyncio.Queue, maximo: int) -> list[tuple]:
+    lote = []
+    while len(lote) < maximo and not cola.empty():
+        lote.append(cola.get_nowait())
+    return lote
+
+
+async def escritor():
+    """Tarea de fondo: vuelca la cola por lotes; si la base falla, reintenta.
+    Al pedir el apagado vacía la cola y termina."""
+    cola = _obtener_cola()
+    while not (_parar.is_set() and cola.empty() and not _pendiente):
+        lote = await _siguiente_lote(cola)
+        if (lote or _pendiente) and not await _volcar(lote):
+            await asyncio.sleep(AUDIT_FLUSH_MS / 1000)
+
+
+def iniciar():
+    global _escritor
+    _parar.clear()
+    _escritor = asyncio.create_task(escritor())
+
+
+async def detener():
+    """Desde el shutdown: deja que el escritor vacíe la cola (con tope de
+    AUDIT_DRAIN_TIMEOUT) antes de que se cierre el engine."""
+    if _escritor is None:
+        return
+    _parar.set()
+    try:
+        await asyncio.wait_for(_escritor, AUDIT_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        perdidos = _obtener_cola().qsize() + len(_pendiente)
+        print(f"⚠️ Auditoría: {perdidos} evento(s) sin volcar al apagar")
+    else:
+        print(f"📝 Auditoría drenada ({_stats['written']} eventos escritos)")
+
+
+@metrics.register_collector
+def _audit_gauges():
+    return [("audit_queue_depth", {}, (_cola.qsize() if _cola else 0) + len(_pendiente))]
+
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "queue_depth": _cola.qsize() if _cola else 0,
+        "pending_retry": len(_pendiente),
+        "queue_max": AUDIT_QUEUE_MAX,
+        "batch_size": AUDIT_BATCH_SIZE,
+        "flush_ms": AUDIT_FLUSH_MS,
+        "on_full": AUDIT_ON_FULL,
+    }
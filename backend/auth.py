@@ -1,18 +1,31 @@
-from fastapi import APIRouter, HTTPException, Depends, Form, status
+import os
+from dataclasses import dataclass
+from fastapi import APIRouter, HTTPException, Depends, Form, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert
+from sqlalchemy import select, insert, func
 from database import get_db
 from models import UsuarioORM, RolORM, usuario_rol_table, PacienteORM, ProfesionalORM
+from crud import reservar_unicos
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
-from passlib.context import CryptContext
+from cache import TTLCache
+from rate_limit import limitar_login, limitar_registro
+import hashing
+import audit
 
 SECRET_KEY = "tu_secreto_aqui"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cache de principales autenticados (por proceso). invalidar_principal()
+# solo limpia la cache del worker que hizo el cambio: en los demás un rol
+# revocado o un usuario desactivado sigue valiendo hasta AUTH_CACHE_TTL
+# segundos. Ese TTL es la cota de revocación; bajarlo si hace falta más.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_MAXSIZE = int(os.getenv("AUTH_CACHE_MAXSIZE", "10000"))
+
+pwd_context = hashing.pwd_context
 
 router = APIRouter(tags=["auth"])
 
@@ -27,6 +40,15 @@ def verify_password(password: str, hashed: str):
     return pwd_context.verify(password, hashed)
 
 
+# Versiones asíncronas: bcrypt corre en el pool de hashing, no en el event loop
+async def get_password_hash_async(password: str):
+    return await hashing.hash_password(password)
+
+
+async def verify_password_async(password: str, hashed: str):
+    return await hashing.verify_password(password, hashed)
+
+
 def create_access_token(data: dict, expires_minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=expires_minutes)
@@ -34,30 +56,89 @@ def create_access_token(data: dict, expires_minutes: int = ACCESS_TOKEN_EXPIRE_M
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+# ---------------------------------------------------------
+#   CACHE DE PRINCIPALES
+# ---------------------------------------------------------
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    email: str
+    nombre_completo: str | None
+    activo: bool
+    roles: frozenset
+
+    @property
+    def rol(self) -> str:
+        return rol_principal(self.roles)
+
+
+def rol_principal(roles) -> str:
+    """Rol que se informa al cliente (login y /users/me): el primero en
+    orden alfabético, o "paciente" si no tiene ninguno."""
+    return min(roles, default="paciente")
+
+
+principal_cache = TTLCache(maxsize=AUTH_CACHE_MAXSIZE, ttl=AUTH_CACHE_TTL)
+
+
+async def _obtener_roles(db: AsyncSession, user_id: int) -> list[str]:
+    result = await db.execute(
+        select(RolORM.nombre)
+        .join(usuario_rol_table, RolORM.id == usuario_rol_table.c.rol_id)
+        .where(usuario_rol_table.c.usuario_id == user_id)
+    )
+    return [r[0] for r in result.all()]
+
+
+def _cachear_principal(user, roles: list[str]) -> Principal:
+    # user: UsuarioORM o fila con las mismas columnas
+    principal = Principal(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        nombre_completo=user.nombre_completo,
+        activo=bool(user.activo) if user.activo is not None else True,
+        roles=frozenset(roles),
+    )
+    principal_cache.set(principal.id, principal)
+    return principal
+
+
+def invalidar_principal(user_id: int | None = None):
+    """Invalida un principal (o toda la cache si no se indica id).
+    Llamar después de cualquier escritura en usuario / usuario_rol."""
+    if user_id is None:
+        principal_cache.clear()
+    else:
+        principal_cache.invalidate(user_id)
+
+
 # ---------------------------------------------------------
 #   LOGIN
 # ---------------------------------------------------------
 @router.post("/login")
 async def login(
+    request: Request,
     email: str = Form(...),
     password: str = Form(...),
     db: AsyncSession = Depends(get_db)
 ):
+    # antes de tocar la DB o bcrypt (la sesión aún no tiene conexión)
+    await limitar_login(request, email)
 
     result = await db.execute(select(UsuarioORM).where(UsuarioORM.email == email))
     user = result.scalar_one_or_none()
 
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await verify_password_async(password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
 
     # Obtener el rol del usuario
-    result_roles = await db.execute(
-        select(RolORM.nombre)
-        .join(usuario_rol_table, RolORM.id == usuario_rol_table.c.rol_id)
-        .where(usuario_rol_table.c.usuario_id == user.id)
-    )
-    roles = [r[0] for r in result_roles.all()]
-    rol = roles[0] if roles else "paciente"
+    roles = await _obtener_roles(db, user.id)
+    rol = rol_principal(roles)
+
+    # precargar la cache para que las siguientes peticiones no consulten la DB
+    _cachear_principal(user, roles)
 
     token = create_access_token({"sub": str(user.id)})
 
@@ -69,6 +150,8 @@ async def login(
 # ---------------------------------------------------------
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
+    # un miss lee del primario: una réplica atrasada devolvería roles
+    # ya revocados y los dejaría en cache por todo el TTL
     db: AsyncSession = Depends(get_db)
 ):
     try:
@@ -77,22 +160,46 @@ async def get_current_user(
 
         if user_id is None:
             raise HTTPException(status_code=401, detail="Token inválido")
+        user_id = int(user_id)
 
-        result = await db.execute(select(UsuarioORM).where(UsuarioORM.id == int(user_id)))
-        user = result.scalar_one_or_none()
-
-    except JWTError:
+    except (JWTError, ValueError):
         raise HTTPException(status_code=401, detail="Token inválido")
 
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    # Cache miss: usuario + roles en una sola consulta y solo las columnas
+    # del principal (nada de hashed_password ni relaciones)
+    result = await db.execute(
+        select(
+            UsuarioORM.id,
+            UsuarioORM.username,
+            UsuarioORM.email,
+            UsuarioORM.nombre_completo,
+            UsuarioORM.activo,
+            func.array_remove(func.array_agg(RolORM.nombre), None).label("roles"),
+        )
+        .outerjoin(usuario_rol_table, usuario_rol_table.c.usuario_id == UsuarioORM.id)
+        .outerjoin(RolORM, RolORM.id == usuario_rol_table.c.rol_id)
+        .where(UsuarioORM.id == user_id)
+        .group_by(UsuarioORM.id)
+    )
+    user = result.first()
+
     if user is None:
         raise HTTPException(status_code=401, detail="Usuario no encontrado")
 
-    return user
+    return _cachear_principal(user, user.roles or [])
 
 
 async def get_current_active_user(
-    user: UsuarioORM = Depends(get_current_user)
+    user: Principal = Depends(get_current_user)
 ):
+    # la auditoría registra quién hizo la petición (ver audit.py)
+    audit.identificar(user)
+    if not user.activo:
+        raise HTTPException(status_code=403, detail="Usuario inactivo")
     return user
 
 
@@ -104,18 +211,10 @@ def require_role(required_roles):
         required_roles = [required_roles]  # normalizar
 
     async def checker(
-        user: UsuarioORM = Depends(get_current_active_user),
-        db: AsyncSession = Depends(get_db)
+        user: Principal = Depends(get_current_active_user)
     ):
-        q = await db.execute(
-            select(RolORM.nombre)
-            .join(usuario_rol_table, RolORM.id == usuario_rol_table.c.rol_id)
-            .where(usuario_rol_table.c.usuario_id == user.id)
-        )
-        roles_usuario = [r[0] for r in q.all()]
-
-        # validar si tiene algún rol permitido
-        if not any(r in roles_usuario for r in required_roles):
+        # los roles vienen del principal cacheado: sin consulta extra
+        if not any(r in user.roles for r in required_roles):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="No tienes permisos para acceder"
@@ -126,11 +225,58 @@ def require_role(required_roles):
     return checker
 
 
+# ---------------------------------------------------------
+#   CREAR USUARIO (usado por /auth/register-safe)
+# ---------------------------------------------------------
+async def asignar_rol(db: AsyncSession, usuario_id: int, rol: str):
+    rol_normalizado = rol.lower().strip()
+    result = await db.execute(select(RolORM).where(RolORM.nombre == rol_normalizado))
+    rol_obj = result.scalar_one_or_none()
+
+    if not rol_obj:
+        rol_obj = RolORM(nombre=rol_normalizado)
+        db.add(rol_obj)
+        await db.flush()
+
+    await db.execute(
+        insert(usuario_rol_table).values(
+            usuario_id=usuario_id,
+            rol_id=rol_obj.id
+        )
+    )
+    # cambio de roles → el principal cacheado queda obsoleto
+    invalidar_principal(usuario_id)
+    return rol_obj
+
+
+async def crear_usuario(
+    db: AsyncSession,
+    username: str,
+    email: str,
+    nombre_completo: str,
+    rol: str,
+    password: str,
+):
+    # el commit lo hace quien llama
+    new_user = UsuarioORM(
+        username=username,
+        email=email,
+        nombre_completo=nombre_completo,
+        hashed_password=await get_password_hash_async(password)
+    )
+    db.add(new_user)
+    await db.flush()
+
+    await asignar_rol(db, new_user.id, rol)
+    return new_user
+
+
 # ---------------------------------------------------------
 #   REGISTRO
 # ---------------------------------------------------------
 @router.post("/register")
 async def register_user(
+    request: Request,
     username: str = Form(...),
     email: str = Form(...),
     nombre_completo: str = Form(...),
@@ -163,6 +309,7 @@ async def register_user(
 
     db: AsyncSession = Depends(get_db)
 ):
+    await limitar_registro(request)
 
     # validar email existente
     result = await db.execute(select(UsuarioORM).where(UsuarioORM.email == email))
@@ -182,27 +329,14 @@ async def register_user(
         username=username,
         email=email,
         nombre_completo=nombre_completo_final,
-        hashed_password=get_password_hash(password)
+        hashed_password=await get_password_hash_async(password)
     )
     db.add(new_user)
     await db.flush()
 
     # asignar rol
     rol_normalizado = rol.lower().strip()
-    result = await db.execute(select(RolORM).where(RolORM.nombre == rol_normalizado))
-    rol_obj = result.scalar_one_or_none()
-
-    if not rol_obj:
-        rol_obj = RolORM(nombre=rol_normalizado)
-        db.add(rol_obj)
-        await db.flush()
-
-    await db.execute(
-        insert(usuario_rol_table).values(
-            usuario_id=new_user.id,
-            rol_id=rol_obj.id
-        )
-    )
+    await asignar_rol(db, new_user.id, rol_normalizado)
 
     # si el usuario es paciente → crear PacienteORM
     if rol_normalizado == "paciente":
@@ -239,6 +373,9 @@ async def register_user(
         )
 
         db.add(paciente)
+        await db.flush()
+        # DocumentoDuplicado → 409 (handler en main); la sesión hace rollback del alta
+        await reservar_unicos(db, paciente.id, paciente.numero_documento, new_user.id)
 
     # si el usuario es médico → crear ProfesionalORM
     elif rol_normalizado == "medico":
@@ -254,5 +391,6 @@ async def register_user(
         db.add(profesional)
 
     await db.commit()
+    invalidar_principal(new_user.id)
 
     return {"message": "Usuario registrado correctamente"}
\ No newline at end of file
@@ -0,0 +1,247 @@
+# bulk_import.py
+import os
+import csv
+import json
+import codecs
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import PacienteORM, PacienteDocumentoORM
+
+# ============================================================
+# 🔹 Importación masiva de pacientes (CSV / NDJSON → COPY)
+# ============================================================
+# El documento se reserva en paciente_documento (UNIQUE) dentro de la
+# transacción del lote, antes del COPY: dos importaciones concurrentes con
+# el mismo documento no pueden cargarlo ambas.
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+IMPORT_MAX_RECHAZOS = int(os.getenv("IMPORT_MAX_RECHAZOS", "1000"))  # detalle devuelto
+
+# Columnas que se cargan con COPY (id lo asigna la secuencia)
+CAMPOS = [
+    c.name for c in PacienteORM.__table__.columns
+    if c.name not in ("id", "usuario_id", "actualizado_en")
+]
+_IDX_DOC = CAMPOS.index("numero_documento")
+_LONGITUDES = {
+    c.name: c.type.length
+    for c in PacienteORM.__table__.columns
+    if getattr(c.type, "length", None)
+}
+
+
+class CodificacionInvalida(Exception):
+    """El cuerpo no es UTF-8 válido: 400 con la línea física del error.
+    resultado trae lo cargado hasta ahí (cada lote se confirma por separado)."""
+
+    def __init__(self, linea: int):
+        self.linea = linea
+        self.resultado = None
+
+
+async def _lineas(stream):
+    """Convierte el stream de bytes en líneas de texto sin cargarlo completo."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pendiente = ""
+    numero = 0  # líneas ya entregadas
+
+    def decodificar(chunk: bytes, final: bool = False) -> str:
+        try:
+            return decoder.decode(chunk, final=final)
+        except UnicodeDecodeError as e:
+            # pendiente no tiene saltos: la línea sale de los bytes previos al error
+            raise CodificacionInvalida(numero + e.object[:e.start].count(b"\n") + 1) from e
+
+    async for chunk in stream:
+        pendiente += decodificar(chunk)
+        *lineas, pendiente = pendiente.split("\n")
+        for linea in lineas:
+            numero += 1
+            yield linea.rstrip("\r")
+    pendiente += decodificar(b"", final=True)
+    if pendiente:
+        yield pendiente.rstrip("\r")
+
+
+async def _registros(stream, formato: str):
+    """Produce (numero_fila, dict) por cada registro. Las líneas en blanco se ignoran.
+    CSV: la primera línea es el encabezado; los campos no pueden contener saltos de línea."""
+    encabezado = None
+    fila = 0
+    async for linea in _lineas(stream):
+        if not linea.strip():
+            continue
+        if formato == "csv":
+            valores = next(csv.reader([linea]))
+            if encabezado is None:
+                encabezado = [v.strip() for v in valores]
+                continue
+            fila += 1
+            if len(valores) != len(encabezado):
+                # zip descartaría columnas de más o dejaría campos vacíos
+                yield fila, ValueError(
+                    f"La fila tiene {len(valores)} campos y el encabezado {len(encabezado)}"
+                )
+                continue
+            yield fila, dict(zip(encabezado, valores))
+        else:
+            fila += 1
+            try:
+                obj = json.loads(linea)
+            except json.JSONDecodeError as e:
+                yield fila, e
+                continue
+            yield fila, obj if isinstance(obj, dict) else ValueError("La línea no es un objeto JSON")
+
+
+def _validar(data: dict) -> tuple:
+    """Devuelve la tupla lista para COPY o lanza ValueError con el motivo."""
+    valores = []
+    for campo in CAMPOS:
+        v = data.get(campo)
+        if isinstance(v, str):
+            v = v.strip() or None
+
+        if v is not None:
+            if campo == "fecha_nacimiento":
+                try:
+                    v = datetime.strptime(str(v), "%Y-%m-%d").date()
+                except ValueError:
+                    raise ValueError(f"fecha_nacimiento inválida: {v}")
+            elif campo == "edad":
+                try:
+                    v = int(v)
+                except (TypeError, ValueError):
+                    raise ValueError(f"edad inválida: {v}")
+            else:
+                v = str(v)
+                limite = _LONGITUDES.get(campo)
+                if limite and len(v) > limite:
+                    raise ValueError(f"{campo} excede {limite} caracteres")
+        valores.append(v)
+
+    # se valida el valor normalizado: "   " se guardaría como NULL
+    if valores[_IDX_DOC] is None:
+        raise ValueError("numero_documento es obligatorio")
+    return tuple(valores)
+
+
+class ResultadoImportacion:
+    def __init__(self):
+        self.recibidos = 0
+        self.insertados = 0
+        self.total_rechazados = 0
+        self.rechazados = []
+
+    def rechazar(self, fila: int, documento, motivo: str):
+        self.total_rechazados += 1
+        if len(self.rechazados) < IMPORT_MAX_RECHAZOS:
+            self.rechazados.append({"fila": fila, "numero_documento": documento, "error": motivo})
+
+    def to_dict(self) -> dict:
+        return {
+            "recibidos": self.recibidos,
+            "insertados": self.insertados,
+            "rechazados": self.total_rechazados,
+            "detalle_rechazos": self.rechazados,
+        }
+
+
+async def _copy(db: AsyncSession, registros: list[tuple]):
+    conn = await db.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        PacienteORM.__tablename__,
+        schema_name=PacienteORM.__table__.schema,
+        columns=["id", *CAMPOS],
+        records=registros,
+    )
+
+
+async def _reservar_documentos(db: AsyncSession, candidatos: list) -> list:
+    """Asigna ids de la secuencia y reserva cada documento; devuelve
+    [(fila, doc, (id, *registro))] de los que no existían."""
+    ids = (await db.execute(
+        text("SELECT nextval('historia_clinica.paciente_id_seq') FROM generate_series(1, :n)"),
+        {"n": len(candidatos)},
+    )).scalars().all()
+    reservados = set((await db.execute(
+        pg_insert(PacienteDocumentoORM)
+        .values([{"numero_documento": doc, "paciente_id": id_} for (_, doc, _), id_ in zip(candidatos, ids)])
+        .on_conflict_do_nothing()
+        .returning(PacienteDocumentoORM.numero_documento)
+    )).scalars())
+    return [
+        (fila, doc, (id_, *registro))
+        for (fila, doc, registro), id_ in zip(candidatos, ids)
+        if doc in reservados
+    ]
+
+
+async def _procesar_lote(db: AsyncSession, lote: list, resultado: ResultadoImportacion):
+    # duplicados dentro del lote; entre lotes (y entre importaciones
+    # concurrentes) los detecta la reserva en paciente_documento
+    candidatos = []
+    vistos = set()
+    for fila, doc, registro in lote:
+        if doc in vistos:
+            resultado.rechazar(fila, doc, "numero_documento duplicado en el archivo")
+        else:
+            vistos.add(doc)
+            candidatos.append((fila, doc, registro))
+
+    if not candidatos:
+        return
+
+    try:
+        validos = await _reservar_documentos(db, candidatos)
+        if validos:
+            await _copy(db, [registro for _, _, registro in validos])
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        for fila, doc, _ in candidatos:
+            resultado.rechazar(fila, doc, f"Error al cargar el lote: {e}")
+        return
+
+    resultado.insertados += len(validos)
+    reservados = {doc for _, doc, _ in validos}
+    for fila, doc, _ in candidatos:
+        if doc not in reservados:
+            resultado.rechazar(fila, doc, "numero_documento ya existe")
+
+
+async def importar_pacientes(db: AsyncSession, stream, formato: str = "csv") -> dict:
+    """Lee el stream por lotes de IMPORT_BATCH_SIZE, valida y carga cada lote con COPY.
+    Cada lote se confirma por separado: un error de carga solo rechaza su lote."""
+    resultado = ResultadoImportacion()
+    lote = []
+
+    try:
+        async for fila, data in _registros(stream, formato):
+            resultado.recibidos += 1
+            if isinstance(data, Exception):
+                resultado.rechazar(fila, None, str(data))
+                continue
+            try:
+                registro = _validar(data)
+            except ValueError as e:
+                resultado.rechazar(fila, data.get("numero_documento"), str(e))
+                continue
+
+            lote.append((fila, registro[_IDX_DOC], registro))
+            if len(lote) >= IMPORT_BATCH_SIZE:
+                await _procesar_lote(db, lote, resultado)
+                lote = []
+    except CodificacionInvalida as e:
+        # se cargan las filas anteriores al error, como los lotes ya confirmados
+        if lote:
+            await _procesar_lote(db, lote, resultado)
+        e.resultado = resultado.to_dict()
+        raise
+
+    if lote:
+        await _procesar_lote(db, lote, resultado)
+
+    return resultado.to_dict()
@@ -0,0 +1,140 @@
+# cache.py
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+
+# ============================================================
+# 🔹 Cache en memoria con TTL + desalojo LRU (por proceso)
+# ============================================================
+class TTLCache:
+    """Cache acotada en tamaño: las entradas vencen tras `ttl` segundos
+    y, al superar `maxsize`, se desaloja la menos usada recientemente."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        if self._data.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._data)
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# ============================================================
+# 🔹 Cache de respuestas con ETag y single-flight
+# ============================================================
+class ResponseCache:
+    """Cache de respuestas ya serializadas (bytes), agrupadas por clave (p. ej.
+    paciente_id) y variante (parámetros de la consulta).
+
+    - Las misses concurrentes de la misma clave/variante se coalescen: una
+      sola corrutina calcula y las demás esperan su resultado (single-flight).
+    - Cada entrada guarda su ETag para responder 304 a GET condicionales.
+    - invalidate(clave) descarta todas las variantes; si hay un cálculo en
+      vuelo para esa clave, su resultado no se guarda (podría ser previo a la escritura).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._en_vuelo: dict = {}        # (clave, variante) → Future
+        self._sucias: set = set()        # claves invalidadas durante un cálculo
+        self.coalesced = 0
+
+    @staticmethod
+    def _con_etag(body: bytes) -> tuple[str, bytes]:
+        return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"', body
+
+    async def get_or_compute(self, clave, variante, calcular) -> tuple[str, bytes]:
+        """`calcular` es una corrutina que devuelve el cuerpo ya serializado."""
+        variantes = self._cache.get(clave)
+        if variantes is not None and variante in variantes:
+            return variantes[variante]
+
+        k = (clave, variante)
+        futuro = self._en_vuelo.get(k)
+        if futuro is not None:
+            self.coalesced += 1
+            return await asyncio.shield(futuro)
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[k] = futuro
+        try:
+            entrada = self._con_etag(await calcular())
+        except BaseException as e:
+            futuro.set_exception(e)
+            futuro.exception()  # evita "exception was never retrieved" si nadie espera
+            raise
+        finally:
+            del self._en_vuelo[k]
+
+        if clave not in self._sucias:
+            variantes = self._cache.get(clave) or {}
+            variantes[variante] = entrada
+            self._cache.set(clave, variantes)
+        if not any(c == clave for c, _ in self._en_vuelo):
+            self._sucias.discard(clave)
+
+        futuro.set_result(entrada)
+        return entrada
+
+    def invalidate(self, clave):
+        self._cache.invalidate(clave)
+        if any(c == clave for c, _ in self._en_vuelo):
+            self._sucias.add(clave)
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), "coalesced": self.coalesced, "in_flight": len(self._en_vuelo)}
+
+
+def etag_coincide(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    etiquetas = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+    return "*" in etiquetas or etag in etiquetas
@@ -1,21 +1,416 @@
+import base64
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from models import PacienteORM
+from collections import defaultdict
+from sqlalchemy import select, insert, update, tuple_, text, func, case, or_, values, column, Integer, Boolean
+from models import (
+    PacienteORM, ObservacionORM, AtencionORM, CierreHistoriaORM,
+    PacienteDocumentoORM, PacienteUsuarioORM, paciente_nombre_busqueda,
+)
 from datetime import datetime
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+import rollup
+
+
+# ---------------------------------------------------------
+#   CURSORES (paginación keyset sobre (fecha, id))
+# ---------------------------------------------------------
+def encode_cursor(fecha: datetime | None, id_: int) -> str:
+    raw = f"{fecha.isoformat() if fecha else ''}|{id_}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        fecha_str, id_str = raw.split("|", 1)
+        return (datetime.fromisoformat(fecha_str) if fecha_str else None), int(id_str)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
+
 
 async def get_paciente(db: AsyncSession, paciente_id: int):
     result = await db.execute(select(PacienteORM).where(PacienteORM.id == paciente_id))
     return result.scalars().first()
 
+def _escapar_like(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def buscar_pacientes(db: AsyncSession, q: str, limit: int = 20):
+    """Búsqueda para admisión: prefijo en documento/teléfonos y similitud
+    de trigramas (pg_trgm) sobre el nombre completo. Resultados ordenados por score."""
+    q = q.strip()
+    if len(q) < 2:
+        return []
+    termino = q.lower()
+    prefijo = _escapar_like(q) + "%"
+
+    doc_prefijo = PacienteORM.numero_documento.like(prefijo, escape="\\")
+    tel_prefijo = or_(
+        PacienteORM.telefono.like(prefijo, escape="\\"),
+        PacienteORM.celular.like(prefijo, escape="\\"),
+    )
+    # nombre %> termino  ⇔  word_similarity(termino, nombre) >= umbral (usa el índice GIN)
+    nombre_similar = paciente_nombre_busqueda.op("%>")(termino)
+
+    score = case(
+        (PacienteORM.numero_documento == q, 3.0),
+        (doc_prefijo, 2.0),
+        (tel_prefijo, 1.5),
+        else_=func.word_similarity(termino, paciente_nombre_busqueda),
+    ).label("score")
+
+    result = await db.execute(
+        select(
+            PacienteORM.id,
+            PacienteORM.tipo_documento,
+            PacienteORM.numero_documento,
+            PacienteORM.primer_nombre,
+            PacienteORM.segundo_nombre,
+            PacienteORM.primer_apellido,
+            PacienteORM.segundo_apellido,
+            PacienteORM.fecha_nacimiento,
+            PacienteORM.telefono,
+            PacienteORM.celular,
+            score,
+        )
+        .where(or_(doc_prefijo, tel_prefijo, nombre_similar))
+        .order_by(score.desc(), PacienteORM.id)
+        .limit(limit)
+    )
+    return [dict(r._mapping) for r in result.all()]
+
+
 async def agregar_observacion(db: AsyncSession, paciente_id: int, observacion: str, usuario_nombre: str):
-    paciente = await get_paciente(db, paciente_id)
-    if not paciente:
+    # Un solo INSERT de costo constante; la FK a paciente detecta ids inexistentes
+    try:
+        result = await db.execute(
+            insert(ObservacionORM)
+            .values(paciente_id=paciente_id, autor=usuario_nombre, texto=observacion)
+            .returning(ObservacionORM.id)
+        )
+        obs_id = result.scalar_one()
+        await db.commit()
+        return obs_id
+    except IntegrityError:
+        await db.rollback()
         return None
-    nueva_obs = f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M')} - {usuario_nombre}]\n{observacion}"
-    paciente.observaciones = (paciente.observaciones or "") + nueva_obs
+
+
+async def listar_observaciones(db: AsyncSession, paciente_id: int, limit: int = 20, cursor: str | None = None):
+    """Página de observaciones, más recientes primero. Devuelve (items, next_cursor)."""
+    q = (
+        select(ObservacionORM.id, ObservacionORM.fecha_hora, ObservacionORM.autor, ObservacionORM.texto)
+        .where(ObservacionORM.paciente_id == paciente_id)
+        .order_by(ObservacionORM.fecha_hora.desc(), ObservacionORM.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        fecha, id_ = decode_cursor(cursor)
+        q = q.where(tuple_(ObservacionORM.fecha_hora, ObservacionORM.id) < tuple_(fecha, id_))
+
+    rows = (await db.execute(q)).all()
+    items = [dict(r._mapping) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.fecha_hora, last.id)
+    return items, next_cursor
+
+# Columnas del listado de atenciones: sin los campos de texto clínico largos
+ATENCION_RESUMEN = (
+    AtencionORM.id,
+    AtencionORM.paciente_id,
+    AtencionORM.fecha_hora_atencion,
+    AtencionORM.tipo_atencion,
+)
+
+
+async def listar_atenciones(db: AsyncSession, paciente_id: int, limit: int = 20, cursor: str | None = None):
+    """Resumen de atenciones, más recientes primero, paginado por (fecha_hora_atencion, id).
+    Las atenciones sin fecha van al final (NULLS LAST, como ix_atencion_paciente_fecha).
+    Siempre filtra por paciente_id (columna de distribución) → un solo shard."""
+    fecha_col = AtencionORM.fecha_hora_atencion
+    q = (
+        select(*ATENCION_RESUMEN)
+        .where(AtencionORM.paciente_id == paciente_id)
+        .order_by(fecha_col.desc().nulls_last(), AtencionORM.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        fecha, id_ = decode_cursor(cursor)
+        if fecha is None:
+            # ya en el tramo sin fecha: solo queda seguir por id
+            q = q.where(fecha_col.is_(None), AtencionORM.id < id_)
+        else:
+            # una comparación de tuplas con NULL no es verdadera: sin el
+            # OR las atenciones sin fecha nunca aparecerían
+            q = q.where(or_(tuple_(fecha_col, AtencionORM.id) < tuple_(fecha, id_), fecha_col.is_(None)))
+
+    rows = (await db.execute(q)).all()
+    items = [dict(r._mapping) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.fecha_hora_atencion, last.id)
+    return items, next_cursor
+
+
+async def get_atencion(db: AsyncSession, paciente_id: int, atencion_id: int):
+    result = await db.execute(
+        select(AtencionORM).where(
+            AtencionORM.paciente_id == paciente_id,
+            AtencionORM.id == atencion_id,
+        )
+    )
+    return result.scalars().first()
+
+
+async def _agrupar_por_shard(db: AsyncSession, paciente_ids: set[int]) -> dict[int, int]:
+    """paciente_id → shard de atencion. Sin Citus (PostgreSQL local) todo cae en un grupo."""
+    try:
+        async with db.begin_nested():
+            result = await db.execute(
+                text(
+                    "SELECT p, get_shard_id_for_distribution_column('historia_clinica.atencion', p) "
+                    "FROM unnest(CAST(:ids AS int[])) AS p"
+                ),
+                {"ids": list(paciente_ids)},
+            )
+            return dict(result.all())
+    except SQLAlchemyError:
+        return {p: 0 for p in paciente_ids}
+
+
+ATENCION_CAMPOS = (
+    "paciente_id", "fecha_hora_atencion", "tipo_atencion", "motivo_consulta",
+    "enfermedad_actual", "antecedentes_personales", "antecedentes_familiares",
+    "alergias", "habitos",
+)
+
+
+async def _ids_atencion(db: AsyncSession, n: int) -> list[int]:
+    """n ids de la secuencia de atencion en un solo viaje."""
+    if not n:
+        return []
+    result = await db.execute(
+        text("SELECT nextval('historia_clinica.atencion_id_seq') FROM generate_series(1, :n)"),
+        {"n": n},
+    )
+    return result.scalars().all()
+
+
+async def _insertar_atenciones(db: AsyncSession, filas: list[dict]):
+    """Un INSERT multi-fila. Devuelve las filas (id, paciente_id, version) creadas."""
+    tabla = AtencionORM.__table__
+    result = await db.execute(
+        insert(tabla).values(filas).returning(tabla.c.id, tabla.c.paciente_id, tabla.c.version)
+    )
+    return result.all()
+
+
+async def _editar_atenciones(db: AsyncSession, filas: list[dict]):
+    """Un solo UPDATE atencion ... FROM (VALUES ...) AS v para todas las filas,
+    con la versión leída por el cliente en el predicado. Cada fila trae solo
+    los campos que el cliente envió: los que faltan en alguna fila llevan una
+    bandera en VALUES y conservan su valor actual. Devuelve las filas
+    (id, paciente_id, version) que se actualizaron."""
+    tabla = AtencionORM.__table__
+    campos = [c for c in ATENCION_CAMPOS if c != "paciente_id" and any(c in f for f in filas)]
+    parciales = [c for c in campos if not all(c in f for f in filas)]
+    v = values(
+        column("id", Integer), column("paciente_id", Integer), column("version", Integer),
+        *(column(c, tabla.c[c].type) for c in campos),
+        *(column(f"enviado_{c}", Boolean) for c in parciales),
+        name="v",
+    ).data([
+        (f["id"], f["paciente_id"], f["version"], *(f.get(c) for c in campos), *(c in f for c in parciales))
+        for f in filas
+    ])
+    result = await db.execute(
+        update(tabla)
+        .where(
+            tabla.c.id == v.c.id,
+            tabla.c.paciente_id == v.c.paciente_id,
+            tabla.c.version == v.c.version,
+            # filtro explícito por la columna de distribución: Citus poda al shard del grupo
+            tabla.c.paciente_id.in_({f["paciente_id"] for f in filas}),
+        )
+        .values(
+            **{
+                c: case((v.c[f"enviado_{c}"], v.c[c]), else_=tabla.c[c]) if c in parciales else v.c[c]
+                for c in campos
+            },
+            version=tabla.c.version + 1,
+        )
+        .returning(tabla.c.id, tabla.c.paciente_id, tabla.c.version)
+    )
+    return result.all()
+
+
+async def _versiones_atencion(db: AsyncSession, claves: list[tuple[int, int]]) -> dict[tuple[int, int], int]:
+    """(id, paciente_id) → versión actual, para las claves que existen."""
+    result = await db.execute(
+        select(AtencionORM.id, AtencionORM.paciente_id, AtencionORM.version).where(
+            tuple_(AtencionORM.id, AtencionORM.paciente_id).in_(claves),
+            AtencionORM.paciente_id.in_({p for _, p in claves}),
+        )
+    )
+    return {(r.id, r.paciente_id): r.version for r in result.all()}
+
+
+async def upsert_atenciones(db: AsyncSession, items: list) -> list[dict]:
+    """Lote de AtencionIn, agrupado por shard: los items sin id se insertan
+    con un INSERT multi-fila y los que traen id se actualizan con un único
+    UPDATE ... FROM (VALUES ...) por grupo, que exige la versión leída y
+    solo toca los campos enviados. Una versión vieja se informa como
+    "conflicto" con la versión actual; un id que no existe para ese paciente,
+    como "no_encontrado": nunca se inserta con un id del cliente.
+    Devuelve el resultado de cada item en el mismo orden recibido."""
+    resultados: list[dict | None] = [None] * len(items)
+    shards = await _agrupar_por_shard(db, {it.paciente_id for it in items})
+
+    # ids para las atenciones nuevas en un solo viaje: así cada fila de
+    # RETURNING se empareja por (id, paciente_id) sin depender del orden
+    ids_nuevos = iter(await _ids_atencion(db, sum(1 for it in items if it.id is None)))
+
+    grupos = defaultdict(lambda: ([], []))
+    for idx, it in enumerate(items):
+        altas, ediciones = grupos[shards[it.paciente_id]]
+        if it.id is None:
+            fila = {c: getattr(it, c) for c in ATENCION_CAMPOS}
+            fila["id"] = next(ids_nuevos)
+            altas.append((idx, fila))
+        else:
+            # un campo omitido no se pisa con NULL
+            fila = {c: getattr(it, c) for c in ATENCION_CAMPOS if c in it.model_fields_set}
+            fila.update(id=it.id, paciente_id=it.paciente_id, version=it.version)
+            ediciones.append((idx, fila))
+
+    # las existentes pueden cambiar de fecha: su día actual también se recalcula
+    existentes = [(it.id, it.paciente_id) for it in items if it.id is not None]
+    if existentes:
+        await db.execute(rollup.marcar_dias(tuple_(AtencionORM.id, AtencionORM.paciente_id).in_(existentes)))
+
+    for altas, ediciones in grupos.values():
+        estados = {}
+        try:
+            async with db.begin_nested():
+                if altas:
+                    rows = await _insertar_atenciones(db, [fila for _, fila in altas])
+                    estados.update({(r.id, r.paciente_id): ("creado", r.version) for r in rows})
+                if ediciones:
+                    rows = await _editar_atenciones(db, [fila for _, fila in ediciones])
+                    estados.update({(r.id, r.paciente_id): ("actualizado", r.version) for r in rows})
+                    # camino raro: distinguir "no existe" de "otro la modificó"
+                    faltan = [(f["id"], f["paciente_id"]) for _, f in ediciones
+                              if (f["id"], f["paciente_id"]) not in estados]
+                    if faltan:
+                        actuales = await _versiones_atencion(db, faltan)
+                        estados.update({clave: ("conflicto", v) for clave, v in actuales.items()})
+        except SQLAlchemyError as e:
+            for idx, fila in altas + ediciones:
+                resultados[idx] = {
+                    "indice": idx, "atencion_id": fila["id"], "paciente_id": fila["paciente_id"],
+                    "estado": "error", "error": str(getattr(e, "orig", e)),
+                }
+            continue
+
+        for idx, fila in altas + ediciones:
+            estado, version = estados.get((fila["id"], fila["paciente_id"]), ("no_encontrado", None))
+            resultados[idx] = {
+                "indice": idx, "atencion_id": fila["id"], "paciente_id": fila["paciente_id"],
+                "estado": estado, "version": version,
+            }
+
     await db.commit()
-    return paciente
+    return resultados
+
+
+# ---------------------------------------------------------
+#   ACTUALIZACIÓN CON CONCURRENCIA OPTIMISTA
+# ---------------------------------------------------------
+class ConflictoVersion(Exception):
+    """La fila cambió desde que el cliente la leyó: 409 con la versión actual."""
+
+    def __init__(self, recurso: str, version_actual: int):
+        self.recurso = recurso
+        self.version_actual = version_actual
+
+
+async def _actualizar_versionada(db: AsyncSession, modelo, paciente_id: int, fila_id: int,
+                                 version: int, valores: dict) -> int | None:
+    """Un solo UPDATE ... WHERE id AND paciente_id AND version RETURNING version.
+    paciente_id en el filtro → Citus lo enruta a un solo shard.
+    Devuelve la nueva versión, None si la fila no existe o lanza ConflictoVersion."""
+    tabla = modelo.__table__
+    clave = (tabla.c.id == fila_id, tabla.c.paciente_id == paciente_id)
+    nueva = (await db.execute(
+        update(tabla)
+        .where(*clave, tabla.c.version == version)
+        .values(**valores, version=tabla.c.version + 1)
+        .returning(tabla.c.version)
+    )).scalar()
+    if nueva is not None:
+        return nueva
+
+    # camino raro: distinguir "no existe" de "otro la modificó"
+    actual = (await db.execute(select(tabla.c.version).where(*clave))).scalar()
+    if actual is None:
+        return None
+    raise ConflictoVersion(modelo.__tablename__, actual)
+
+
+async def actualizar_atencion(db: AsyncSession, paciente_id: int, atencion_id: int,
+                              version: int, valores: dict) -> int | None:
+    # actualizado_en (onupdate) marca el día para el rollup incremental (rollup.py);
+    # si cambia la fecha, el día que deja se registra antes del UPDATE
+    if "fecha_hora_atencion" in valores:
+        await db.execute(rollup.marcar_dias(AtencionORM.id == atencion_id, AtencionORM.paciente_id == paciente_id))
+    return await _actualizar_versionada(db, AtencionORM, paciente_id, atencion_id, version, valores)
+
+
+async def actualizar_cierre_historia(db: AsyncSession, paciente_id: int, cierre_id: int,
+                                     version: int, valores: dict) -> int | None:
+    return await _actualizar_versionada(db, CierreHistoriaORM, paciente_id, cierre_id, version, valores)
+
+
+async def get_cierre_historia(db: AsyncSession, paciente_id: int, cierre_id: int):
+    result = await db.execute(
+        select(CierreHistoriaORM).where(
+            CierreHistoriaORM.paciente_id == paciente_id,
+            CierreHistoriaORM.id == cierre_id,
+        )
+    )
+    return result.scalars().first()
+
+
+# ---------------------------------------------------------
+#   UNICIDAD DE DOCUMENTO Y USUARIO DEL PACIENTE
+# ---------------------------------------------------------
+class DocumentoDuplicado(Exception):
+    """El documento (o el usuario) ya pertenece a otro paciente: 409."""
+
+    def __init__(self, campo: str):
+        self.campo = campo
+
+
+async def reservar_unicos(db: AsyncSession, paciente_id: int, numero_documento: str | None,
+                          usuario_id: int | None = None):
+    """Inserta las claves únicas del paciente en sus tablas de búsqueda, en la
+    transacción del paciente: un duplicado lanza DocumentoDuplicado y el
+    llamador hace rollback del alta completa."""
+    for campo, modelo, valor in (
+        ("numero_documento", PacienteDocumentoORM, numero_documento),
+        ("usuario_id", PacienteUsuarioORM, usuario_id),
+    ):
+        if valor is None:
+            continue
+        try:
+            await db.execute(insert(modelo).values({campo: valor, "paciente_id": paciente_id}))
+        except IntegrityError as e:
+            raise DocumentoDuplicado(campo) from e
+
 
 async def crear_paciente(db: AsyncSession, data: dict):
     try:
@@ -53,12 +448,18 @@ async def crear_paciente(db: AsyncSession, data: dict):
             entidad_pertenece=data.get("entidad_pertenece"),
             regimen_afiliacion=data.get("regimen_afiliacion"),
             tipo_usuario=data.get("tipo_usuario"),
-            observaciones=data.get("observaciones"),
         )
         db.add(paciente)
+        await db.flush()
+        await reservar_unicos(db, paciente.id, paciente.numero_documento)
+        if data.get("observaciones"):
+            db.add(ObservacionORM(paciente_id=paciente.id, texto=data["observaciones"]))
         await db.commit()
         await db.refresh(paciente)
         return paciente
+    except DocumentoDuplicado:
+        await db.rollback()
+        raise
     except SQLAlchemyError as e:
         await db.rollback()
         print(f"Error al crear paciente: {e}")
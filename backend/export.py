@@ -0,0 +1,113 @@
+# export.py
+import io
+import os
+import csv
+import json
+from datetime import date, datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import PacienteORM, AtencionORM, CierreHistoriaORM
+
+# ============================================================
+# 🔹 Exportación de historias clínicas (streaming NDJSON / CSV)
+# ============================================================
+# Una fila por atención (y por cierre, si tiene varios); el paciente sin
+# atenciones sale en una sola fila con esas columnas vacías. Se lee con un
+# cursor del lado del servidor en lotes de EXPORT_BATCH_SIZE y cada lote se
+# envía como un chunk: la memoria no depende del tamaño de la historia.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Lista explícita de columnas clínicas: las de control interno (usuario_id,
+# version, actualizado_en) y las claves de unión repetidas no se exportan,
+# y una columna nueva del modelo no sale hasta agregarla aquí
+_CAMPOS = (
+    ("paciente", PacienteORM, (
+        "id", "tipo_documento", "numero_documento",
+        "primer_apellido", "segundo_apellido", "primer_nombre", "segundo_nombre",
+        "fecha_nacimiento", "edad", "sexo", "genero", "grupo_sanguineo", "factor_rh",
+        "estado_civil", "direccion_residencia", "municipio_ciudad", "departamento",
+        "telefono", "celular", "correo_electronico", "ocupacion",
+        "entidad_pertenece", "regimen_afiliacion", "tipo_usuario",
+    )),
+    ("atencion", AtencionORM, (
+        "id", "fecha_hora_atencion", "tipo_atencion", "motivo_consulta", "enfermedad_actual",
+        "antecedentes_personales", "antecedentes_familiares", "alergias", "habitos",
+    )),
+    ("cierre", CierreHistoriaORM, (
+        "id", "firma_paciente", "fecha_hora_cierre", "responsable_registro",
+    )),
+)
+
+COLUMNAS = [
+    (prefijo, modelo.__table__.c[nombre])
+    for prefijo, modelo, nombres in _CAMPOS
+    for nombre in nombres
+]
+ENCABEZADO = [f"{prefijo}.{c.name}" for prefijo, c in COLUMNAS]
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _consulta(paciente_id: int | None, entidad: str | None):
+    # atencion y cierre_historia están colocadas con paciente: el JOIN por
+    # paciente_id se resuelve dentro de cada shard
+    stmt = (
+        select(*[c for _, c in COLUMNAS])
+        .select_from(PacienteORM)
+        .outerjoin(AtencionORM, AtencionORM.paciente_id == PacienteORM.id)
+        .outerjoin(
+            CierreHistoriaORM,
+            (CierreHistoriaORM.paciente_id == AtencionORM.paciente_id)
+            & (CierreHistoriaORM.atencion_id == AtencionORM.id),
+        )
+        .order_by(
+            PacienteORM.id,
+            AtencionORM.fecha_hora_atencion,
+            AtencionORM.id,
+            CierreHistoriaORM.id,
+        )
+    )
+    if paciente_id is not None:
+        stmt = stmt.where(PacienteORM.id == paciente_id)
+    if entidad is not None:
+        stmt = stmt.where(PacienteORM.entidad_pertenece == entidad)
+    return stmt
+
+
+def _valor(v):
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    return v
+
+
+def _lote_ndjson(filas) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(ENCABEZADO, map(_valor, fila))), ensure_ascii=False) + "\n"
+        for fila in filas
+    ).encode()
+
+
+def _lote_csv(filas, encabezado: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if encabezado:
+        writer.writerow(ENCABEZADO)
+    writer.writerows([_valor(v) for v in fila] for fila in filas)
+    return buffer.getvalue().encode()
+
+
+async def exportar_historias(
+    db: AsyncSession, formato: str, paciente_id: int | None = None, entidad: str | None = None
+):
+    """Generador asíncrono de chunks (bytes) para un StreamingResponse."""
+    if formato == "csv":
+        yield _lote_csv([], encabezado=True)
+
+    result = await db.stream(
+        _consulta(paciente_id, entidad).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    async for filas in result.partitions():
+        yield _lote_ndjson(filas) if formato == "ndjson" else _lote_csv(filas)
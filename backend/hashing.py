@@ -0,0 +1,103 @@
+# hashing.py
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from passlib.context import CryptContext
+
+# ============================================================
+# 🔹 Configuración del pool de hashing (bcrypt fuera del event loop)
+# ============================================================
+HASH_POOL_KIND = os.getenv("HASH_POOL_KIND", "thread")        # thread | process
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_POOL_MAX_PENDING = int(os.getenv("HASH_POOL_MAX_PENDING", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class HashPoolSaturado(Exception):
+    """La cola del pool de hashing está llena: se responde 503 sin esperar."""
+
+
+# Funciones a nivel de módulo para que sean serializables en ProcessPoolExecutor
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+_executor = None
+_pending = 0
+_lock = threading.Lock()
+_stats = {"submitted": 0, "completed": 0, "rejected": 0, "max_pending_seen": 0}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        if HASH_POOL_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=HASH_POOL_WORKERS, thread_name_prefix="bcrypt"
+            )
+    return _executor
+
+
+def _liberar(_futuro):
+    global _pending
+    with _lock:
+        _pending -= 1
+        _stats["completed"] += 1
+
+
+async def _run(fn, *args):
+    global _pending
+    # cola acotada: trabajos en ejecución + en espera
+    with _lock:
+        if _pending >= HASH_POOL_MAX_PENDING:
+            _stats["rejected"] += 1
+            raise HashPoolSaturado()
+        _pending += 1
+        _stats["submitted"] += 1
+        _stats["max_pending_seen"] = max(_stats["max_pending_seen"], _pending)
+
+    try:
+        futuro = _get_executor().submit(fn, *args)
+    except BaseException:
+        _liberar(None)
+        raise
+    # el lugar se libera cuando termina el trabajo, no cuando deja de
+    # esperarlo la petición: si el cliente corta, bcrypt sigue ocupando el
+    # hilo hasta terminar (un trabajo aún en cola sí se cancela). El
+    # callback corre en el hilo del pool, de ahí el lock.
+    futuro.add_done_callback(_liberar)
+    return await asyncio.wrap_future(futuro)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await _run(_verify, password, hashed)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def stats() -> dict:
+    return {
+        "kind": HASH_POOL_KIND,
+        "workers": HASH_POOL_WORKERS,
+        "max_pending": HASH_POOL_MAX_PENDING,
+        "queue_depth": max(0, _pending - HASH_POOL_WORKERS),
+        "in_flight": _pending,
+        **_stats,
+    }
@@ -0,0 +1,141 @@
+# health.py
+import os
+import time
+import asyncio
+from sqlalchemy import text
+from database import (
+    DATABASE_URL, build_engine, engine_config, pool_stats, read_engines,
+    replica_health, DB_REPLICA_MAX_LAG_S,
+)
+import metrics
+
+# ============================================================
+# 🔹 Liveness / readiness con muestreo en segundo plano
+# ============================================================
+# /livez no toca nada: si el event loop responde, el proceso está vivo.
+# /readyz devuelve la última foto tomada por muestrear(), que corre cada
+# HEALTH_CHECK_INTERVAL segundos. Así el costo de un probe es leer un dict
+# y los probes del kubelet no compiten por el pool bajo carga.
+#
+# El muestreo usa su propio engine de una conexión: un pool de la app
+# saturado no se confunde con una base caída (se informa aparte).
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "5"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+# una foto más vieja que esto implica que el muestreo se colgó → no listo
+HEALTH_STALE_AFTER = float(os.getenv("HEALTH_STALE_AFTER", str(HEALTH_CHECK_INTERVAL * 3)))
+
+health_engine = build_engine(DATABASE_URL, {
+    **engine_config,
+    "echo": False,
+    "pool_size": 1,
+    "max_overflow": 0,
+    "pool_timeout": HEALTH_CHECK_TIMEOUT,
+})
+
+# Alcance de los workers de Citus medido desde el coordinador. En un
+# PostgreSQL sin Citus la función no existe y se informa citus=False.
+_WORKERS_SQL = text(
+    "SELECT nodename, nodeport, success, result "
+    "FROM run_command_on_workers('SELECT 1')"
+)
+
+_snapshot: dict | None = None
+_drenando = False
+
+metrics.definir("health_ready", "gauge", "1 si la última foto de salud está lista")
+metrics.definir("health_check_seconds", "gauge", "Duración del último muestreo de salud")
+
+
+async def _coordinador_y_workers() -> tuple[dict, dict]:
+    inicio = time.perf_counter()
+    async with health_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+        coordinador = {"ok": True, "latency_ms": round((time.perf_counter() - inicio) * 1000, 2), "error": None}
+        try:
+            async with conn.begin_nested():
+                filas = (await conn.execute(_WORKERS_SQL)).all()
+        except Exception as e:
+            if "run_command_on_workers" not in str(e):
+                raise
+            return coordinador, {"citus": False, "ok": True, "nodes": []}
+    nodos = [
+        {"node": f"{f.nodename}:{f.nodeport}", "ok": bool(f.success),
+         "error": None if f.success else f.result}
+        for f in filas
+    ]
+    return coordinador, {"citus": True, "ok": all(n["ok"] for n in nodos), "nodes": nodos}
+
+
+async def muestrear() -> dict:
+    """Toma una foto completa de la salud de la base y la deja publicada."""
+    global _snapshot
+    inicio = time.perf_counter()
+    try:
+        coordinador, workers = await asyncio.wait_for(_coordinador_y_workers(), HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        error = "timeout" if isinstance(e, asyncio.TimeoutError) else str(e)
+        coordinador = {"ok": False, "latency_ms": None, "error": error}
+        workers = {"citus": None, "ok": False, "nodes": []}
+
+    # las réplicas las muestrea monitor_replicas(); aquí solo se resumen
+    replicas = [{"replica": i, **h} for i, h in replica_health.items()]
+    pool = pool_stats()
+    listo = coordinador["ok"] and workers["ok"]
+    degradado = any(not r["healthy"] for r in replicas) or (
+        pool["checked_out"] >= pool["size"] + pool["max_overflow"]
+    )
+
+    _snapshot = {
+        "status": "fail" if not listo else "degraded" if degradado else "ok",
+        "ready": listo,
+        "checked_at": time.time(),
+        "duration_ms": round((time.perf_counter() - inicio) * 1000, 2),
+        "coordinator": coordinador,
+        "workers": workers,
+        "replication": {"max_lag_s": DB_REPLICA_MAX_LAG_S, "replicas": replicas},
+        "pool": {"primary": pool, "replicas": [pool_stats(e) for e in read_engines]},
+    }
+    return _snapshot
+
+
+@metrics.register_collector
+def _health_gauges():
+    if _snapshot is None:
+        return []
+    return [
+        ("health_ready", {}, 1 if _snapshot["ready"] else 0),
+        ("health_check_seconds", {}, _snapshot["duration_ms"] / 1000),
+    ]
+
+
+async def monitor_salud():
+    """Tarea de fondo: refresca la foto cada HEALTH_CHECK_INTERVAL."""
+    while True:
+        try:
+            await muestrear()
+        except Exception as e:  # un fallo inesperado no debe matar el muestreo
+            print(f"⚠️ Muestreo de salud falló: {e}")
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+
+def marcar_drenando():
+    """Desde el shutdown: /readyz pasa a 503 mientras se drena."""
+    global _drenando
+    _drenando = True
+
+
+def readiness() -> tuple[int, dict]:
+    """(status_code, cuerpo) de /readyz a partir de la última foto, sin I/O."""
+    if _drenando:
+        return 503, {"status": "draining", "ready": False}
+    if _snapshot is None:
+        return 503, {"status": "starting", "ready": False}
+    edad = time.time() - _snapshot["checked_at"]
+    cuerpo = {**_snapshot, "age_s": round(edad, 2)}
+    if edad > HEALTH_STALE_AFTER:
+        return 503, {**cuerpo, "status": "stale", "ready": False}
+    return (200 if _snapshot["ready"] else 503), cuerpo
+
+
+async def shutdown():
+    await health_engine.dispose()
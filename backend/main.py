@@ -1,18 +1,48 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from asyncpg import UniqueViolationError
-from datetime import datetime
+from datetime import datetime, date, timedelta
 
 from fastapi.templating import Jinja2Templates
 # from fastapi.staticfiles import StaticFiles  # ❌ Ya no necesitamos esto
 
-from database import get_db, engine
-from auth import router as auth_router, get_current_active_user, require_role
-from crud import get_paciente, agregar_observacion, crear_paciente  # <-- agregar crear_paciente
-from schemas import Token, UsuarioResponse
-from models import UsuarioORM
+import os
+import asyncio
+from database import (
+    get_db, get_read_db, engine, read_engines, describe_engine_config, pool_stats,
+    routing_stats, monitor_replicas, ReadYourWritesMiddleware, lectura_en_primario,
+)
+from auth import (
+    router as auth_router, get_current_active_user, require_role,
+    Principal, principal_cache, invalidar_principal,
+)
+from crud import (
+    get_paciente, agregar_observacion, crear_paciente, listar_observaciones,
+    listar_atenciones, get_atencion, get_cierre_historia, upsert_atenciones,
+    buscar_pacientes, actualizar_atencion, actualizar_cierre_historia, ConflictoVersion,
+    DocumentoDuplicado,
+)
+from models import AtencionORM, CierreHistoriaORM
+from cache import ResponseCache, etag_coincide
+import hashing
+import metrics
+from query_budget import budget
+from bulk_import import importar_pacientes, CodificacionInvalida
+from export import exportar_historias, FORMATOS as FORMATOS_EXPORT
+import pdf_export
+import rate_limit
+import health
+import audit
+import rollup
+from schemas import (
+    UsuarioResponse, AtencionIn, PacienteResponse, PacienteDetalle, PacienteBusqueda,
+    AtencionPagina, AtencionResumen, AtencionResponse, CierreHistoriaResponse, DashboardAtenciones,
+)
+from respuestas import campos_parciales, json_bytes, respuesta_json
+from pydantic import ValidationError
 from fastapi import Form
 
 # ==========================================================
@@ -35,20 +65,165 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Lecturas a réplicas con read-your-writes tras una escritura
+app.add_middleware(ReadYourWritesMiddleware)
+
+# Auditoría de accesos a historias: eventos a una cola, volcado por lotes
+app.add_middleware(audit.AuditMiddleware)
+
+# Métricas: latencia por ruta, peticiones en curso y tiempo de DB
+app.add_middleware(metrics.MetricsMiddleware)
+for _eng in [engine, *read_engines]:
+    metrics.instrument_engine(_eng)
+
+# Cache de la ficha del paciente (GET /pacientes/{id}), por worker.
+# Las escrituras de este worker la invalidan; el TTL acota lo que puede
+# quedar desactualizado en los demás.
+paciente_cache = ResponseCache(
+    maxsize=int(os.getenv("PACIENTE_CACHE_MAXSIZE", "5000")),
+    ttl=float(os.getenv("PACIENTE_CACHE_TTL", "10")),
+)
+
+
+@metrics.register_collector
+def _stats_gauges():
+    cache = principal_cache.stats()
+    cache_paciente = paciente_cache.stats()
+    pool_hash = hashing.stats()
+    pool_db = pool_stats()
+    pdf = pdf_export.stats()
+    return [
+        ("auth_cache_hits_total", {}, cache["hits"]),
+        ("auth_cache_misses_total", {}, cache["misses"]),
+        ("auth_cache_size", {}, cache["size"]),
+        ("paciente_cache_hits_total", {}, cache_paciente["hits"]),
+        ("paciente_cache_misses_total", {}, cache_paciente["misses"]),
+        ("paciente_cache_coalesced_total", {}, cache_paciente["coalesced"]),
+        ("paciente_cache_size", {}, cache_paciente["size"]),
+        ("hash_pool_queue_depth", {}, pool_hash["queue_depth"]),
+        ("hash_pool_in_flight", {}, pool_hash["in_flight"]),
+        ("hash_pool_rejected_total", {}, pool_hash["rejected"]),
+        ("pdf_jobs_in_flight", {}, pdf["in_flight"]),
+        ("pdf_cache_hits_total", {}, pdf["cache_hits"]),
+        ("pdf_rendered_total", {}, pdf["rendered"]),
+        ("pdf_failed_total", {}, pdf["failed"]),
+        ("db_pool_checked_out", {}, pool_db["checked_out"]),
+        ("db_pool_overflow", {}, pool_db["overflow"]),
+    ]
+
+
+metrics.definir("auth_cache_hits_total", "counter", "Aciertos de la cache de principales")
+metrics.definir("auth_cache_misses_total", "counter", "Fallos de la cache de principales")
+metrics.definir("auth_cache_size", "gauge", "Principales en cache")
+metrics.definir("paciente_cache_hits_total", "counter", "Aciertos de la cache de pacientes")
+metrics.definir("paciente_cache_misses_total", "counter", "Fallos de la cache de pacientes")
+metrics.definir("paciente_cache_coalesced_total", "counter", "Lecturas de paciente coalescidas (single-flight)")
+metrics.definir("paciente_cache_size", "gauge", "Pacientes en cache")
+metrics.definir("hash_pool_queue_depth", "gauge", "Trabajos bcrypt esperando worker")
+metrics.definir("hash_pool_in_flight", "gauge", "Trabajos bcrypt en curso o en cola")
+metrics.definir("hash_pool_rejected_total", "counter", "Trabajos bcrypt rechazados (503)")
+metrics.definir("pdf_jobs_in_flight", "gauge", "PDFs en cola o renderizándose")
+metrics.definir("pdf_cache_hits_total", "counter", "Solicitudes de PDF servidas desde disco")
+metrics.definir("pdf_rendered_total", "counter", "PDFs renderizados")
+metrics.definir("pdf_failed_total", "counter", "PDFs con error de render")
+metrics.definir("db_pool_checked_out", "gauge", "Conexiones del pool en uso")
+metrics.definir("db_pool_overflow", "gauge", "Conexiones en overflow del pool")
+
 # ==========================================================
 # Routers de autenticación
 # ==========================================================
 app.include_router(auth_router, prefix="/auth")
 
+# ==========================================================
+# Protección de bcrypt: límite de intentos (429) y pool saturado (503)
+# ==========================================================
+@app.exception_handler(hashing.HashPoolSaturado)
+async def hash_pool_saturado_handler(request: Request, exc: hashing.HashPoolSaturado):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servicio de autenticación ocupado, intente de nuevo"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.exception_handler(rate_limit.LimiteExcedido)
+async def limite_excedido_handler(request: Request, exc: rate_limit.LimiteExcedido):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Demasiados intentos, espere antes de reintentar"},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+@app.exception_handler(pdf_export.PdfPoolSaturado)
+async def pdf_pool_saturado_handler(request: Request, exc: pdf_export.PdfPoolSaturado):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Demasiados PDFs en proceso, intente de nuevo"},
+        headers={"Retry-After": "5"},
+    )
+
+@app.exception_handler(CodificacionInvalida)
+async def codificacion_invalida_handler(request: Request, exc: CodificacionInvalida):
+    return JSONResponse(
+        status_code=400,
+        content={
+            "detail": f"El archivo no es UTF-8 válido (línea {exc.linea}); se cargaron las filas anteriores",
+            "linea": exc.linea,
+            "resultado": exc.resultado,
+        },
+    )
+
+@app.exception_handler(DocumentoDuplicado)
+async def documento_duplicado_handler(request: Request, exc: DocumentoDuplicado):
+    detalle = "Ya existe un paciente con ese número de documento" if exc.campo == "numero_documento" \
+        else "El usuario ya tiene un paciente asociado"
+    return JSONResponse(status_code=409, content={"detail": detalle})
+
+# ==========================================================
+# Concurrencia optimista (409 con la versión actual)
+# ==========================================================
+@app.exception_handler(ConflictoVersion)
+async def conflicto_version_handler(request: Request, exc: ConflictoVersion):
+    return JSONResponse(
+        status_code=409,
+        content={
+            "detail": f"{exc.recurso} fue modificada por otro usuario; recargue y reintente",
+            "version_actual": exc.version_actual,
+        },
+    )
+
 # ==========================================================
 # Eventos
 # ==========================================================
 @app.on_event("startup")
 async def startup():
     print("🚀 Backend iniciado y conectado a Citus")
+    print(f"⚙️ Engine: {describe_engine_config()}")
+    app.state.metrics_flush = asyncio.create_task(metrics.flush_loop())
+    if read_engines:
+        app.state.replica_monitor = asyncio.create_task(monitor_replicas())
+        print(f"📚 {len(read_engines)} réplica(s) de lectura configuradas")
+    app.state.health_monitor = asyncio.create_task(health.monitor_salud())
+    audit.iniciar()
+    if rollup.ROLLUP_INTERVAL > 0:
+        app.state.rollup = asyncio.create_task(rollup.mantener())
 
 @app.on_event("shutdown")
 async def shutdown():
+    health.marcar_drenando()
+    app.state.health_monitor.cancel()
+    hashing.shutdown()
+    pdf_export.shutdown()
+    app.state.metrics_flush.cancel()
+    metrics.remove_snapshot()
+    # la auditoría pendiente se escribe mientras el engine sigue vivo
+    await audit.detener()
+    for tarea in ("replica_monitor", "rollup"):
+        monitor = getattr(app.state, tarea, None)
+        if monitor:
+            monitor.cancel()
+    for eng in read_engines:
+        await eng.dispose()
+    await health.shutdown()
     await engine.dispose()
 
 # ==========================================================
@@ -69,52 +244,124 @@ async def register_page(request: Request):
 async def root():
     return {"status": "online", "version": "2.0.0"}
 
+# Probes: /livez sin I/O; /readyz (y /health, por compatibilidad) leen la
+# foto que refresca health.monitor_salud() en segundo plano
+@app.get("/livez")
+async def livez():
+    return {"status": "alive"}
+
+@app.get("/readyz")
 @app.get("/health")
-async def health(db: AsyncSession = Depends(get_db)):
-    try:
-        await db.execute("SELECT 1")
-        return {"status": "ok", "database": "connected"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error de DB: {str(e)}")
+async def readyz():
+    status_code, cuerpo = health.readiness()
+    return JSONResponse(cuerpo, status_code=status_code)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def stats():
+    return {
+        "auth_cache": principal_cache.stats(),
+        "paciente_cache": paciente_cache.stats(),
+        "hash_pool": hashing.stats(),
+        "pdf": pdf_export.stats(),
+        "rate_limit": rate_limit.stats(),
+        "audit": audit.stats(),
+        "rollup": rollup.stats(),
+        "db_pool": pool_stats(),
+        "db_routing": routing_stats(),
+    }
 
 @app.get("/users/me", response_model=UsuarioResponse)
-async def me(current_user: UsuarioORM = Depends(get_current_active_user)):
+@budget(1)
+async def me(current_user: Principal = Depends(get_current_active_user)):
     return current_user
 
 # ==========================================================
 # Pacientes
 # ==========================================================
-@app.get("/pacientes/{paciente_id}")
+# Búsqueda para el mostrador de admisión (antes de /pacientes/{paciente_id})
+@app.get("/pacientes/buscar", response_model=list[PacienteBusqueda])
+@budget(2)
+async def endpoint_buscar_pacientes(
+    q: str = Query(..., min_length=2, max_length=100),
+    limit: int = Query(20, ge=1, le=50),
+    current_user: Principal = Depends(require_role(["admisionista", "medico"])),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # min_length se valida antes de recortar: "  " no puede traer toda la tabla
+    q = q.strip()
+    if len(q) < 2:
+        raise HTTPException(status_code=422, detail="La búsqueda necesita al menos 2 caracteres")
+    resultados = await buscar_pacientes(db, q, limit)
+    # solo ids: el texto buscado puede ser un documento o un nombre
+    await audit.registrar("search", "paciente", detalle=",".join(str(p.id) for p in resultados))
+    return resultados
+
+@app.get("/pacientes/{paciente_id}", response_model=PacienteDetalle)
+@budget(3)
 async def endpoint_get_paciente(
+    request: Request,
     paciente_id: int,
-    current_user: UsuarioORM = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db)
+    obs_limit: int = Query(20, ge=1, le=100),
+    obs_cursor: str | None = None,
+    campos: frozenset[str] | None = Depends(campos_parciales(PacienteDetalle)),
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    paciente = await get_paciente(db, paciente_id)
-    if not paciente:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-    return paciente
+    async def cargar():
+        paciente = await get_paciente(db, paciente_id)
+        if not paciente:
+            raise HTTPException(status_code=404, detail="Paciente no encontrado")
+
+        try:
+            observaciones, siguiente = await listar_observaciones(db, paciente_id, obs_limit, obs_cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        detalle = PacienteDetalle(
+            **PacienteResponse.model_validate(paciente).model_dump(),
+            observaciones=observaciones,
+            observaciones_next_cursor=siguiente,
+        )
+        return json_bytes(detalle, campos)
+
+    # Quien escribió hace poco no lee de la cache: recarga desde el primario
+    # (read-your-writes) y deja esa versión para los demás
+    if lectura_en_primario():
+        paciente_cache.invalidate(paciente_id)
+    variante = (obs_limit, obs_cursor, campos)
+    etag, body = await paciente_cache.get_or_compute(paciente_id, variante, cargar)
+
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/pacientes/observacion/{paciente_id}")
+@budget(2)
 async def endpoint_observacion(
     paciente_id: int,
     observacion: str,
-    current_user: UsuarioORM = Depends(require_role(["medico"])),
+    current_user: Principal = Depends(require_role(["medico"])),
     db: AsyncSession = Depends(get_db)
 ):
-    paciente = await agregar_observacion(
+    obs_id = await agregar_observacion(
         db, paciente_id, observacion, current_user.nombre_completo
     )
-    if not paciente:
+    if not obs_id:
         raise HTTPException(status_code=404, detail="Paciente no encontrado")
-    return {"message": "Observación agregada"}
+    paciente_cache.invalidate(paciente_id)
+    return {"message": "Observación agregada", "observacion_id": obs_id}
 
 # Endpoint para crear paciente (con conversión de fecha correcta)
 @app.post("/pacientes")
 async def endpoint_crear_paciente(
     data: dict,
     db: AsyncSession = Depends(get_db),
-    current_user: UsuarioORM = Depends(require_role(["admisionista", "medico"]))
+    current_user: Principal = Depends(require_role(["admisionista", "medico"]))
 ):
     fecha_str = data.get("fecha_nacimiento")
     fecha_date = None
@@ -130,24 +377,87 @@ async def endpoint_crear_paciente(
     paciente = await crear_paciente(db, data)
     if not paciente:
         raise HTTPException(status_code=500, detail="Error al crear paciente")
+    paciente_cache.invalidate(paciente.id)
+    await audit.registrar("create", "paciente", paciente.id)
     return {"message": "Paciente creado", "paciente_id": paciente.id}
 
+# Importación masiva (CSV o NDJSON en el cuerpo, leído en streaming)
+@app.post("/pacientes/import")
+async def endpoint_importar_pacientes(
+    request: Request,
+    formato: str | None = Query(None, pattern="^(csv|ndjson)$"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(require_role(["admisionista"]))
+):
+    if formato is None:
+        content_type = request.headers.get("content-type", "")
+        formato = "ndjson" if "ndjson" in content_type or "jsonl" in content_type else "csv"
+
+    try:
+        resultado = await importar_pacientes(db, request.stream(), formato)
+    except CodificacionInvalida as e:
+        # los lotes previos al error ya quedaron cargados
+        await audit.registrar("import", "paciente", detalle=f"{e.resultado['insertados']} insertados")
+        raise
+    await audit.registrar("import", "paciente", detalle=f"{resultado['insertados']} insertados")
+    return resultado
+
 # --- Nuevos endpoints para panel médico (CRUD de atención y cierre_historia) ---
 
-@app.get("/medico/paciente/{paciente_id}/atenciones")
+@app.get("/medico/paciente/{paciente_id}/atenciones", response_model=AtencionPagina)
+@budget(2)
 async def obtener_atenciones_paciente(
     paciente_id: int,
-    current_user: UsuarioORM = Depends(require_role(["medico"])),
-    db: AsyncSession = Depends(get_db)
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    campos: frozenset[str] | None = Depends(campos_parciales(AtencionResumen)),
+    current_user: Principal = Depends(require_role(["medico"])),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    result = await db.execute(
-        select(AtencionORM).where(AtencionORM.paciente_id == paciente_id)
-    )
-    atenciones = result.scalars().all()
-    return atenciones
+    try:
+        items, siguiente = await listar_atenciones(db, paciente_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    pagina = AtencionPagina(items=items, next_cursor=siguiente)
+    include = {"items": {"__all__": campos}, "next_cursor": True} if campos else None
+    return respuesta_json(pagina, include)
+
+
+@app.get("/medico/paciente/{paciente_id}/atenciones/{atencion_id}", response_model=AtencionResponse)
+@budget(2)
+async def obtener_atencion_detalle(
+    paciente_id: int,
+    atencion_id: int,
+    campos: frozenset[str] | None = Depends(campos_parciales(AtencionResponse)),
+    current_user: Principal = Depends(require_role(["medico"])),
+    db: AsyncSession = Depends(get_read_db)
+):
+    atencion = await get_atencion(db, paciente_id, atencion_id)
+    if not atencion:
+        raise HTTPException(status_code=404, detail="Atención no encontrada")
+    return respuesta_json(AtencionResponse.model_validate(atencion), campos)
+
+
+@app.get(
+    "/medico/paciente/{paciente_id}/cierres/{cierre_id}",
+    response_model=CierreHistoriaResponse,
+)
+@budget(1)
+async def obtener_cierre_historia(
+    paciente_id: int,
+    cierre_id: int,
+    campos: frozenset[str] | None = Depends(campos_parciales(CierreHistoriaResponse)),
+    current_user: Principal = Depends(require_role(["medico"])),
+    db: AsyncSession = Depends(get_read_db)
+):
+    cierre = await get_cierre_historia(db, paciente_id, cierre_id)
+    if not cierre:
+        raise HTTPException(status_code=404, detail="Cierre de historia no encontrado")
+    return respuesta_json(CierreHistoriaResponse.model_validate(cierre), campos)
 
 
 @app.post("/medico/atencion")
+@budget(3)
 async def crear_o_actualizar_atencion(
     atencion_id: int | None = Form(default=None),
     paciente_id: int = Form(...),
@@ -159,7 +469,8 @@ async def crear_o_actualizar_atencion(
     antecedentes_familiares: str = Form(...),
     alergias: str = Form(...),
     habitos: str = Form(...),
-    current_user: UsuarioORM = Depends(require_role(["medico"])),
+    version: int | None = Form(default=None),  # obligatoria al actualizar
+    current_user: Principal = Depends(require_role(["medico"])),
     db: AsyncSession = Depends(get_db),
 ):
     from datetime import datetime
@@ -169,45 +480,81 @@ async def crear_o_actualizar_atencion(
     except ValueError:
         raise HTTPException(status_code=400, detail="Fecha y hora inválida")
 
+    valores = dict(
+        fecha_hora_atencion=fecha_dt,
+        tipo_atencion=tipo_atencion,
+        motivo_consulta=motivo_consulta,
+        enfermedad_actual=enfermedad_actual,
+        antecedentes_personales=antecedentes_personales,
+        antecedentes_familiares=antecedentes_familiares,
+        alergias=alergias,
+        habitos=habitos,
+    )
     if atencion_id:
-        atencion = await db.get(AtencionORM, atencion_id)
-        if not atencion:
+        if version is None:
+            raise HTTPException(status_code=428, detail="Indique la versión leída de la atención")
+        # un solo UPDATE por (id, paciente_id, version): 409 si otro la cambió
+        nueva_version = await actualizar_atencion(db, paciente_id, atencion_id, version, valores)
+        if nueva_version is None:
             raise HTTPException(status_code=404, detail="Atención no encontrada")
-        # actualizar campos
-        atencion.fecha_hora_atencion = fecha_dt
-        atencion.tipo_atencion = tipo_atencion
-        atencion.motivo_consulta = motivo_consulta
-        atencion.enfermedad_actual = enfermedad_actual
-        atencion.antecedentes_personales = antecedentes_personales
-        atencion.antecedentes_familiares = antecedentes_familiares
-        atencion.alergias = alergias
-        atencion.habitos = habitos
     else:
-        atencion = AtencionORM(
-            paciente_id=paciente_id,
-            fecha_hora_atencion=fecha_dt,
-            tipo_atencion=tipo_atencion,
-            motivo_consulta=motivo_consulta,
-            enfermedad_actual=enfermedad_actual,
-            antecedentes_personales=antecedentes_personales,
-            antecedentes_familiares=antecedentes_familiares,
-            alergias=alergias,
-            habitos=habitos,
-        )
+        atencion = AtencionORM(paciente_id=paciente_id, **valores)
         db.add(atencion)
 
     await db.commit()
-    return {"message": "Atención guardada", "atencion_id": atencion.id}
+    accion = "update" if atencion_id else "create"
+    if not atencion_id:
+        atencion_id, nueva_version = atencion.id, atencion.version
+    await audit.registrar(accion, "atencion", paciente_id, atencion_id)
+    return {"message": "Atención guardada", "atencion_id": atencion_id, "version": nueva_version}
+
+
+ATENCION_BATCH_MAX = 1000
+
+
+@app.post("/medico/atenciones/batch")
+async def upsert_atenciones_batch(
+    items: list[dict],
+    current_user: Principal = Depends(require_role(["medico"])),
+    db: AsyncSession = Depends(get_db),
+):
+    if len(items) > ATENCION_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo {ATENCION_BATCH_MAX} atenciones por lote")
+
+    # validar item por item para reportar errores sin rechazar todo el lote
+    resultados = [None] * len(items)
+    validos, indices = [], []
+    for idx, item in enumerate(items):
+        try:
+            validos.append(AtencionIn.model_validate(item))
+            indices.append(idx)
+        except ValidationError as e:
+            resultados[idx] = {
+                "indice": idx, "atencion_id": item.get("id"), "paciente_id": item.get("paciente_id"),
+                "estado": "error", "error": e.errors(include_url=False),
+            }
+
+    if validos:
+        for idx, res in zip(indices, await upsert_atenciones(db, validos)):
+            res["indice"] = idx
+            resultados[idx] = res
+            if res["estado"] in ("creado", "actualizado"):
+                accion = "create" if res["estado"] == "creado" else "update"
+                await audit.registrar(accion, "atencion", res["paciente_id"], res["atencion_id"])
+
+    return {"resultados": resultados}
 
 
 @app.post("/medico/cierre_historia")
 async def crear_o_actualizar_cierre_historia(
     id: int | None = Form(default=None),
     atencion_id: int = Form(...),
+    paciente_id: int = Form(...),
     firma_paciente: str = Form(""),
     fecha_hora_cierre: str = Form(...),  # ISO datetime string
     responsable_registro: str = Form(...),
-    current_user: UsuarioORM = Depends(require_role(["medico"])),
+    version: int | None = Form(default=None),  # obligatoria al actualizar
+    current_user: Principal = Depends(require_role(["medico"])),
     db: AsyncSession = Depends(get_db),
 ):
     from datetime import datetime
@@ -217,30 +564,119 @@ async def crear_o_actualizar_cierre_historia(
     except ValueError:
         raise HTTPException(status_code=400, detail="Fecha de cierre inválida")
 
+    valores = dict(
+        firma_paciente=firma_paciente,
+        fecha_hora_cierre=fecha_cierre_dt,
+        responsable_registro=responsable_registro,
+    )
     if id:
-        cierre = await db.get(CierreHistoriaORM, id)
-        if not cierre:
+        if version is None:
+            raise HTTPException(status_code=428, detail="Indique la versión leída del cierre")
+        nueva_version = await actualizar_cierre_historia(db, paciente_id, id, version, valores)
+        if nueva_version is None:
             raise HTTPException(status_code=404, detail="Cierre de historia no encontrado")
-        cierre.firma_paciente = firma_paciente
-        cierre.fecha_hora_cierre = fecha_cierre_dt
-        cierre.responsable_registro = responsable_registro
+        cierre_id = id
     else:
-        cierre = CierreHistoriaORM(
-            atencion_id=atencion_id,
-            firma_paciente=firma_paciente,
-            fecha_hora_cierre=fecha_cierre_dt,
-            responsable_registro=responsable_registro,
-        )
+        cierre = CierreHistoriaORM(atencion_id=atencion_id, paciente_id=paciente_id, **valores)
         db.add(cierre)
 
     await db.commit()
-    return {"message": "Cierre de historia guardado", "cierre_id": cierre.id}
+    accion = "update" if id else "create"
+    if not id:
+        cierre_id, nueva_version = cierre.id, cierre.version
+    await audit.registrar(accion, "cierre", paciente_id, cierre_id)
+    return {"message": "Cierre de historia guardado", "cierre_id": cierre_id, "version": nueva_version}
+
+# ==========================================================
+# Tablero de gestión (lee los rollups, no la tabla distribuida)
+# ==========================================================
+@app.get("/dashboard/atenciones", response_model=DashboardAtenciones)
+@budget(2)
+async def dashboard_atenciones(
+    por: str = Query("tipo_atencion", pattern="^(tipo_atencion|entidad|regimen|dia)$"),
+    desde: date | None = None,
+    hasta: date | None = None,
+    current_user: Principal = Depends(require_role(["secretaria", "admisionista"])),
+    db: AsyncSession = Depends(get_read_db),
+):
+    hasta = hasta or date.today()
+    desde = desde or hasta - timedelta(days=29)
+    if desde > hasta or (hasta - desde).days >= rollup.DASHBOARD_MAX_DIAS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Rango inválido: desde <= hasta y máximo {rollup.DASHBOARD_MAX_DIAS} días",
+        )
+    return await rollup.resumen(db, por, desde, hasta)
+
+# ==========================================================
+# Exportación (secretaria)
+# ==========================================================
+@app.get("/secretaria/export")
+async def exportar(
+    paciente_id: int | None = None,
+    entidad: str | None = Query(None, min_length=1, max_length=150),
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: Principal = Depends(require_role(["secretaria"])),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if (paciente_id is None) == (entidad is None):
+        raise HTTPException(status_code=400, detail="Indique paciente_id o entidad (solo uno)")
+
+    nombre = f"paciente_{paciente_id}" if paciente_id is not None else "entidad"
+    await audit.registrar("export", "paciente", paciente_id, detalle=entidad and f"entidad={entidad}")
+    return StreamingResponse(
+        exportar_historias(db, formato, paciente_id=paciente_id, entidad=entidad),
+        media_type=FORMATOS_EXPORT[formato],
+        headers={"Content-Disposition": f'attachment; filename="historias_{nombre}.{formato}"'},
+    )
+
+# PDF de la historia: POST crea el trabajo, GET consulta su estado y descarga
+@app.post("/secretaria/pdf/{paciente_id}")
+async def solicitar_pdf(
+    paciente_id: int,
+    current_user: Principal = Depends(require_role(["secretaria"])),
+    db: AsyncSession = Depends(get_read_db),
+):
+    trabajo = await pdf_export.solicitar_pdf(db, paciente_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+    return JSONResponse(status_code=200 if trabajo["estado"] == "listo" else 202, content=trabajo)
+
+@app.get("/secretaria/pdf/trabajos/{job_id}")
+async def estado_pdf(
+    job_id: str,
+    current_user: Principal = Depends(require_role(["secretaria"])),
+):
+    trabajo = pdf_export.estado_pdf(job_id) if pdf_export.JOB_ID_RE.match(job_id) else None
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return trabajo
+
+@app.get("/secretaria/pdf/trabajos/{job_id}/archivo")
+async def descargar_pdf(
+    job_id: str,
+    current_user: Principal = Depends(require_role(["secretaria"])),
+):
+    # FileResponse atiende Range / If-Range y envía ETag y Last-Modified
+    m = pdf_export.JOB_ID_RE.match(job_id)
+    ruta = pdf_export.ruta_pdf(job_id) if m else None
+    if ruta is None or not os.path.exists(ruta):
+        raise HTTPException(status_code=404, detail="PDF no disponible")
+    # la ruta no lleva paciente_id: el middleware no la audita
+    await audit.registrar("export", "pdf", int(m.group(1)), detalle=job_id)
+    return FileResponse(
+        ruta,
+        media_type="application/pdf",
+        filename=f"historia_{m.group(1)}.pdf",
+        headers={"Cache-Control": "private, max-age=3600"},
+    )
 
 # ==========================================================
 # Registro seguro
 # ==========================================================
 @app.post("/auth/register-safe")
 async def register_safe(
+    request: Request,
     username: str,
     email: str,
     nombre_completo: str,
@@ -249,10 +685,13 @@ async def register_safe(
     db: AsyncSession = Depends(get_db)
 ):
     from auth import crear_usuario
-    
+
+    await rate_limit.limitar_registro(request)
+
     try:
         user = await crear_usuario(db, username, email, nombre_completo, rol, password)
         await db.commit()
+        invalidar_principal(user.id)
         return {"message": "Usuario creado", "user_id": user.id}
     except IntegrityError as e:
         await db.rollback()
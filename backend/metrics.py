@@ -0,0 +1,331 @@
+# metrics.py
+import os
+import json
+import time
+import fcntl
+import asyncio
+import tempfile
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+# ============================================================
+# 🔹 Métricas en formato Prometheus (sin dependencias externas)
+# ============================================================
+# Cada worker de uvicorn acumula sus métricas en memoria y cada
+# METRICS_FLUSH_INTERVAL segundos escribe una instantánea en
+# METRICS_DIR/<pid>.json. /metrics suma las instantáneas de todos los
+# workers, así el resultado es el mismo sin importar cuál atiende el scrape.
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "hc_metrics"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# nombre → {"type", "help", "buckets"}
+_definiciones = {}
+# nombre → {labels (tupla ordenada) → valor | {"buckets": [...], "sum", "count"}}
+_valores = {}
+# funciones que devuelven [(nombre, labels, valor)] de gauges calculados al vuelo
+_collectors = []
+# funciones (scope, ruta, ctx) llamadas al terminar cada petición (ver query_budget.py)
+request_hooks = []
+
+# estado de la petición en curso: {"db_time": float, "statements": int, "parent": dict | None}
+request_ctx: ContextVar[dict | None] = ContextVar("metrics_request_ctx", default=None)
+
+
+def definir(nombre: str, tipo: str, ayuda: str, buckets=None):
+    _definiciones[nombre] = {"type": tipo, "help": ayuda, "buckets": buckets}
+    _valores.setdefault(nombre, {})
+
+
+def _key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def inc(nombre: str, valor: float = 1.0, **labels):
+    serie = _valores[nombre]
+    k = _key(labels)
+    serie[k] = serie.get(k, 0.0) + valor
+
+
+def observe(nombre: str, valor: float, **labels):
+    buckets = _definiciones[nombre]["buckets"]
+    serie = _valores[nombre]
+    k = _key(labels)
+    h = serie.get(k)
+    if h is None:
+        h = serie[k] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+    i = bisect_left(buckets, valor)
+    if i < len(buckets):
+        h["buckets"][i] += 1   # acumulativo recién al exportar
+    h["sum"] += valor
+    h["count"] += 1
+
+
+def new_context() -> dict:
+    return {"db_time": 0.0, "statements": 0, "parent": request_ctx.get()}
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+definir("http_requests_total", "counter", "Peticiones HTTP atendidas")
+definir("http_request_duration_seconds", "histogram", "Latencia por ruta", LATENCY_BUCKETS)
+definir("http_requests_in_flight", "gauge", "Peticiones en curso por método")
+definir("db_request_seconds", "histogram", "Tiempo total en la DB por petición", LATENCY_BUCKETS)
+definir("db_statements_per_request", "histogram", "Sentencias SQL por petición", COUNT_BUCKETS)
+definir("db_pool_checkout_wait_seconds", "histogram", "Espera para obtener conexión del pool", LATENCY_BUCKETS)
+
+
+# ============================================================
+# 🔹 Instrumentación de SQLAlchemy
+# ============================================================
+def instrument_engine(async_engine):
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_t0", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _despues(conn, cursor, statement, parameters, context, executemany):
+        duracion = time.perf_counter() - conn.info["metrics_t0"].pop()
+        # los contadores se anidan (petición dentro de un query_budget de test, etc.)
+        ctx = request_ctx.get()
+        while ctx is not None:
+            ctx["db_time"] += duracion
+            ctx["statements"] += 1
+            ctx = ctx.get("parent")
+
+    pool = sync_engine.pool
+    if hasattr(pool, "checkout_wait_listeners"):
+        pool.checkout_wait_listeners.append(
+            lambda espera: observe("db_pool_checkout_wait_seconds", espera)
+        )
+
+
+# ============================================================
+# 🔹 Middleware ASGI
+# ============================================================
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        estado = {"status": 500}
+        ctx = new_context()
+        token = request_ctx.set(ctx)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                estado["status"] = message["status"]
+            await send(message)
+
+        # la plantilla de la ruta recién se conoce cuando el router la resuelve,
+        # por eso el gauge de peticiones en curso se etiqueta solo por método
+        inc("http_requests_in_flight", 1, method=method)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duracion = time.perf_counter() - t0
+            request_ctx.reset(token)
+            inc("http_requests_in_flight", -1, method=method)
+
+            route = scope.get("route")
+            ruta = getattr(route, "path", "unmatched")
+            inc("http_requests_total", method=method, route=ruta, status=str(estado["status"]))
+            observe("http_request_duration_seconds", duracion, method=method, route=ruta)
+            observe("db_request_seconds", ctx["db_time"], method=method, route=ruta)
+            observe("db_statements_per_request", ctx["statements"], method=method, route=ruta)
+            for hook in request_hooks:
+                hook(scope, ruta, ctx)
+
+
+# ============================================================
+# 🔹 Instantáneas por worker y exportación
+# ============================================================
+def _snapshot() -> dict:
+    datos = {
+        nombre: [[list(map(list, k)), v] for k, v in serie.items()]
+        for nombre, serie in _valores.items()
+    }
+    for fn in _collectors:
+        for nombre, labels, valor in fn():
+            datos.setdefault(nombre, []).append([list(map(list, _key(labels))), valor])
+    return datos
+
+
+def flush():
+    global _pid_reciclado
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    destino = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    if _pid_reciclado is None:
+        # un proceso anterior con este pid murió sin retirar su instantánea
+        _pid_reciclado = False
+        if os.path.exists(destino):
+            _retirar([destino])
+    tmp = destino + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp, destino)  # escritura atómica
+
+
+def remove_snapshot():
+    """Desde el shutdown: los counters del worker pasan a retired.json."""
+    try:
+        flush()
+        _retirar([os.path.join(METRICS_DIR, f"{os.getpid()}.json")])
+    except OSError as e:
+        print(f"⚠️ No se pudo retirar la instantánea de métricas: {e}")
+
+
+async def flush_loop():
+    while True:
+        try:
+            flush()
+        except OSError as e:
+            print(f"⚠️ No se pudo escribir métricas: {e}")
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+
+
+def _proceso_vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+# ============================================================
+# 🔹 Counters de workers retirados
+# ============================================================
+# Si un worker termina o se recicla, sus counters no pueden desaparecer de
+# la suma: rate() de Prometheus leería la baja como un reinicio. Antes de
+# borrar una instantánea (shutdown propio o worker muerto) sus counters e
+# histogramas se suman a retired.json, que _combinar() siempre incluye.
+# Los gauges de un worker que ya no existe se descartan.
+RETIRADOS = "retired.json"
+_pid_reciclado = None
+
+
+@contextmanager
+def _bloqueo():
+    with open(os.path.join(METRICS_DIR, "retired.lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _leer(ruta: str) -> dict:
+    try:
+        with open(ruta) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _sumar(total: dict, datos: dict, solo_acumulables: bool = False):
+    for nombre, series in datos.items():
+        if solo_acumulables and _definiciones.get(nombre, {}).get("type") not in ("counter", "histogram"):
+            continue
+        destino = total.setdefault(nombre, {})
+        for labels, valor in series:
+            k = tuple(tuple(par) for par in labels)
+            previo = destino.get(k)
+            if previo is None:
+                destino[k] = valor
+            elif isinstance(valor, dict):
+                previo["buckets"] = [a + b for a, b in zip(previo["buckets"], valor["buckets"])]
+                previo["sum"] += valor["sum"]
+                previo["count"] += valor["count"]
+            else:
+                destino[k] = previo + valor
+
+
+def _retirar(rutas: list[str]):
+    """Suma los counters de estas instantáneas a retired.json y las borra.
+    Bajo lock: dos workers que ven al mismo muerto no lo suman dos veces."""
+    with _bloqueo():
+        rutas = [r for r in rutas if os.path.exists(r)]
+        if not rutas:
+            return
+        retirados = {}
+        _sumar(retirados, _leer(os.path.join(METRICS_DIR, RETIRADOS)))
+        for ruta in rutas:
+            _sumar(retirados, _leer(ruta), solo_acumulables=True)
+        destino = os.path.join(METRICS_DIR, RETIRADOS)
+        with open(destino + ".tmp", "w") as f:
+            json.dump({
+                nombre: [[list(map(list, k)), v] for k, v in serie.items()]
+                for nombre, serie in retirados.items()
+            }, f)
+        os.replace(destino + ".tmp", destino)
+        for ruta in rutas:
+            os.remove(ruta)
+
+
+def _combinar() -> dict:
+    """Suma las instantáneas de los workers vivos más los counters retirados."""
+    flush()
+    vivos, muertos = [], []
+    for archivo in os.listdir(METRICS_DIR):
+        if not archivo.endswith(".json") or not archivo[:-5].isdigit():
+            continue
+        pid = int(archivo[:-5])
+        ruta = os.path.join(METRICS_DIR, archivo)
+        if pid == os.getpid() or _proceso_vivo(pid):
+            vivos.append(ruta)
+        else:
+            muertos.append(ruta)
+    if muertos:
+        _retirar(muertos)
+
+    total = {}
+    # bajo lock: un worker que se retira a mitad de la lectura no se pierde
+    with _bloqueo():
+        _sumar(total, _leer(os.path.join(METRICS_DIR, RETIRADOS)))
+        for ruta in vivos:
+            _sumar(total, _leer(ruta))
+    return total
+
+
+def _fmt_labels(k: tuple, extra: tuple = ()) -> str:
+    pares = list(k) + list(extra)
+    if not pares:
+        return ""
+    cuerpo = ",".join(
+        f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for n, v in pares
+    )
+    return "{" + cuerpo + "}"
+
+
+def render() -> str:
+    lineas = []
+    for nombre, series in sorted(_combinar().items()):
+        definicion = _definiciones.get(nombre, {"type": "gauge", "help": nombre, "buckets": None})
+        lineas.append(f"# HELP {nombre} {definicion['help']}")
+        lineas.append(f"# TYPE {nombre} {definicion['type']}")
+        for k, valor in series.items():
+            if definicion["type"] == "histogram":
+                acumulado = 0
+                for limite, cantidad in zip(definicion["buckets"], valor["buckets"]):
+                    acumulado += cantidad
+                    lineas.append(f"{nombre}_bucket{_fmt_labels(k, (('le', limite),))} {acumulado}")
+                lineas.append(f"{nombre}_bucket{_fmt_labels(k, (('le', '+Inf'),))} {valor['count']}")
+                lineas.append(f"{nombre}_sum{_fmt_labels(k)} {valor['sum']}")
+                lineas.append(f"{nombre}_count{_fmt_labels(k)} {valor['count']}")
+            else:
+                lineas.append(f"{nombre}{_fmt_labels(k)} {valor}")
+    return "\n".join(lineas) + "\n"
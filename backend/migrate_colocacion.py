@@ -0,0 +1,171 @@
+import asyncio
+from sqlalchemy import text
+from database import async_session
+
+# ============================================================
+# 🔹 Migración: colocar paciente / atencion / cierre_historia
+# ============================================================
+# Esquema anterior:
+#   paciente        → tabla de referencia (replicada en cada worker)
+#   atencion        → distribuida por paciente_id
+#   cierre_historia → distribuida por atencion_id
+# Esquema nuevo (ver k8s/init-scripts/create_db.sql):
+#   paciente distribuida por id; atencion, cierre_historia y observacion
+#   distribuidas por paciente_id y colocadas con paciente.
+#
+# Cada paso verifica el estado actual, así el script puede re-ejecutarse.
+
+SCHEMA = "historia_clinica"
+
+
+async def tipo_tabla(session, tabla: str):
+    result = await session.execute(
+        text(
+            "SELECT citus_table_type, distribution_column, colocation_id FROM citus_tables "
+            "WHERE table_name = CAST(:t AS regclass)"
+        ),
+        {"t": f"{SCHEMA}.{tabla}"},
+    )
+    return result.first()
+
+
+async def columna_existe(session, tabla: str, columna: str) -> bool:
+    result = await session.execute(
+        text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = :s AND table_name = :t AND column_name = :c"
+        ),
+        {"s": SCHEMA, "t": tabla, "c": columna},
+    )
+    return result.scalar() is not None
+
+
+async def restriccion_existe(session, tabla: str, nombre: str) -> bool:
+    result = await session.execute(
+        text("SELECT 1 FROM pg_constraint WHERE conrelid = CAST(:t AS regclass) AND conname = :n"),
+        {"t": f"{SCHEMA}.{tabla}", "n": nombre},
+    )
+    return result.scalar() is not None
+
+
+async def paso(session, descripcion: str, *sentencias: str):
+    print(f"🔄 {descripcion}")
+    for sql in sentencias:
+        await session.execute(text(sql))
+    await session.commit()
+
+
+async def main():
+    async with async_session() as session:
+        # 1. usuario debe ser tabla de referencia para poder referenciarla
+        #    desde una tabla distribuida (paciente.usuario_id)
+        info = await tipo_tabla(session, "usuario")
+        if info is None:
+            await paso(session, "usuario → tabla de referencia",
+                       f"SELECT create_reference_table('{SCHEMA}.usuario')")
+
+        # 2. paciente: referencia → distribuida por id, colocada con atencion
+        info = await tipo_tabla(session, "paciente")
+        if info is None or info.citus_table_type == "reference":
+            sentencias = []
+            if info is not None:
+                sentencias.append(f"SELECT undistribute_table('{SCHEMA}.paciente')")
+            sentencias += [
+                # los UNIQUE sin columna de distribución no se permiten
+                f"ALTER TABLE {SCHEMA}.paciente DROP CONSTRAINT IF EXISTS paciente_numero_documento_key",
+                f"ALTER TABLE {SCHEMA}.paciente DROP CONSTRAINT IF EXISTS paciente_usuario_id_key",
+                f"CREATE INDEX IF NOT EXISTS ix_paciente_numero_documento ON {SCHEMA}.paciente (numero_documento)",
+                f"SELECT create_distributed_table('{SCHEMA}.paciente', 'id', "
+                f"colocate_with => '{SCHEMA}.atencion')",
+            ]
+            await paso(session, "paciente → distribuida por id (colocada con atencion)", *sentencias)
+
+        # 2b. la unicidad que se quitó arriba pasa a tablas de búsqueda
+        #     distribuidas por la propia clave (ver crud.reservar_unicos)
+        for tabla, columna, tipo in (
+            ("paciente_documento", "numero_documento", "VARCHAR(50)"),
+            ("paciente_usuario", "usuario_id", f"INT REFERENCES {SCHEMA}.usuario(id)"),
+        ):
+            repetidos = (await session.execute(text(
+                f"SELECT {columna}, count(*) FROM {SCHEMA}.paciente "
+                f"WHERE {columna} IS NOT NULL GROUP BY {columna} HAVING count(*) > 1"
+            ))).all()
+            for valor, n in repetidos:
+                print(f"⚠️ paciente.{columna} = {valor} repetido {n} veces: se reserva para el menor id")
+            sentencias = [
+                f"CREATE TABLE IF NOT EXISTS {SCHEMA}.{tabla} ("
+                f"{columna} {tipo} PRIMARY KEY, paciente_id INT NOT NULL)",
+            ]
+            if await tipo_tabla(session, tabla) is None:
+                sentencias.append(f"SELECT create_distributed_table('{SCHEMA}.{tabla}', '{columna}')")
+            sentencias.append(
+                f"INSERT INTO {SCHEMA}.{tabla} ({columna}, paciente_id) "
+                f"SELECT {columna}, min(id) FROM {SCHEMA}.paciente WHERE {columna} IS NOT NULL "
+                f"GROUP BY {columna} ON CONFLICT DO NOTHING"
+            )
+            await paso(session, f"{tabla} → unicidad de paciente.{columna}", *sentencias)
+
+        # 3. cierre_historia: agregar paciente_id y redistribuir por él
+        info = await tipo_tabla(session, "cierre_historia")
+        if info is None or info.distribution_column != "paciente_id":
+            sentencias = []
+            if info is not None:
+                sentencias.append(f"SELECT undistribute_table('{SCHEMA}.cierre_historia')")
+            if not await columna_existe(session, "cierre_historia", "paciente_id"):
+                sentencias.append(f"ALTER TABLE {SCHEMA}.cierre_historia ADD COLUMN paciente_id INT")
+            sentencias += [
+                # tabla local en el coordinador ⋈ atencion distribuida
+                f"UPDATE {SCHEMA}.cierre_historia c SET paciente_id = a.paciente_id "
+                f"FROM {SCHEMA}.atencion a WHERE a.id = c.atencion_id AND c.paciente_id IS NULL",
+                f"ALTER TABLE {SCHEMA}.cierre_historia ALTER COLUMN paciente_id SET NOT NULL",
+                f"ALTER TABLE {SCHEMA}.cierre_historia DROP CONSTRAINT IF EXISTS cierre_historia_pkey",
+                f"ALTER TABLE {SCHEMA}.cierre_historia ADD PRIMARY KEY (id, paciente_id)",
+                f"CREATE INDEX IF NOT EXISTS ix_cierre_historia_atencion "
+                f"ON {SCHEMA}.cierre_historia (paciente_id, atencion_id)",
+                f"SELECT create_distributed_table('{SCHEMA}.cierre_historia', 'paciente_id', "
+                f"colocate_with => '{SCHEMA}.paciente')",
+                f"ALTER TABLE {SCHEMA}.cierre_historia ADD CONSTRAINT fk_cierre_atencion "
+                f"FOREIGN KEY (atencion_id, paciente_id) REFERENCES {SCHEMA}.atencion(id, paciente_id)",
+            ]
+            await paso(session, "cierre_historia → distribuida por paciente_id", *sentencias)
+
+        # 4. observacion: distribuida por paciente_id en el grupo de paciente
+        #    (la crea migrate_observaciones.py si el cluster no la tenía)
+        fks = [("atencion", "fk_atencion_paciente")]
+        existe = (await session.execute(
+            text("SELECT to_regclass(:t)"), {"t": f"{SCHEMA}.observacion"}
+        )).scalar()
+        if existe is None:
+            print("⚠️ observacion no existe: ejecutar migrate_observaciones.py y repetir")
+        else:
+            fks.append(("observacion", "fk_observacion_paciente"))
+            info = await tipo_tabla(session, "observacion")
+            grupo = (await tipo_tabla(session, "paciente")).colocation_id
+            if info is None or info.distribution_column != "paciente_id" or info.colocation_id != grupo:
+                sentencias = []
+                if info is not None:
+                    sentencias.append(f"SELECT undistribute_table('{SCHEMA}.observacion')")
+                sentencias.append(
+                    f"SELECT create_distributed_table('{SCHEMA}.observacion', 'paciente_id', "
+                    f"colocate_with => '{SCHEMA}.paciente')"
+                )
+                await paso(session, "observacion → distribuida por paciente_id (colocada con paciente)", *sentencias)
+
+        # 5. FKs hacia paciente: válidas ahora que comparten grupo de colocación;
+        #    sin ellas un paciente_id inexistente no da el 404 esperado
+        for tabla, nombre in fks:
+            if not await restriccion_existe(session, tabla, nombre):
+                await paso(
+                    session, f"{tabla} → {nombre}",
+                    f"ALTER TABLE {SCHEMA}.{tabla} ADD CONSTRAINT {nombre} "
+                    f"FOREIGN KEY (paciente_id) REFERENCES {SCHEMA}.paciente(id)",
+                )
+
+    if existe is None:
+        print("🎯 Colocación parcial: paciente, atencion y cierre_historia comparten shard; falta observacion.")
+    else:
+        print("🎯 Colocación terminada: paciente, atencion, cierre_historia y observacion comparten shard.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+import asyncio
+import re
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database import async_session
+
+# ============================================================
+# 🔹 Migración: paciente.observaciones (Text) → tabla observacion
+# ============================================================
+# Cada nota fue concatenada por el antiguo agregar_observacion como:
+#   "\n[YYYY-mm-dd HH:MM - Nombre del médico]\ntexto..."
+# Este script crea la tabla observacion si falta (distribuida y colocada
+# como en k8s/init-scripts/create_db.sql), separa cada blob en filas y deja
+# la columna en NULL. Con --drop-column elimina la columna al terminar.
+
+BATCH_SIZE = 500
+
+ENCABEZADO = re.compile(r"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}) - (.*?)\]$", re.MULTILINE)
+
+
+def separar_observaciones(blob: str) -> list[dict]:
+    notas = []
+    matches = list(ENCABEZADO.finditer(blob))
+
+    # texto previo al primer encabezado (p. ej. observaciones iniciales)
+    inicio = blob[: matches[0].start()] if matches else blob
+    if inicio.strip():
+        notas.append({"fecha_hora": None, "autor": None, "texto": inicio.strip()})
+
+    for i, m in enumerate(matches):
+        fin = matches[i + 1].start() if i + 1 < len(matches) else len(blob)
+        texto = blob[m.end():fin].strip()
+        if not texto:
+            continue
+        notas.append({
+            "fecha_hora": datetime.strptime(m.group(1), "%Y-%m-%d %H:%M"),
+            "autor": m.group(2),
+            "texto": texto,
+        })
+
+    # el texto inicial es anterior a toda nota fechada: queda justo antes
+    # de la primera para no aparecer como la más reciente del listado
+    fechadas = [n["fecha_hora"] for n in notas if n["fecha_hora"] is not None]
+    if notas and notas[0]["fecha_hora"] is None and fechadas:
+        notas[0]["fecha_hora"] = fechadas[0] - timedelta(microseconds=1)
+    return notas
+
+
+async def tipo_tabla(session, tabla: str) -> str | None:
+    result = await session.execute(
+        text("SELECT citus_table_type FROM citus_tables WHERE table_name = CAST(:t AS regclass)"),
+        {"t": f"historia_clinica.{tabla}"},
+    )
+    return result.scalar()
+
+
+async def crear_tabla(session):
+    """Tabla e índice como en create_db.sql; en Citus se distribuye por
+    paciente_id en el mismo grupo de colocación que paciente."""
+    await session.execute(text(
+        "CREATE TABLE IF NOT EXISTS historia_clinica.observacion ("
+        "id SERIAL, paciente_id INT NOT NULL, fecha_hora TIMESTAMP NOT NULL DEFAULT NOW(), "
+        "autor VARCHAR(200), texto TEXT NOT NULL, PRIMARY KEY (id, paciente_id))"
+    ))
+    await session.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_observacion_paciente_fecha "
+        "ON historia_clinica.observacion (paciente_id, fecha_hora DESC, id DESC)"
+    ))
+
+    citus = await session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'citus'"))
+    if citus.scalar() is not None:
+        if await tipo_tabla(session, "observacion") is None:
+            # con el esquema anterior paciente es de referencia: se coloca con
+            # atencion (ya por paciente_id) y migrate_colocacion.py une a paciente
+            colocar = "paciente" if await tipo_tabla(session, "paciente") == "distributed" else "atencion"
+            await session.execute(text(
+                "SELECT create_distributed_table('historia_clinica.observacion', 'paciente_id', "
+                f"colocate_with => 'historia_clinica.{colocar}')"
+            ))
+            print(f"🧩 observacion distribuida por paciente_id (colocada con {colocar})")
+    await session.commit()
+
+
+async def main(drop_column: bool = False):
+    migrados = 0
+    filas = 0
+    ultimo_id = 0
+
+    async with async_session() as session:
+        await crear_tabla(session)
+
+        existe = await session.execute(
+            text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_schema = 'historia_clinica' AND table_name = 'paciente' "
+                "AND column_name = 'observaciones'"
+            )
+        )
+        if existe.scalar() is None:
+            print("✅ paciente.observaciones no existe: nada que migrar.")
+            return
+
+        while True:
+            result = await session.execute(
+                text(
+                    "SELECT id, observaciones FROM historia_clinica.paciente "
+                    "WHERE id > :ultimo AND observaciones IS NOT NULL "
+                    "ORDER BY id LIMIT :lim"
+                ),
+                {"ultimo": ultimo_id, "lim": BATCH_SIZE},
+            )
+            lote = result.all()
+            if not lote:
+                break
+
+            valores = []
+            for paciente_id, blob in lote:
+                for nota in separar_observaciones(blob):
+                    valores.append({"paciente_id": paciente_id, **nota})
+
+            # blob sin ninguna nota fechada: se usa la primera atención del
+            # paciente; NOW() queda solo para quien tampoco tiene atenciones
+            sin_fecha = {v["paciente_id"] for v in valores if v["fecha_hora"] is None}
+            if sin_fecha:
+                primeras = dict((await session.execute(
+                    text(
+                        "SELECT paciente_id, MIN(fecha_hora_atencion) - INTERVAL '1 microsecond' "
+                        "FROM historia_clinica.atencion WHERE paciente_id = ANY(:ids) GROUP BY paciente_id"
+                    ),
+                    {"ids": list(sin_fecha)},
+                )).all())
+                for v in valores:
+                    if v["fecha_hora"] is None:
+                        v["fecha_hora"] = primeras.get(v["paciente_id"])
+
+            if valores:
+                await session.execute(
+                    text(
+                        "INSERT INTO historia_clinica.observacion (paciente_id, fecha_hora, autor, texto) "
+                        "VALUES (:paciente_id, COALESCE(:fecha_hora, NOW()), :autor, :texto)"
+                    ),
+                    valores,
+                )
+
+            ids = [r[0] for r in lote]
+            await session.execute(
+                text("UPDATE historia_clinica.paciente SET observaciones = NULL WHERE id = ANY(:ids)"),
+                {"ids": ids},
+            )
+            await session.commit()
+
+            migrados += len(lote)
+            filas += len(valores)
+            ultimo_id = ids[-1]
+            print(f"🔄 {migrados} pacientes migrados ({filas} observaciones)")
+
+        if drop_column:
+            await session.execute(text("ALTER TABLE historia_clinica.paciente DROP COLUMN IF EXISTS observaciones"))
+            await session.commit()
+            print("🗑️ Columna paciente.observaciones eliminada")
+
+    print(f"🎯 Migración terminada: {migrados} pacientes, {filas} observaciones.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(drop_column="--drop-column" in sys.argv))
@@ -0,0 +1,28 @@
+import asyncio
+from sqlalchemy import text
+from database import async_session
+
+# ============================================================
+# 🔹 Migración: orden del listado de atenciones (NULLS LAST)
+# ============================================================
+# listar_atenciones pagina por (fecha_hora_atencion DESC NULLS LAST, id
+# DESC); el índice debe tener ese mismo orden para servir el keyset.
+# Se puede re-ejecutar.
+
+SCHEMA = "historia_clinica"
+
+
+async def main():
+    async with async_session() as session:
+        print("🔄 ix_atencion_paciente_fecha → fecha DESC NULLS LAST")
+        await session.execute(text(f"DROP INDEX IF EXISTS {SCHEMA}.ix_atencion_paciente_fecha"))
+        await session.execute(text(
+            f"CREATE INDEX ix_atencion_paciente_fecha ON {SCHEMA}.atencion "
+            "(paciente_id, fecha_hora_atencion DESC NULLS LAST, id DESC)"
+        ))
+        await session.commit()
+    print("🎯 Migración terminada.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+import asyncio
+from sqlalchemy import text
+from database import async_session
+import rollup
+
+# ============================================================
+# 🔹 Migración: rollups de atenciones para tableros
+# ============================================================
+# Agrega actualizado_en (marca de cambio) a atencion y paciente, el índice
+# por fecha para recalcular días por rango, crea las tablas locales del
+# rollup (ver k8s/init-scripts/create_db.sql) y hace el backfill con una
+# reconstrucción completa. Se puede re-ejecutar.
+
+SCHEMA = "historia_clinica"
+
+SENTENCIAS = [
+    f"ALTER TABLE {SCHEMA}.atencion "
+    "ADD COLUMN IF NOT EXISTS actualizado_en TIMESTAMPTZ NOT NULL DEFAULT NOW()",
+    f"CREATE INDEX IF NOT EXISTS ix_atencion_actualizado_en ON {SCHEMA}.atencion (actualizado_en)",
+    f"CREATE INDEX IF NOT EXISTS ix_atencion_fecha ON {SCHEMA}.atencion (fecha_hora_atencion)",
+    f"ALTER TABLE {SCHEMA}.paciente "
+    "ADD COLUMN IF NOT EXISTS actualizado_en TIMESTAMPTZ NOT NULL DEFAULT NOW()",
+    f"CREATE INDEX IF NOT EXISTS ix_paciente_actualizado_en ON {SCHEMA}.paciente (actualizado_en)",
+    f"""CREATE TABLE IF NOT EXISTS {SCHEMA}.atencion_rollup_diario (
+        dia DATE NOT NULL,
+        tipo_atencion VARCHAR(50) NOT NULL,
+        entidad_pertenece VARCHAR(150) NOT NULL,
+        regimen_afiliacion VARCHAR(50) NOT NULL,
+        atenciones BIGINT NOT NULL,
+        PRIMARY KEY (dia, tipo_atencion, entidad_pertenece, regimen_afiliacion)
+    )""",
+    f"CREATE TABLE IF NOT EXISTS {SCHEMA}.rollup_dia_pendiente (dia DATE PRIMARY KEY)",
+    f"""CREATE TABLE IF NOT EXISTS {SCHEMA}.rollup_marca (
+        nombre VARCHAR(50) PRIMARY KEY,
+        procesado_hasta TIMESTAMPTZ NOT NULL
+    )""",
+]
+
+
+async def main():
+    async with async_session() as session:
+        print("🔄 Esquema de rollups")
+        for sql in SENTENCIAS:
+            await session.execute(text(sql))
+        await session.commit()
+
+        print("🔄 Reconstrucción completa del rollup")
+        resultado = await rollup.reconstruir(session)
+    print(f"🎯 Migración terminada: {resultado}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
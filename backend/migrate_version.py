@@ -0,0 +1,28 @@
+import asyncio
+from sqlalchemy import text
+from database import async_session
+
+# ============================================================
+# 🔹 Migración: columna version en atencion y cierre_historia
+# ============================================================
+# Concurrencia optimista (ver crud._actualizar_versionada). ADD COLUMN con
+# DEFAULT constante no reescribe la tabla y Citus lo propaga a los shards.
+# Se puede re-ejecutar.
+
+SCHEMA = "historia_clinica"
+TABLAS = ("atencion", "cierre_historia")
+
+
+async def main():
+    async with async_session() as session:
+        for tabla in TABLAS:
+            print(f"🔄 {SCHEMA}.{tabla}.version")
+            await session.execute(text(
+                f"ALTER TABLE {SCHEMA}.{tabla} ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1"
+            ))
+        await session.commit()
+    print("🎯 Migración terminada.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
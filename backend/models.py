@@ -1,8 +1,8 @@
 from sqlalchemy import (
-    Column, Integer, String, Date, DateTime, Boolean,
-    Table, ForeignKey, Text
+    Column, Integer, BigInteger, SmallInteger, String, Date, DateTime, Boolean,
+    Table, ForeignKey, ForeignKeyConstraint, Text, Index
 )
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from sqlalchemy.orm import relationship
 from database import Base
 from passlib.context import CryptContext
@@ -39,11 +39,14 @@ class UsuarioORM(Base):
     activo = Column(Boolean, default=True)
     fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Sin carga automática: quien necesite roles los pide explícitamente
+    # (selectinload o la consulta de auth); acceder sin cargarlos falla en
+    # vez de lanzar SQL escondido.
     roles = relationship(
         "RolORM",
         secondary=usuario_rol_table,
         back_populates="usuarios",
-        lazy="selectin"
+        lazy="raise_on_sql"
     )
 
 
@@ -54,22 +57,28 @@ class RolORM(Base):
     id = Column(Integer, primary_key=True, index=True)
     nombre = Column(String(50), unique=True, nullable=False)
 
+    # Un rol como "medico" tiene a todo el personal: nunca se carga solo
     usuarios = relationship(
         "UsuarioORM",
         secondary=usuario_rol_table,
         back_populates="roles",
-        lazy="selectin"
+        lazy="raise_on_sql"
     )
 
 
 class PacienteORM(Base):
+    """Distribuida por id: atencion, cierre_historia y observacion están
+    colocadas con ella, así la historia completa vive en un solo shard.
+    En Citus un UNIQUE debe incluir la columna de distribución, por eso
+    la unicidad de numero_documento y usuario_id la garantizan
+    PacienteDocumentoORM y PacienteUsuarioORM."""
     __tablename__ = "paciente"
     __table_args__ = {"schema": "historia_clinica"}
 
     id = Column(Integer, primary_key=True, index=True)
 
     tipo_documento = Column(String(20))
-    numero_documento = Column(String(50), unique=True, index=True)
+    numero_documento = Column(String(50), index=True)
 
     primer_apellido = Column(String(100))
     segundo_apellido = Column(String(100))
@@ -99,11 +108,79 @@ class PacienteORM(Base):
     regimen_afiliacion = Column(String(50))
     tipo_usuario = Column(String(50))
 
-    observaciones = Column(Text)  # Aquí el médico agrega observaciones
+    # Las observaciones del médico viven en ObservacionORM (una fila por nota)
 
-    usuario_id = Column(Integer, ForeignKey("historia_clinica.usuario.id"), unique=True, nullable=True)
+    usuario_id = Column(Integer, ForeignKey("historia_clinica.usuario.id"), index=True, nullable=True)
     usuario = relationship("UsuarioORM", back_populates="paciente", uselist=False)
 
+    # entidad y régimen son dimensiones del rollup: toda edición del
+    # paciente pone actualizado_en = now() vía onupdate (ver rollup.py)
+    actualizado_en = Column(DateTime(timezone=True), nullable=False, server_default=func.now(),
+                            onupdate=func.now(), index=True)
+
+
+class PacienteDocumentoORM(Base):
+    """Tabla de búsqueda numero_documento → paciente, distribuida por
+    numero_documento: su PK es el UNIQUE que paciente no puede declarar.
+    Se inserta en la misma transacción que el paciente (crud.reservar_unicos)."""
+    __tablename__ = "paciente_documento"
+    __table_args__ = {"schema": "historia_clinica"}
+
+    numero_documento = Column(String(50), primary_key=True)
+    paciente_id = Column(Integer, nullable=False)
+
+
+class PacienteUsuarioORM(Base):
+    """Tabla de búsqueda usuario → paciente (un usuario, un paciente),
+    distribuida por usuario_id."""
+    __tablename__ = "paciente_usuario"
+    __table_args__ = {"schema": "historia_clinica"}
+
+    usuario_id = Column(Integer, ForeignKey("historia_clinica.usuario.id"), primary_key=True)
+    paciente_id = Column(Integer, nullable=False)
+
+
+# Nombre completo normalizado para búsqueda difusa (pg_trgm). La consulta
+# debe usar exactamente esta expresión para que aplique el índice GIN.
+paciente_nombre_busqueda = func.lower(
+    func.coalesce(PacienteORM.primer_nombre, "") + " "
+    + func.coalesce(PacienteORM.segundo_nombre, "") + " "
+    + func.coalesce(PacienteORM.primer_apellido, "") + " "
+    + func.coalesce(PacienteORM.segundo_apellido, "")
+)
+
+Index(
+    "ix_paciente_nombre_trgm",
+    paciente_nombre_busqueda.label("nombre_busqueda"),
+    postgresql_using="gin",
+    postgresql_ops={"nombre_busqueda": "gin_trgm_ops"},
+)
+# Búsqueda por prefijo (LIKE 'abc%') independiente de la collation
+Index("ix_paciente_documento_prefijo", PacienteORM.numero_documento,
+      postgresql_ops={"numero_documento": "varchar_pattern_ops"})
+Index("ix_paciente_telefono_prefijo", PacienteORM.telefono,
+      postgresql_ops={"telefono": "varchar_pattern_ops"})
+Index("ix_paciente_celular_prefijo", PacienteORM.celular,
+      postgresql_ops={"celular": "varchar_pattern_ops"})
+# Exportación por aseguradora (ver export.py)
+Index("ix_paciente_entidad", PacienteORM.entidad_pertenece, PacienteORM.id)
+
+
+class ObservacionORM(Base):
+    """Bitácora de observaciones: solo inserciones, una fila por nota.
+    Distribuida por paciente_id (colocada con paciente)."""
+    __tablename__ = "observacion"
+    __table_args__ = (
+        Index("ix_observacion_paciente_fecha", "paciente_id", "fecha_hora", "id"),
+        {"schema": "historia_clinica"},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    paciente_id = Column(Integer, ForeignKey("historia_clinica.paciente.id"), primary_key=True)
+    fecha_hora = Column(DateTime, nullable=False, server_default=func.now())
+    autor = Column(String(200))
+    texto = Column(Text, nullable=False)
+
 
 class ProfesionalORM(Base):
     __tablename__ = "profesional"
@@ -123,10 +200,18 @@ class ProfesionalORM(Base):
 
 class AtencionORM(Base):
     __tablename__ = "atencion"
-    __table_args__ = {"schema": "historia_clinica"}
+    __table_args__ = (
+        # mismo orden que listar_atenciones: sin fecha al final
+        Index("ix_atencion_paciente_fecha", "paciente_id",
+              text("fecha_hora_atencion DESC NULLS LAST"), text("id DESC")),
+        Index("ix_atencion_actualizado_en", "actualizado_en"),
+        Index("ix_atencion_fecha", "fecha_hora_atencion"),
+        {"schema": "historia_clinica"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    paciente_id = Column(Integer, ForeignKey("historia_clinica.paciente.id"), nullable=False)
+    # PK (id, paciente_id) como en Citus: la clave incluye la columna de distribución
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    paciente_id = Column(Integer, ForeignKey("historia_clinica.paciente.id"), primary_key=True)
     fecha_hora_atencion = Column(DateTime)
     tipo_atencion = Column(String(50))
     motivo_consulta = Column(Text)
@@ -137,22 +222,96 @@ class AtencionORM(Base):
     habitos = Column(Text)
     # agregar aquí los demás campos necesarios
 
+    # Concurrencia optimista: cada UPDATE exige la versión leída y la incrementa
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Marca de cambio para el rollup incremental (ver rollup.py); todo UPDATE la renueva
+    actualizado_en = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
     paciente = relationship("PacienteORM", back_populates="atenciones")
 
 
 class CierreHistoriaORM(Base):
+    """Distribuida por paciente_id (colocada con atencion); la FK compuesta
+    (atencion_id, paciente_id) mantiene el JOIN dentro del shard."""
     __tablename__ = "cierre_historia"
-    __table_args__ = {"schema": "historia_clinica"}
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["atencion_id", "paciente_id"],
+            ["historia_clinica.atencion.id", "historia_clinica.atencion.paciente_id"],
+        ),
+        Index("ix_cierre_historia_atencion", "paciente_id", "atencion_id"),
+        {"schema": "historia_clinica"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    atencion_id = Column(Integer, ForeignKey("historia_clinica.atencion.id"), nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    atencion_id = Column(Integer, nullable=False)
+    paciente_id = Column(Integer, primary_key=True)
     firma_paciente = Column(Text)
     fecha_hora_cierre = Column(DateTime)
     responsable_registro = Column(String(150))
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     atencion = relationship("AtencionORM", back_populates="cierre_historia")
 
 
+class AuditoriaORM(Base):
+    """Bitácora de accesos (solo inserciones, la escribe audit.py por lotes).
+    Tabla local del coordinador: los eventos sin paciente (búsquedas,
+    exportaciones por entidad) no tienen columna de distribución."""
+    __tablename__ = "auditoria"
+    __table_args__ = (
+        Index("ix_auditoria_paciente_ts", "paciente_id", "ts"),
+        Index("ix_auditoria_usuario_ts", "usuario_id", "ts"),
+        {"schema": "historia_clinica"},
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    ts = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    usuario_id = Column(Integer)
+    username = Column(String(50))
+    accion = Column(String(20), nullable=False)
+    recurso = Column(String(30), nullable=False)
+    paciente_id = Column(Integer)
+    recurso_id = Column(Integer)
+    metodo = Column(String(10))
+    ruta = Column(String(200))
+    status = Column(SmallInteger)
+    ip = Column(String(64))
+    detalle = Column(Text)
+
+
+class AtencionRollupORM(Base):
+    """Conteo de atenciones por día × tipo × entidad × régimen, mantenido
+    por rollup.py. Tabla local del coordinador: el tablero la lee sin
+    tocar los shards. Las dimensiones nulas se guardan como ''."""
+    __tablename__ = "atencion_rollup_diario"
+    __table_args__ = {"schema": "historia_clinica"}
+
+    dia = Column(Date, primary_key=True)
+    tipo_atencion = Column(String(50), primary_key=True)
+    entidad_pertenece = Column(String(150), primary_key=True)
+    regimen_afiliacion = Column(String(50), primary_key=True)
+    atenciones = Column(BigInteger, nullable=False)
+
+
+class RollupDiaPendienteORM(Base):
+    """Días que el rollup debe recalcular aunque ninguna atención tenga hoy
+    esa fecha: el día anterior de una atención cuya fecha se editó."""
+    __tablename__ = "rollup_dia_pendiente"
+    __table_args__ = {"schema": "historia_clinica"}
+
+    dia = Column(Date, primary_key=True)
+
+
+class RollupMarcaORM(Base):
+    """Marca de agua de cada rollup: cambios en atencion hasta aquí ya procesados."""
+    __tablename__ = "rollup_marca"
+    __table_args__ = {"schema": "historia_clinica"}
+
+    nombre = Column(String(50), primary_key=True)
+    procesado_hasta = Column(DateTime(timezone=True), nullable=False)
+
+
 PacienteORM.atenciones = relationship("AtencionORM", back_populates="paciente", cascade="all, delete-orphan")
 AtencionORM.cierre_historia = relationship("CierreHistoriaORM", back_populates="atencion", uselist=False)
 
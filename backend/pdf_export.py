@@ -0,0 +1,344 @@
+# pdf_export.py
+import os
+import re
+import glob
+import time
+import asyncio
+import tempfile
+import textwrap
+from datetime import date, datetime
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import PacienteORM, AtencionORM, CierreHistoriaORM, ObservacionORM
+
+# ============================================================
+# 🔹 Exportación de historias en PDF (trabajos en un pool de procesos)
+# ============================================================
+# POST crea un trabajo y devuelve su id; el render corre en un
+# ProcessPoolExecutor acotado y el archivo queda en PDF_CACHE_DIR como
+# <paciente_id>-<huella>.pdf. La huella resume el contenido de la historia
+# (paciente, atenciones, cierres y observaciones): si nada cambió, el
+# trabajo ya está listo y no se vuelve a renderizar.
+#
+# El estado del trabajo vive en disco junto al PDF, no en memoria: con
+# varios workers de uvicorn el POST y el GET de estado pueden caer en
+# procesos distintos. <job_id>.pending marca un render en curso (creado con
+# O_EXCL, así dos workers no renderizan lo mismo) y <job_id>.error guarda el
+# mensaje de un render fallido. Un .pending más viejo que PDF_JOB_TIMEOUT
+# es de un worker que murió: se informa como error y el próximo POST lo
+# vuelve a encolar.
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "hc_pdf"))
+PDF_POOL_WORKERS = int(os.getenv("PDF_POOL_WORKERS", str(min(2, os.cpu_count() or 1))))
+PDF_POOL_MAX_PENDING = int(os.getenv("PDF_POOL_MAX_PENDING", "16"))
+PDF_JOB_TIMEOUT = float(os.getenv("PDF_JOB_TIMEOUT", "300"))
+
+JOB_ID_RE = re.compile(r"^(\d+)-([0-9a-f]{16})$")
+
+
+class PdfPoolSaturado(Exception):
+    """Demasiados PDFs en cola: se responde 503 sin encolar más."""
+
+
+_executor = None
+# trabajos de este proceso (para el tope de cola y el shutdown)
+_en_curso: dict[str, asyncio.Task] = {}
+_stats = {"submitted": 0, "cache_hits": 0, "rendered": 0, "failed": 0, "rejected": 0}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PDF_POOL_WORKERS)
+    return _executor
+
+
+def ruta_pdf(job_id: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f"{job_id}.pdf")
+
+
+def _marca(job_id: str, tipo: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f"{job_id}.{tipo}")
+
+
+def _borrar(ruta: str):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def _pendiente_vigente(job_id: str) -> bool | None:
+    """True si hay un render en curso, False si la marca quedó huérfana,
+    None si no hay marca."""
+    try:
+        edad = time.time() - os.path.getmtime(_marca(job_id, "pending"))
+    except FileNotFoundError:
+        return None
+    return edad < PDF_JOB_TIMEOUT
+
+
+def _tomar_trabajo(job_id: str) -> bool:
+    """Crea la marca .pending; False si otro worker ya está renderizando."""
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    ruta = _marca(job_id, "pending")
+    try:
+        os.close(os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        if _pendiente_vigente(job_id) is not False:
+            return False
+        os.utime(ruta)  # marca huérfana: este worker retoma el trabajo
+        return True
+
+
+# ============================================================
+# 🔹 Huella y datos de la historia (async, en el event loop)
+# ============================================================
+# Todas las subconsultas filtran por la columna de distribución: Citus la
+# resuelve en un solo shard.
+_HUELLA_SQL = text("""
+    SELECT
+        (SELECT p::text FROM historia_clinica.paciente p WHERE p.id = :pid) IS NOT NULL,
+        md5(
+            coalesce((SELECT p::text FROM historia_clinica.paciente p WHERE p.id = :pid), '')
+            || coalesce((SELECT string_agg(a::text, '|' ORDER BY a.id)
+                         FROM historia_clinica.atencion a WHERE a.paciente_id = :pid), '')
+            || coalesce((SELECT string_agg(c::text, '|' ORDER BY c.id)
+                         FROM historia_clinica.cierre_historia c WHERE c.paciente_id = :pid), '')
+            || coalesce((SELECT string_agg(o::text, '|' ORDER BY o.id)
+                         FROM historia_clinica.observacion o WHERE o.paciente_id = :pid), '')
+        )
+""")
+
+
+async def huella_historia(db: AsyncSession, paciente_id: int) -> str | None:
+    """Huella del contenido de la historia, o None si el paciente no existe."""
+    existe, huella = (await db.execute(_HUELLA_SQL, {"pid": paciente_id})).one()
+    return huella[:16] if existe else None
+
+
+def _filas(rows) -> list[dict]:
+    return [dict(r._mapping) for r in rows]
+
+
+async def _cargar_historia(db: AsyncSession, paciente_id: int) -> dict:
+    paciente = (await db.execute(
+        select(*PacienteORM.__table__.columns).where(PacienteORM.id == paciente_id)
+    )).one()
+    atenciones = (await db.execute(
+        select(*AtencionORM.__table__.columns)
+        .where(AtencionORM.paciente_id == paciente_id)
+        .order_by(AtencionORM.fecha_hora_atencion, AtencionORM.id)
+    )).all()
+    cierres = (await db.execute(
+        select(*CierreHistoriaORM.__table__.columns)
+        .where(CierreHistoriaORM.paciente_id == paciente_id)
+        .order_by(CierreHistoriaORM.id)
+    )).all()
+    observaciones = (await db.execute(
+        select(ObservacionORM.fecha_hora, ObservacionORM.autor, ObservacionORM.texto)
+        .where(ObservacionORM.paciente_id == paciente_id)
+        .order_by(ObservacionORM.fecha_hora, ObservacionORM.id)
+    )).all()
+    return {
+        "paciente": dict(paciente._mapping),
+        "atenciones": _filas(atenciones),
+        "cierres": _filas(cierres),
+        "observaciones": _filas(observaciones),
+    }
+
+
+# ============================================================
+# 🔹 Render (corre en el pool de procesos)
+# ============================================================
+# PDF de solo texto escrito a mano (Helvetica, WinAnsi): evita una
+# dependencia de render para un documento que no lleva imágenes.
+_ANCHO, _ALTO, _MARGEN = 595, 842, 50          # A4 en puntos
+_LINEA, _TAM, _COLUMNAS = 13, 10, 95
+
+
+def _texto(v) -> str:
+    if isinstance(v, (date, datetime)):
+        return v.isoformat(sep=" ") if isinstance(v, datetime) else v.isoformat()
+    return str(v)
+
+
+def _lineas_historia(datos: dict) -> list[tuple[str, str]]:
+    """[(fuente, línea)] con F1 = normal y F2 = negrita."""
+    lineas = []
+
+    def titulo(t):
+        lineas.append(("F2", ""))
+        lineas.append(("F2", t))
+
+    def campos(fila: dict, omitir=()):
+        for k, v in fila.items():
+            if k in omitir or v in (None, ""):
+                continue
+            etiqueta = k.replace("_", " ").capitalize()
+            for i, parte in enumerate(textwrap.wrap(f"{etiqueta}: {_texto(v)}", _COLUMNAS) or [""]):
+                lineas.append(("F1", parte if i == 0 else "    " + parte))
+
+    p = datos["paciente"]
+    lineas.append(("F2", "HISTORIA CLÍNICA"))
+    nombre = " ".join(filter(None, [p.get("primer_nombre"), p.get("segundo_nombre"),
+                                    p.get("primer_apellido"), p.get("segundo_apellido")]))
+    lineas.append(("F1", f"{nombre} - {p.get('tipo_documento') or ''} {p.get('numero_documento') or ''}"))
+    titulo("Datos del paciente")
+    campos(p, omitir=("id", "usuario_id", "actualizado_en"))
+
+    cierres = {}
+    for c in datos["cierres"]:
+        cierres.setdefault(c["atencion_id"], []).append(c)
+
+    for a in datos["atenciones"]:
+        fecha = _texto(a["fecha_hora_atencion"]) if a.get("fecha_hora_atencion") else "sin fecha"
+        titulo(f"Atención #{a['id']} - {fecha} - {a.get('tipo_atencion') or ''}")
+        campos(a, omitir=("id", "paciente_id", "fecha_hora_atencion", "tipo_atencion"))
+        for c in cierres.get(a["id"], []):
+            lineas.append(("F2", f"Cierre #{c['id']}"))
+            campos(c, omitir=("id", "paciente_id", "atencion_id"))
+
+    if datos["observaciones"]:
+        titulo("Observaciones")
+        for o in datos["observaciones"]:
+            encabezado = f"{_texto(o['fecha_hora'])} - {o.get('autor') or ''}: {o['texto']}"
+            for i, parte in enumerate(textwrap.wrap(encabezado, _COLUMNAS) or [""]):
+                lineas.append(("F1", parte if i == 0 else "    " + parte))
+    return lineas
+
+
+def _escapar(s: str) -> bytes:
+    b = s.encode("cp1252", errors="replace")
+    return b.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _pdf(lineas: list[tuple[str, str]]) -> bytes:
+    por_pagina = (_ALTO - 2 * _MARGEN) // _LINEA
+    paginas = [lineas[i:i + por_pagina] for i in range(0, len(lineas), por_pagina)] or [[]]
+
+    # 1 catálogo, 2 páginas, 3-4 fuentes, luego (página, contenido) por cada hoja
+    objetos = [None, None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for n, pagina in enumerate(paginas, start=1):
+        cuerpo = [b"BT", f"{_MARGEN} {_ALTO - _MARGEN} Td {_LINEA} TL".encode()]
+        for fuente, linea in pagina:
+            cuerpo.append(f"/{fuente} {_TAM} Tf".encode() + b" (" + _escapar(linea) + b") '")
+        cuerpo.append(b"ET")
+        pie = f"Página {n} de {len(paginas)}"
+        cuerpo.append(f"BT /F1 8 Tf {_ANCHO - _MARGEN - 60} 30 Td (".encode() + _escapar(pie) + b") Tj ET")
+        stream = b"\n".join(cuerpo)
+
+        objetos.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        contenido = len(objetos)
+        objetos.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_ANCHO} {_ALTO}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {contenido} 0 R >>".encode()
+        )
+        kids.append(f"{len(objetos)} 0 R")
+
+    objetos[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objetos[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    salida = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, obj in enumerate(objetos, start=1):
+        offsets.append(len(salida))
+        salida += f"{i} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(salida)
+    salida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        salida += f"{off:010d} 00000 n \n".encode()
+    salida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(salida)
+
+
+def _render(datos: dict, destino: str):
+    """Función de módulo (serializable para el pool): escribe el PDF de forma atómica."""
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    tmp = f"{destino}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_pdf(_lineas_historia(datos)))
+    os.replace(tmp, destino)
+
+
+# ============================================================
+# 🔹 API de trabajos
+# ============================================================
+async def _ejecutar(job_id: str, paciente_id: int, datos: dict):
+    destino = ruta_pdf(job_id)
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_get_executor(), _render, datos, destino)
+        _stats["rendered"] += 1
+        # las versiones anteriores de la historia ya no sirven
+        for viejo in glob.glob(os.path.join(PDF_CACHE_DIR, f"{paciente_id}-*.*")):
+            if viejo != destino and not viejo.endswith((".pending", ".tmp")):
+                _borrar(viejo)
+    except Exception as e:
+        _stats["failed"] += 1
+        with open(_marca(job_id, "error"), "w", encoding="utf-8") as f:
+            f.write(str(e))
+        print(f"❌ Error al generar PDF {job_id}: {e}")
+    finally:
+        _borrar(_marca(job_id, "pending"))
+        del _en_curso[job_id]
+
+
+async def solicitar_pdf(db: AsyncSession, paciente_id: int) -> dict | None:
+    """Crea (o reutiliza) el trabajo de PDF del paciente. None si no existe."""
+    huella = await huella_historia(db, paciente_id)
+    if huella is None:
+        return None
+
+    job_id = f"{paciente_id}-{huella}"
+    _stats["submitted"] += 1
+    if os.path.exists(ruta_pdf(job_id)):
+        _stats["cache_hits"] += 1
+        return {"job_id": job_id, "estado": "listo"}
+    if job_id in _en_curso or _pendiente_vigente(job_id):
+        return {"job_id": job_id, "estado": "pendiente"}
+
+    if len(_en_curso) >= PDF_POOL_MAX_PENDING:
+        _stats["rejected"] += 1
+        raise PdfPoolSaturado()
+
+    datos = await _cargar_historia(db, paciente_id)
+    if not _tomar_trabajo(job_id):
+        return {"job_id": job_id, "estado": "pendiente"}
+    _borrar(_marca(job_id, "error"))
+    _en_curso[job_id] = asyncio.create_task(_ejecutar(job_id, paciente_id, datos))
+    return {"job_id": job_id, "estado": "pendiente"}
+
+
+def estado_pdf(job_id: str) -> dict | None:
+    """Estado leído del disco: lo responde cualquier worker."""
+    if os.path.exists(ruta_pdf(job_id)):
+        return {"job_id": job_id, "estado": "listo"}
+    vigente = _pendiente_vigente(job_id)
+    if vigente:
+        return {"job_id": job_id, "estado": "pendiente"}
+    if vigente is False:
+        return {"job_id": job_id, "estado": "error", "error": "El trabajo se interrumpió; vuelva a solicitarlo"}
+    try:
+        with open(_marca(job_id, "error"), encoding="utf-8") as f:
+            return {"job_id": job_id, "estado": "error", "error": f.read()}
+    except FileNotFoundError:
+        return None
+
+
+def shutdown():
+    global _executor
+    for job_id, tarea in list(_en_curso.items()):
+        tarea.cancel()
+        _borrar(_marca(job_id, "pending"))
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def stats() -> dict:
+    return {**_stats, "in_flight": len(_en_curso), "workers": PDF_POOL_WORKERS, "max_pending": PDF_POOL_MAX_PENDING}
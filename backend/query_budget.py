@@ -0,0 +1,68 @@
+# query_budget.py
+import os
+from contextlib import contextmanager
+import metrics
+
+# ============================================================
+# 🔹 Presupuesto de sentencias SQL por petición
+# ============================================================
+# En producción: QUERY_BUDGET=N registra (y cuenta en /metrics) toda
+# petición que ejecute más de N sentencias. Un endpoint puede declarar su
+# propio límite con @budget(n).
+#
+# En tests:
+#     with query_budget(2):
+#         await client.get("/pacientes/1")
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "0"))   # 0 = desactivado
+
+metrics.definir(
+    "db_query_budget_exceeded_total", "counter",
+    "Peticiones que superaron su presupuesto de sentencias SQL",
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, limite: int, ejecutadas: int, etiqueta: str = ""):
+        self.limite = limite
+        self.ejecutadas = ejecutadas
+        super().__init__(
+            f"{etiqueta or 'bloque'}: {ejecutadas} sentencias SQL (presupuesto {limite})"
+        )
+
+
+def budget(max_statements: int):
+    """Decorador de endpoint: fija su presupuesto de sentencias por petición."""
+    def decorador(fn):
+        fn.__query_budget__ = max_statements
+        return fn
+    return decorador
+
+
+@contextmanager
+def query_budget(max_statements: int, etiqueta: str = ""):
+    """Cuenta las sentencias ejecutadas dentro del bloque (incluidas las de
+    peticiones ASGI en proceso) y lanza QueryBudgetExceeded si superan el límite."""
+    ctx = metrics.new_context()
+    token = metrics.request_ctx.set(ctx)
+    try:
+        yield ctx
+    finally:
+        metrics.request_ctx.reset(token)
+    if ctx["statements"] > max_statements:
+        raise QueryBudgetExceeded(max_statements, ctx["statements"], etiqueta)
+
+
+def _limite(endpoint) -> int:
+    return getattr(endpoint, "__query_budget__", QUERY_BUDGET)
+
+
+def _check_request(scope, ruta: str, ctx: dict):
+    limite = _limite(scope.get("endpoint"))
+    if not limite or ctx["statements"] <= limite:
+        return
+    metrics.inc("db_query_budget_exceeded_total", route=ruta)
+    print(f"⚠️ {scope['method']} {ruta}: {ctx['statements']} sentencias SQL "
+          f"(presupuesto {limite}, {ctx['db_time'] * 1000:.1f} ms en DB)")
+
+
+metrics.request_hooks.append(_check_request)
@@ -0,0 +1,205 @@
+# rate_limit.py
+import os
+import time
+import sqlite3
+import asyncio
+import tempfile
+import threading
+from dataclasses import dataclass
+from fastapi import Request
+import metrics
+
+# ============================================================
+# 🔹 Límite de intentos (token bucket) para login y registro
+# ============================================================
+# Cada regla es un token bucket por clave (IP o cuenta): `capacidad`
+# intentos de ráfaga que se recargan a `por_minuto`. El chequeo va antes
+# de cualquier consulta o hash, así una ráfaga de credenciales no llega a
+# bcrypt. El estado se guarda en un backend intercambiable:
+#   sqlite  → archivo local compartido por todos los workers del pod (default)
+#   memory  → dict del proceso (un solo worker / desarrollo)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "hc_rate_limit.sqlite3"))
+# Proxies de confianza que agregan X-Forwarded-For (ingress + frontend = 2)
+FORWARDED_TRUSTED_HOPS = int(os.getenv("FORWARDED_TRUSTED_HOPS", "0"))
+
+
+@dataclass(frozen=True)
+class Regla:
+    nombre: str
+    capacidad: int
+    por_minuto: float
+
+
+LOGIN_IP = Regla("login_ip", int(os.getenv("LOGIN_IP_BURST", "20")), float(os.getenv("LOGIN_IP_PER_MIN", "30")))
+LOGIN_CUENTA = Regla("login_cuenta", int(os.getenv("LOGIN_ACCOUNT_BURST", "5")), float(os.getenv("LOGIN_ACCOUNT_PER_MIN", "5")))
+REGISTRO_IP = Regla("registro_ip", int(os.getenv("REGISTER_IP_BURST", "5")), float(os.getenv("REGISTER_IP_PER_MIN", "5")))
+
+
+_stats = {"allowed": {}, "rejected": {}, "backend_errors": 0}
+
+
+class LimiteExcedido(Exception):
+    """Se superó una regla: se responde 429 con Retry-After."""
+
+    def __init__(self, regla: Regla, retry_after: float):
+        self.regla = regla
+        self.retry_after = retry_after
+
+
+metrics.definir("rate_limit_allowed_total", "counter", "Intentos admitidos por regla")
+metrics.definir("rate_limit_rejected_total", "counter", "Intentos rechazados (429) por regla")
+metrics.definir("rate_limit_backend_errors_total", "counter", "Fallos del backend de límites (se admite el intento)")
+
+
+def _recargar(tokens: float, actualizado: float, ahora: float, regla: Regla) -> float:
+    return min(regla.capacidad, tokens + (ahora - actualizado) * regla.por_minuto / 60)
+
+
+def _espera(tokens: float, regla: Regla) -> float:
+    return (1 - tokens) * 60 / regla.por_minuto
+
+
+# ============================================================
+# 🔹 Backends
+# ============================================================
+class MemoryBackend:
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    async def consumir(self, clave: str, regla: Regla) -> float:
+        """Devuelve 0 si hay token o los segundos hasta el próximo."""
+        ahora = time.monotonic()
+        tokens, actualizado = self._buckets.get(clave, (regla.capacidad, ahora))
+        tokens = _recargar(tokens, actualizado, ahora, regla)
+        if tokens < 1:
+            self._buckets[clave] = (tokens, ahora)
+            return _espera(tokens, regla)
+        self._buckets[clave] = (tokens - 1, ahora)
+        return 0.0
+
+
+class SQLiteBackend:
+    """Buckets en un archivo SQLite (WAL): los workers de uvicorn del mismo
+    pod comparten el estado. Cada operación es una transacción IMMEDIATE
+    corta que corre en un hilo para no bloquear el event loop."""
+
+    LIMPIEZA_CADA = 1000  # operaciones entre borrados de buckets viejos
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._ops = 0
+
+    def _conexion(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # estado efímero
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket ("
+                " clave TEXT PRIMARY KEY, tokens REAL NOT NULL, actualizado REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _consumir(self, clave: str, regla: Regla, limpiar: bool) -> float:
+        conn = self._conexion()
+        ahora = time.time()  # reloj de pared: se compara entre procesos
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conn.execute(
+                "SELECT tokens, actualizado FROM bucket WHERE clave = ?", (clave,)
+            ).fetchone()
+            tokens = regla.capacidad if fila is None else _recargar(fila[0], fila[1], ahora, regla)
+            espera = 0.0
+            if tokens < 1:
+                espera = _espera(tokens, regla)
+            else:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO bucket (clave, tokens, actualizado) VALUES (?, ?, ?) "
+                "ON CONFLICT (clave) DO UPDATE SET tokens = excluded.tokens, actualizado = excluded.actualizado",
+                (clave, tokens, ahora),
+            )
+            if limpiar:
+                # un bucket sin uso por una hora ya está lleno: se puede borrar
+                conn.execute("DELETE FROM bucket WHERE actualizado < ?", (ahora - 3600,))
+            conn.execute("COMMIT")
+            return espera
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def consumir(self, clave: str, regla: Regla) -> float:
+        self._ops += 1
+        limpiar = self._ops % self.LIMPIEZA_CADA == 0
+        return await asyncio.to_thread(self._consumir, clave, regla, limpiar)
+
+
+def _crear_backend():
+    if RATE_LIMIT_BACKEND == "memory":
+        return MemoryBackend()
+    if RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteBackend(RATE_LIMIT_DB)
+    raise ValueError(f"RATE_LIMIT_BACKEND desconocido: {RATE_LIMIT_BACKEND}")
+
+
+backend = _crear_backend()
+
+
+# ============================================================
+# 🔹 API
+# ============================================================
+def ip_cliente(request: Request) -> str:
+    """IP del cliente: la que anotó el proxy de confianza más lejano. Se
+    unen todas las cabeceras X-Forwarded-For (un cliente puede mandar
+    varias) y se cuenta desde el final, que es lo que agregaron los proxies."""
+    if FORWARDED_TRUSTED_HOPS:
+        reenviadas = [
+            ip.strip()
+            for valor in request.headers.getlist("x-forwarded-for")
+            for ip in valor.split(",") if ip.strip()
+        ]
+        if len(reenviadas) >= FORWARDED_TRUSTED_HOPS:
+            return reenviadas[-FORWARDED_TRUSTED_HOPS]
+    return request.client.host if request.client else "desconocida"
+
+
+async def limitar(regla: Regla, clave: str):
+    """Consume un token de la regla para la clave o lanza LimiteExcedido.
+    Si el backend falla se admite el intento (fail-open) y se cuenta el error."""
+    try:
+        espera = await backend.consumir(f"{regla.nombre}:{clave}", regla)
+    except sqlite3.Error as e:
+        metrics.inc("rate_limit_backend_errors_total", regla=regla.nombre)
+        _stats["backend_errors"] += 1
+        print(f"⚠️ Rate limit no disponible ({regla.nombre}): {e}")
+        return
+    if espera > 0:
+        metrics.inc("rate_limit_rejected_total", regla=regla.nombre)
+        _stats["rejected"][regla.nombre] = _stats["rejected"].get(regla.nombre, 0) + 1
+        raise LimiteExcedido(regla, espera)
+    metrics.inc("rate_limit_allowed_total", regla=regla.nombre)
+    _stats["allowed"][regla.nombre] = _stats["allowed"].get(regla.nombre, 0) + 1
+
+
+async def limitar_login(request: Request, email: str):
+    await limitar(LOGIN_IP, ip_cliente(request))
+    await limitar(LOGIN_CUENTA, email.strip().lower())
+
+
+async def limitar_registro(request: Request):
+    await limitar(REGISTRO_IP, ip_cliente(request))
+
+
+def stats() -> dict:
+    return {
+        "backend": RATE_LIMIT_BACKEND,
+        **_stats,
+        "reglas": {
+            r.nombre: {"capacidad": r.capacidad, "por_minuto": r.por_minuto}
+            for r in (LOGIN_IP, LOGIN_CUENTA, REGISTRO_IP)
+        },
+    }
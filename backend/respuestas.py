@@ -0,0 +1,37 @@
+# respuestas.py
+from typing import Optional
+from pydantic import BaseModel
+from fastapi import HTTPException, Query
+from fastapi.responses import Response
+
+# Ayudas de HTTP para los modelos de schemas.py: validación de ?fields= y
+# serialización directa con pydantic-core (sin jsonable_encoder).
+
+
+# ==========================================================
+# Campos parciales (?fields=id,primer_nombre,...)
+# ==========================================================
+def campos_parciales(modelo: type[BaseModel]):
+    """Dependencia que valida ?fields= contra los campos del modelo.
+    Devuelve el conjunto pedido o None (todos los campos)."""
+    def dependencia(
+        fields: Optional[str] = Query(None, description="Campos a incluir, separados por coma")
+    ) -> Optional[frozenset[str]]:
+        if not fields:
+            return None
+        campos = frozenset(f.strip() for f in fields.split(",") if f.strip())
+        desconocidos = campos - modelo.model_fields.keys()
+        if desconocidos:
+            raise HTTPException(
+                status_code=400, detail=f"Campos desconocidos: {', '.join(sorted(desconocidos))}"
+            )
+        return campos
+    return dependencia
+
+
+def json_bytes(obj: BaseModel, include=None) -> bytes:
+    return obj.model_dump_json(include=include).encode()
+
+
+def respuesta_json(obj: BaseModel, include=None, **kwargs) -> Response:
+    return Response(content=json_bytes(obj, include), media_type="application/json", **kwargs)
@@ -0,0 +1,218 @@
+# rollup.py
+import os
+import sys
+import time
+import asyncio
+from datetime import date, datetime, time as hora, timedelta
+from sqlalchemy import select, insert, delete, func, cast, Date, text, and_, or_, union
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import async_session
+from models import (
+    AtencionORM, PacienteORM, AtencionRollupORM, RollupMarcaORM, RollupDiaPendienteORM,
+)
+
+# ============================================================
+# 🔹 Rollups de atenciones para tableros
+# ============================================================
+# atencion_rollup_diario guarda el conteo por día × tipo × entidad ×
+# régimen; el tablero suma esas pocas filas en vez de hacer GROUP BY
+# sobre todos los shards de atencion en cada carga.
+#
+# Mantenimiento incremental: cada ROLLUP_INTERVAL segundos se recalculan
+# completos (idempotente) los días afectados desde la marca de agua:
+#   - días de las atenciones con actualizado_en nuevo (altas y ediciones)
+#   - días de las atenciones de pacientes con actualizado_en nuevo (entidad
+#     y régimen son dimensiones del rollup)
+#   - rollup_dia_pendiente: el día anterior de una atención cuya fecha se
+#     editó (lo registra marcar_dias() antes del UPDATE)
+# La marca retrocede ROLLUP_MARGEN_S para cubrir transacciones que
+# empezaron antes y confirmaron después de la corrida anterior. Los días se
+# filtran por rango sobre fecha_hora_atencion (ix_atencion_fecha).
+#
+#   python rollup.py             # una pasada incremental
+#   python rollup.py --rebuild   # reconstrucción completa (backfill)
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))  # 0 = sin tarea en la app
+ROLLUP_MARGEN_S = float(os.getenv("ROLLUP_MARGEN_S", "120"))
+DASHBOARD_MAX_DIAS = int(os.getenv("DASHBOARD_MAX_DIAS", "366"))
+
+NOMBRE = "atencion_diario"
+# un solo proceso por vez recalcula (workers y pods comparten el coordinador)
+_LOCK_ID = 72_025
+
+R = AtencionRollupORM
+DIMENSIONES = {
+    "dia": R.dia,
+    "tipo_atencion": R.tipo_atencion,
+    "entidad": R.entidad_pertenece,
+    "regimen": R.regimen_afiliacion,
+}
+
+_dia_atencion = cast(AtencionORM.fecha_hora_atencion, Date)
+_stats = {"runs": 0, "rebuilds": 0, "days_recomputed": 0, "errors": 0, "last_run": None, "last_duration_ms": None}
+
+
+def _agregado():
+    # atencion ⋈ paciente es colocado: el JOIN y el GROUP BY parcial corren en cada shard
+    claves = (
+        _dia_atencion,
+        func.coalesce(AtencionORM.tipo_atencion, ""),
+        func.coalesce(PacienteORM.entidad_pertenece, ""),
+        func.coalesce(PacienteORM.regimen_afiliacion, ""),
+    )
+    return (
+        select(*claves, func.count())
+        .select_from(AtencionORM)
+        .join(PacienteORM, PacienteORM.id == AtencionORM.paciente_id)
+        .where(AtencionORM.fecha_hora_atencion.is_not(None))
+        .group_by(*claves)
+    )
+
+
+def _en_dias(dias) -> object:
+    """fecha_hora_atencion en los días dados, como rangos [inicio, fin) con
+    los días consecutivos unidos: a diferencia de cast(fecha, date) usa el índice."""
+    rangos = []
+    for dia in sorted(dias):
+        if rangos and rangos[-1][1] == dia:
+            rangos[-1][1] = dia + timedelta(days=1)
+        else:
+            rangos.append([dia, dia + timedelta(days=1)])
+    fecha = AtencionORM.fecha_hora_atencion
+    return or_(*(
+        and_(fecha >= datetime.combine(inicio, hora.min), fecha < datetime.combine(fin, hora.min))
+        for inicio, fin in rangos
+    ))
+
+
+def marcar_dias(*condicion):
+    """INSERT ... SELECT de los días actuales de las atenciones que cumplen la
+    condición. Se ejecuta antes de un UPDATE que puede cambiar la fecha, en
+    su transacción: el día que la atención deja también se recalcula."""
+    return pg_insert(RollupDiaPendienteORM).from_select(
+        ["dia"],
+        select(_dia_atencion).distinct().where(*condicion, AtencionORM.fecha_hora_atencion.is_not(None)),
+    ).on_conflict_do_nothing()
+
+
+def _insertar(agregado):
+    return insert(R).from_select(
+        ["dia", "tipo_atencion", "entidad_pertenece", "regimen_afiliacion", "atenciones"], agregado
+    )
+
+
+async def _guardar_marca(db: AsyncSession, hasta):
+    marca = await db.get(RollupMarcaORM, NOMBRE)
+    if marca is None:
+        db.add(RollupMarcaORM(nombre=NOMBRE, procesado_hasta=hasta))
+    else:
+        marca.procesado_hasta = hasta
+
+
+async def reconstruir(db: AsyncSession) -> dict:
+    """Recalcula el rollup completo en una transacción (los lectores ven el anterior hasta el commit)."""
+    t0 = time.perf_counter()
+    await db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LOCK_ID})
+    hasta = (await db.execute(select(func.now()))).scalar()
+    await db.execute(delete(R))
+    await db.execute(delete(RollupDiaPendienteORM))
+    await db.execute(_insertar(_agregado()))
+    await _guardar_marca(db, hasta)
+    await db.commit()
+    _stats["rebuilds"] += 1
+    return _registrar(t0, {"modo": "rebuild", "procesado_hasta": hasta})
+
+
+async def actualizar(db: AsyncSession) -> dict:
+    """Pasada incremental: recalcula solo los días afectados por cambios."""
+    t0 = time.perf_counter()
+    if not (await db.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _LOCK_ID})).scalar():
+        await db.rollback()
+        return {"modo": "ocupado"}
+
+    marca = await db.get(RollupMarcaORM, NOMBRE)
+    if marca is None:
+        await db.rollback()  # libera el lock antes de reconstruir
+        return await reconstruir(db)
+
+    hasta = (await db.execute(select(func.now()))).scalar()
+    desde = marca.procesado_hasta - timedelta(seconds=ROLLUP_MARGEN_S)
+    con_fecha = AtencionORM.fecha_hora_atencion.is_not(None)
+    cambiados = union(
+        select(_dia_atencion).where(
+            AtencionORM.actualizado_en > desde, AtencionORM.actualizado_en <= hasta, con_fecha,
+        ),
+        # atencion ⋈ paciente colocado: cada shard resuelve sus pacientes editados
+        select(_dia_atencion)
+        .join(PacienteORM, PacienteORM.id == AtencionORM.paciente_id)
+        .where(PacienteORM.actualizado_en > desde, PacienteORM.actualizado_en <= hasta, con_fecha),
+    )
+    dias = set((await db.execute(cambiados)).scalars())
+    # los pendientes que confirme otra transacción después quedan para la próxima pasada
+    dias.update((await db.execute(
+        delete(RollupDiaPendienteORM).returning(RollupDiaPendienteORM.dia)
+    )).scalars())
+
+    if dias:
+        await db.execute(delete(R).where(R.dia.in_(dias)))
+        await db.execute(_insertar(_agregado().where(_en_dias(dias))))
+    marca.procesado_hasta = hasta
+    await db.commit()
+    _stats["days_recomputed"] += len(dias)
+    return _registrar(t0, {"modo": "incremental", "dias": len(dias), "procesado_hasta": hasta})
+
+
+def _registrar(t0: float, resultado: dict) -> dict:
+    _stats["runs"] += 1
+    _stats["last_run"] = time.time()
+    _stats["last_duration_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return resultado
+
+
+async def mantener():
+    """Tarea de fondo de la app: una pasada incremental cada ROLLUP_INTERVAL."""
+    while True:
+        await asyncio.sleep(ROLLUP_INTERVAL)
+        try:
+            async with async_session() as db:
+                await actualizar(db)
+        except Exception as e:
+            _stats["errors"] += 1
+            print(f"⚠️ Rollup de atenciones falló: {e}")
+
+
+# ============================================================
+# 🔹 Lectura para el tablero
+# ============================================================
+async def resumen(db: AsyncSession, por: str, desde: date, hasta: date) -> dict:
+    """Conteos por dimensión en [desde, hasta]: lee solo el rollup."""
+    columna = DIMENSIONES[por]
+    filas = (await db.execute(
+        select(columna, func.sum(R.atenciones))
+        .where(R.dia >= desde, R.dia <= hasta)
+        .group_by(columna)
+        .order_by(columna if por == "dia" else func.sum(R.atenciones).desc())
+    )).all()
+    marca = await db.get(RollupMarcaORM, NOMBRE)
+    return {
+        "por": por,
+        "desde": desde,
+        "hasta": hasta,
+        "actualizado_hasta": marca.procesado_hasta if marca else None,
+        "total": sum(n for _, n in filas),
+        "filas": [{"clave": str(clave), "atenciones": n} for clave, n in filas],
+    }
+
+
+def stats() -> dict:
+    return {"interval_s": ROLLUP_INTERVAL, "margin_s": ROLLUP_MARGEN_S, **_stats}
+
+
+async def main(rebuild: bool):
+    async with async_session() as db:
+        resultado = await (reconstruir(db) if rebuild else actualizar(db))
+    print(f"📊 Rollup {NOMBRE}: {resultado} ({_stats['last_duration_ms']} ms)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(rebuild="--rebuild" in sys.argv))
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, model_validator
 from typing import Optional
+from datetime import date, datetime
 
 class Token(BaseModel):
     access_token: str
@@ -19,11 +20,146 @@ class UsuarioCreate(BaseModel):
     nombre_completo: Optional[str] = None
 
 class UsuarioResponse(BaseModel):
+    """Se construye desde auth.Principal: `rol` es el rol principal y
+    `roles` todos los asignados (UsuarioORM no tiene columna rol)."""
     id: int
     username: str
     email: str
     rol: str
+    roles: list[str]
     nombre_completo: Optional[str]
     activo: bool
     class Config:
         from_attributes = True
+
+class AtencionIn(BaseModel):
+    id: Optional[int] = None           # si viene, se actualiza esa atención
+    paciente_id: int
+    fecha_hora_atencion: datetime
+    tipo_atencion: str
+    motivo_consulta: Optional[str] = None
+    enfermedad_actual: Optional[str] = None
+    antecedentes_personales: Optional[str] = None
+    antecedentes_familiares: Optional[str] = None
+    alergias: Optional[str] = None
+    habitos: Optional[str] = None
+    version: Optional[int] = None      # obligatoria si viene id (concurrencia optimista)
+
+    @model_validator(mode="after")
+    def _version_al_actualizar(self):
+        if self.id is not None and self.version is None:
+            raise ValueError("version es obligatoria al actualizar una atención")
+        return self
+
+
+# ==========================================================
+# Respuestas de pacientes, atenciones y cierres
+# ==========================================================
+# Se serializan con pydantic-core (a bytes, sin pasar por jsonable_encoder)
+# y no exponen columnas internas como paciente.usuario_id.
+class PacienteResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    tipo_documento: Optional[str] = None
+    numero_documento: Optional[str] = None
+    primer_apellido: Optional[str] = None
+    segundo_apellido: Optional[str] = None
+    primer_nombre: Optional[str] = None
+    segundo_nombre: Optional[str] = None
+    fecha_nacimiento: Optional[date] = None
+    edad: Optional[int] = None
+    sexo: Optional[str] = None
+    genero: Optional[str] = None
+    grupo_sanguineo: Optional[str] = None
+    factor_rh: Optional[str] = None
+    estado_civil: Optional[str] = None
+    direccion_residencia: Optional[str] = None
+    municipio_ciudad: Optional[str] = None
+    departamento: Optional[str] = None
+    telefono: Optional[str] = None
+    celular: Optional[str] = None
+    correo_electronico: Optional[str] = None
+    ocupacion: Optional[str] = None
+    entidad_pertenece: Optional[str] = None
+    regimen_afiliacion: Optional[str] = None
+    tipo_usuario: Optional[str] = None
+
+
+class ObservacionResponse(BaseModel):
+    id: int
+    fecha_hora: datetime
+    autor: Optional[str] = None
+    texto: str
+
+
+class PacienteDetalle(PacienteResponse):
+    observaciones: list[ObservacionResponse] = []
+    observaciones_next_cursor: Optional[str] = None
+
+
+class PacienteBusqueda(BaseModel):
+    id: int
+    tipo_documento: Optional[str] = None
+    numero_documento: Optional[str] = None
+    primer_nombre: Optional[str] = None
+    segundo_nombre: Optional[str] = None
+    primer_apellido: Optional[str] = None
+    segundo_apellido: Optional[str] = None
+    fecha_nacimiento: Optional[date] = None
+    telefono: Optional[str] = None
+    celular: Optional[str] = None
+    score: float
+
+
+class AtencionResumen(BaseModel):
+    id: int
+    paciente_id: int
+    fecha_hora_atencion: Optional[datetime] = None
+    tipo_atencion: Optional[str] = None
+
+
+class AtencionPagina(BaseModel):
+    items: list[AtencionResumen]
+    next_cursor: Optional[str] = None
+
+
+class AtencionResponse(AtencionResumen):
+    model_config = ConfigDict(from_attributes=True)
+
+    motivo_consulta: Optional[str] = None
+    enfermedad_actual: Optional[str] = None
+    antecedentes_personales: Optional[str] = None
+    antecedentes_familiares: Optional[str] = None
+    alergias: Optional[str] = None
+    habitos: Optional[str] = None
+    version: int  # enviar de vuelta al actualizar (409 si cambió)
+
+
+class CierreHistoriaResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    atencion_id: int
+    paciente_id: int
+    firma_paciente: Optional[str] = None
+    fecha_hora_cierre: Optional[datetime] = None
+    responsable_registro: Optional[str] = None
+    version: int
+
+
+# ==========================================================
+# Tablero (lee los rollups de rollup.py)
+# ==========================================================
+class DashboardFila(BaseModel):
+    clave: str
+    atenciones: int
+
+
+class DashboardAtenciones(BaseModel):
+    por: str
+    desde: date
+    hasta: date
+    actualizado_hasta: Optional[datetime] = None  # marca de agua del rollup
+    total: int
+    filas: list[DashboardFila]
@@ -0,0 +1,147 @@
+# serve.py
+import os
+import math
+import argparse
+import uvicorn
+
+# ============================================================
+# 🔹 Lanzador del backend
+# ============================================================
+# dev  → un proceso con --reload (como antes)
+# prod → N workers según la cuota de CPU del contenedor, uvloop + httptools,
+#        drenado ordenado en SIGTERM y reciclaje de workers. El pool de cada
+#        worker se dimensiona para que el total de conexiones del deployment
+#        quede bajo el max_connections del coordinador.
+#
+# Uso:
+#   python serve.py                      # perfil de DB_PROFILE (dev por defecto)
+#   DB_PROFILE=prod python serve.py
+#   python serve.py --dry-run            # solo muestra el plan
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8001"))
+
+# Conexiones: el coordinador acepta DB_MAX_CONNECTIONS; se reservan
+# DB_RESERVED_CONNECTIONS (superusuario, migraciones, psql) y el resto se
+# reparte entre BACKEND_REPLICAS pods × workers. Cada worker abre además
+# HEALTH_CONNECTIONS para el muestreo de salud (health.py).
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", "10"))
+BACKEND_REPLICAS = int(os.getenv("BACKEND_REPLICAS", "1"))
+HEALTH_CONNECTIONS = 1
+DB_POOL_MAX_PER_WORKER = int(os.getenv("DB_POOL_MAX_PER_WORKER", "30"))  # tope aunque sobre presupuesto
+
+# Drenado y reciclaje
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "25"))       # < terminationGracePeriodSeconds
+WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "0"))  # 0 = sin reciclaje
+WORKER_MAX_REQUESTS_JITTER = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "0"))
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "5"))
+ACCESS_LOG = os.getenv("ACCESS_LOG", "false").lower() == "true"  # /metrics ya cubre latencias
+
+
+def cpu_quota() -> float:
+    """CPUs disponibles: cuota del cgroup (v2 o v1) o, si no hay, afinidad del proceso."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            cuota, periodo = f.read().split()
+        if cuota != "max":
+            return int(cuota) / int(periodo)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            cuota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            periodo = int(f.read())
+        if cuota > 0:
+            return cuota / periodo
+    except (OSError, ValueError):
+        pass
+    return float(len(os.sched_getaffinity(0)))
+
+
+def calcular_workers() -> int:
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(1, int(os.environ["WEB_CONCURRENCY"]))
+    # workers asíncronos: uno por CPU alcanza; bcrypt y PDFs tienen sus pools
+    return max(1, math.ceil(cpu_quota()))
+
+
+def calcular_pool(workers: int) -> tuple[int, int]:
+    """(pool_size, max_overflow) por worker dentro del presupuesto de conexiones."""
+    disponibles = DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS
+    por_worker = min(
+        disponibles // (BACKEND_REPLICAS * workers) - HEALTH_CONNECTIONS, DB_POOL_MAX_PER_WORKER
+    )
+    if por_worker < 1:
+        raise SystemExit(
+            f"❌ {BACKEND_REPLICAS} réplica(s) × {workers} workers no caben en "
+            f"{disponibles} conexiones: baje WEB_CONCURRENCY o suba DB_MAX_CONNECTIONS"
+        )
+    pool_size = max(1, por_worker * 2 // 3)
+    return pool_size, por_worker - pool_size
+
+
+def plan(profile: str) -> dict:
+    if profile == "dev":
+        return {"profile": "dev", "workers": 1, "reload": True}
+
+    workers = calcular_workers()
+    pool_size, max_overflow = calcular_pool(workers)
+    # valores explícitos ganan, pero se avisa si rompen el presupuesto
+    pool_size = int(os.getenv("DB_POOL_SIZE", pool_size))
+    max_overflow = int(os.getenv("DB_MAX_OVERFLOW", max_overflow))
+    total = BACKEND_REPLICAS * workers * (pool_size + max_overflow + HEALTH_CONNECTIONS)
+    return {
+        "profile": profile,
+        "workers": workers,
+        "reload": False,
+        "cpu_quota": cpu_quota(),
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "total_connections": total,
+        "max_connections": DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lanzador del backend (uvicorn)")
+    parser.add_argument("--profile", default=os.getenv("DB_PROFILE", "dev"), choices=["dev", "prod"])
+    parser.add_argument("--dry-run", action="store_true", help="mostrar el plan y salir")
+    args = parser.parse_args()
+
+    p = plan(args.profile)
+    print(f"🚀 Plan de arranque: {p}")
+    if p.get("total_connections", 0) > p.get("max_connections", math.inf):
+        print(f"⚠️ {p['total_connections']} conexiones posibles superan el presupuesto de {p['max_connections']}")
+    if args.dry_run:
+        return
+
+    # los workers leen su configuración de engine al importar database.py
+    os.environ["DB_PROFILE"] = args.profile
+    if p["reload"]:
+        uvicorn.run("main:app", host=HOST, port=PORT, reload=True)
+        return
+
+    os.environ["DB_POOL_SIZE"] = str(p["pool_size"])
+    os.environ["DB_MAX_OVERFLOW"] = str(p["max_overflow"])
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=p["workers"],
+        loop="uvloop",
+        http="httptools",
+        # SIGTERM: deja de aceptar, espera las peticiones en curso hasta
+        # GRACEFUL_TIMEOUT y luego corre el shutdown (pools, engine)
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        limit_max_requests=WORKER_MAX_REQUESTS or None,
+        limit_max_requests_jitter=WORKER_MAX_REQUESTS_JITTER,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        # X-Forwarded-For lo interpreta rate_limit.py (FORWARDED_TRUSTED_HOPS)
+        proxy_headers=False,
+        access_log=ACCESS_LOG,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ import requests
 from pprint import pprint
 
 API_URL = "http://localhost:8001"
-TEST_USER = {"username": "admin", "password": "admin123"}
+TEST_USER = {"email": "admin@example.com", "password": "admin123"}
 
 def test_health():
     try:
@@ -15,9 +15,9 @@ def test_health():
 def test_login():
     try:
         response = requests.post(
-            f"{API_URL}/token",
+            f"{API_URL}/auth/login",
             data={
-                "username": TEST_USER["username"],
+                "email": TEST_USER["email"],
                 "password": TEST_USER["password"]
             }
         )
@@ -0,0 +1,22 @@
+import inspect
+import auth
+from database import get_db
+
+
+def _principal(*roles):
+    return auth.Principal(1, "u", "u@example.com", None, True, frozenset(roles))
+
+
+def test_mismo_rol_en_login_y_principal():
+    # el orden en que la base devuelve los roles no cambia el rol informado
+    for roles in (["secretaria", "medico"], ["medico", "secretaria"]):
+        assert auth.rol_principal(roles) == _principal(*roles).rol == "medico"
+
+
+def test_sin_roles_es_paciente():
+    assert auth.rol_principal([]) == _principal().rol == "paciente"
+
+
+def test_miss_de_cache_lee_del_primario():
+    dependencia = inspect.signature(auth.get_current_user).parameters["db"].default
+    assert dependencia.dependency is get_db
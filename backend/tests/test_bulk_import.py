@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+import bulk_import
+
+
+@pytest.mark.parametrize("documento", [None, "", "   ", "\t"])
+def test_documento_obligatorio_despues_de_normalizar(documento):
+    with pytest.raises(ValueError, match="numero_documento es obligatorio"):
+        bulk_import._validar({"numero_documento": documento, "primer_nombre": "Ana"})
+
+
+def test_documento_se_guarda_recortado():
+    registro = bulk_import._validar({"numero_documento": " 1020 ", "edad": "30"})
+    assert registro[bulk_import._IDX_DOC] == "1020"
+    assert registro[bulk_import.CAMPOS.index("edad")] == 30
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def _todos(gen):
+    return [x async for x in gen]
+
+
+def test_utf8_invalido_informa_la_linea():
+    # el byte inválido cae en la línea 3, partido entre dos chunks
+    stream = _stream(b"numero_documento\n1\n2\xff", b"\n3\n")
+    with pytest.raises(bulk_import.CodificacionInvalida) as exc:
+        asyncio.run(_todos(bulk_import._lineas(stream)))
+    assert exc.value.linea == 3
+
+
+def test_filas_con_campos_de_mas_o_de_menos_se_rechazan():
+    stream = _stream(b"numero_documento,primer_nombre\n1,Ana\n2,Luis,extra\n3\n")
+    registros = asyncio.run(_todos(bulk_import._registros(stream, "csv")))
+    assert registros[0] == (1, {"numero_documento": "1", "primer_nombre": "Ana"})
+    assert [fila for fila, data in registros if isinstance(data, ValueError)] == [2, 3]
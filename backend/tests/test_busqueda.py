@@ -0,0 +1,43 @@
+import asyncio
+import httpx
+import pytest
+import crud
+import main
+from auth import Principal, get_current_active_user
+from database import get_read_db
+
+
+class SesionSinUso:
+    async def execute(self, *args, **kwargs):
+        raise AssertionError("la búsqueda no debe llegar a la base")
+
+
+@pytest.fixture
+def cliente():
+    async def admisionista():
+        return Principal(1, "adm", "adm@example.com", None, True, frozenset({"admisionista"}))
+
+    async def sesion():
+        yield SesionSinUso()
+
+    main.app.dependency_overrides[get_current_active_user] = admisionista
+    main.app.dependency_overrides[get_read_db] = sesion
+    yield
+    main.app.dependency_overrides.clear()
+
+
+def _get(url):
+    async def pedir():
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://test") as c:
+            return await c.get(url)
+    return asyncio.run(pedir())
+
+
+@pytest.mark.parametrize("q", ["%20%20", "%20a%20", "a%20%20"])
+def test_busqueda_solo_espacios_es_422(cliente, q):
+    assert _get(f"/pacientes/buscar?q={q}").status_code == 422
+
+
+def test_crud_no_consulta_con_termino_vacio():
+    assert asyncio.run(crud.buscar_pacientes(SesionSinUso(), "   ")) == []
@@ -0,0 +1,9 @@
+import export
+
+
+def test_no_exporta_columnas_internas():
+    for columna in ("paciente.usuario_id", "paciente.actualizado_en", "atencion.version",
+                    "atencion.actualizado_en", "atencion.paciente_id", "cierre.version"):
+        assert columna not in export.ENCABEZADO
+    assert "paciente.numero_documento" in export.ENCABEZADO
+    assert "atencion.motivo_consulta" in export.ENCABEZADO
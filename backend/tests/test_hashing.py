@@ -0,0 +1,39 @@
+import asyncio
+import threading
+import pytest
+import hashing
+
+
+@pytest.fixture(autouse=True)
+def pool_limpio():
+    yield
+    hashing.shutdown()
+
+
+def test_cancelar_la_espera_no_libera_el_lugar(monkeypatch):
+    monkeypatch.setattr(hashing, "HASH_POOL_WORKERS", 1)
+    monkeypatch.setattr(hashing, "HASH_POOL_MAX_PENDING", 1)
+    liberar = threading.Event()
+
+    def lento(_):
+        liberar.wait(5)
+        return "ok"
+
+    async def principal():
+        tarea = asyncio.create_task(hashing._run(lento, "x"))
+        await asyncio.sleep(0.05)
+        tarea.cancel()
+        await asyncio.sleep(0)
+        # el hilo sigue ocupado: el pool sigue lleno
+        assert hashing._pending == 1
+        with pytest.raises(hashing.HashPoolSaturado):
+            await hashing._run(lento, "y")
+        liberar.set()
+        for _ in range(100):
+            if hashing._pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert hashing._pending == 0
+        assert await hashing._run(str.upper, "z") == "Z"
+
+    asyncio.run(principal())
@@ -0,0 +1,35 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy.dialects import postgresql
+import crud
+
+
+class SesionQueCaptura:
+    def __init__(self):
+        self.sql = None
+
+    async def execute(self, stmt):
+        self.sql = str(stmt.compile(dialect=postgresql.dialect()))
+        return type("R", (), {"all": lambda self: []})()
+
+
+def _sql(cursor):
+    db = SesionQueCaptura()
+    asyncio.run(crud.listar_atenciones(db, 1, cursor=cursor))
+    return db.sql
+
+
+def test_orden_con_nulls_last():
+    assert "DESC NULLS LAST" in _sql(None)
+
+
+def test_cursor_con_fecha_incluye_las_atenciones_sin_fecha():
+    sql = _sql(crud.encode_cursor(datetime(2025, 1, 1, 8), 10))
+    assert "fecha_hora_atencion IS NULL" in sql
+
+
+def test_cursor_sin_fecha_sigue_por_id():
+    cursor = crud.encode_cursor(None, 10)
+    assert crud.decode_cursor(cursor) == (None, 10)
+    sql = _sql(cursor)
+    assert "fecha_hora_atencion IS NULL" in sql and "atencion.id <" in sql
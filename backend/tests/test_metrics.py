@@ -0,0 +1,43 @@
+import os
+import json
+import pytest
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "_pid_reciclado", None)
+    monkeypatch.setitem(metrics._definiciones, "prueba_total", {"type": "counter", "help": "", "buckets": None})
+    monkeypatch.setitem(metrics._definiciones, "prueba_en_curso", {"type": "gauge", "help": "", "buckets": None})
+    monkeypatch.setitem(metrics._valores, "prueba_total", {(): 3.0})
+    monkeypatch.setitem(metrics._valores, "prueba_en_curso", {(): 2.0})
+    return tmp_path
+
+
+def _worker_muerto(directorio, pid=999_999, total=5.0):
+    with open(os.path.join(directorio, f"{pid}.json"), "w") as f:
+        json.dump({"prueba_total": [[[], total]], "prueba_en_curso": [[[], 7.0]]}, f)
+
+
+def test_counter_de_worker_muerto_no_baja(metrics_dir):
+    _worker_muerto(metrics_dir)
+    assert metrics._combinar()["prueba_total"][()] == 8.0
+    assert not os.path.exists(os.path.join(metrics_dir, "999999.json"))
+    # el muerto ya no está, pero su counter sigue sumando; su gauge no
+    combinado = metrics._combinar()
+    assert combinado["prueba_total"][()] == 8.0
+    assert combinado["prueba_en_curso"][()] == 2.0
+
+
+def test_shutdown_retira_los_counters_propios(metrics_dir, monkeypatch):
+    metrics.remove_snapshot()
+    assert not os.path.exists(os.path.join(metrics_dir, f"{os.getpid()}.json"))
+    # un worker nuevo arranca en cero: el total conserva lo del anterior
+    monkeypatch.setitem(metrics._valores, "prueba_total", {(): 1.0})
+    assert metrics._combinar()["prueba_total"][()] == 4.0
+
+
+def test_pid_reciclado_retira_la_instantanea_vieja(metrics_dir):
+    _worker_muerto(metrics_dir, pid=os.getpid(), total=10.0)
+    assert metrics._combinar()["prueba_total"][()] == 13.0
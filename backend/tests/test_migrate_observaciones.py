@@ -0,0 +1,18 @@
+from datetime import datetime, timedelta
+from migrate_observaciones import separar_observaciones
+
+
+def test_texto_inicial_queda_antes_de_la_primera_nota():
+    blob = (
+        "Paciente remitido de otra IPS\n"
+        "[2024-03-01 10:15 - Dra. Ruiz]\nControl de tensión\n"
+        "[2024-05-02 08:00 - Dr. Gómez]\nSin cambios"
+    )
+    notas = separar_observaciones(blob)
+    assert [n["autor"] for n in notas] == [None, "Dra. Ruiz", "Dr. Gómez"]
+    assert notas[0]["fecha_hora"] == datetime(2024, 3, 1, 10, 15) - timedelta(microseconds=1)
+
+
+def test_blob_sin_encabezados_queda_sin_fecha():
+    [nota] = separar_observaciones("Alergia a penicilina")
+    assert nota["fecha_hora"] is None and nota["texto"] == "Alergia a penicilina"
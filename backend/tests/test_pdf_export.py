@@ -0,0 +1,61 @@
+import os
+import time
+import asyncio
+import pytest
+import pdf_export
+
+JOB = "7-0123456789abcdef"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_export, "PDF_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(pdf_export, "_en_curso", {})
+    return tmp_path
+
+
+def test_pendiente_visible_desde_otro_worker():
+    # el worker que recibió el POST dejó la marca; este proceso no tiene el trabajo en memoria
+    assert pdf_export._tomar_trabajo(JOB)
+    assert pdf_export._en_curso == {}
+    assert pdf_export.estado_pdf(JOB) == {"job_id": JOB, "estado": "pendiente"}
+
+
+def test_dos_workers_no_toman_el_mismo_trabajo():
+    assert pdf_export._tomar_trabajo(JOB)
+    assert not pdf_export._tomar_trabajo(JOB)
+
+
+def test_marca_huerfana_se_informa_y_se_retoma(monkeypatch):
+    assert pdf_export._tomar_trabajo(JOB)
+    viejo = time.time() - pdf_export.PDF_JOB_TIMEOUT - 1
+    os.utime(pdf_export._marca(JOB, "pending"), (viejo, viejo))
+    assert pdf_export.estado_pdf(JOB)["estado"] == "error"
+    assert pdf_export._tomar_trabajo(JOB)
+    assert pdf_export.estado_pdf(JOB)["estado"] == "pendiente"
+
+
+def test_render_completo_y_error():
+    datos = {"paciente": {"id": 7, "primer_nombre": "Ana"}, "atenciones": [], "cierres": [], "observaciones": []}
+
+    async def correr(job_id, datos):
+        pdf_export._tomar_trabajo(job_id)
+        pdf_export._en_curso[job_id] = None
+        await pdf_export._ejecutar(job_id, 7, datos)
+
+    async def principal():
+        await correr(JOB, datos)
+        await correr("7-fedcba9876543210", {"paciente": None})
+
+    try:
+        asyncio.run(principal())
+    finally:
+        pdf_export.shutdown()
+    assert pdf_export.estado_pdf(JOB) == {"job_id": JOB, "estado": "listo"}
+    fallido = pdf_export.estado_pdf("7-fedcba9876543210")
+    assert fallido["estado"] == "error" and fallido["error"]
+    assert not os.path.exists(pdf_export._marca(JOB, "pending"))
+
+
+def test_trabajo_desconocido():
+    assert pdf_export.estado_pdf(JOB) is None
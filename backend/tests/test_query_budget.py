@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import create_engine, text
+import metrics
+import query_budget
+from query_budget import QueryBudgetExceeded, budget
+
+
+@pytest.fixture(scope="module")
+def conexion():
+    # engine síncrono en memoria con la misma instrumentación que el de la app
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(SimpleNamespace(sync_engine=engine))
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+def _sentencias(conn, n):
+    for _ in range(n):
+        conn.execute(text("SELECT 1"))
+
+
+def test_dentro_del_presupuesto(conexion):
+    with query_budget.query_budget(2) as ctx:
+        _sentencias(conexion, 2)
+    assert ctx["statements"] == 2
+
+
+def test_excede_el_presupuesto(conexion):
+    with pytest.raises(QueryBudgetExceeded, match="3 sentencias SQL \\(presupuesto 2\\)"):
+        with query_budget.query_budget(2, "detalle"):
+            _sentencias(conexion, 3)
+
+
+def test_bloques_anidados_suman_al_externo(conexion):
+    with query_budget.query_budget(10) as externo:
+        _sentencias(conexion, 1)
+        with query_budget.query_budget(5) as interno:
+            _sentencias(conexion, 2)
+    assert (interno["statements"], externo["statements"]) == (2, 3)
+
+
+def test_peticion_sobre_el_presupuesto_del_endpoint(monkeypatch):
+    @budget(2)
+    async def endpoint():
+        pass
+
+    monkeypatch.setitem(metrics._valores, "db_query_budget_exceeded_total", {})
+    scope = {"method": "GET", "endpoint": endpoint}
+    query_budget._check_request(scope, "/x", {"statements": 2, "db_time": 0.0})
+    assert metrics._valores["db_query_budget_exceeded_total"] == {}
+    query_budget._check_request(scope, "/x", {"statements": 3, "db_time": 0.0})
+    assert metrics._valores["db_query_budget_exceeded_total"] == {(("route", "/x"),): 1.0}
+
+
+def test_sin_presupuesto_no_se_cuenta(monkeypatch):
+    monkeypatch.setattr(query_budget, "QUERY_BUDGET", 0)
+    monkeypatch.setitem(metrics._valores, "db_query_budget_exceeded_total", {})
+    query_budget._check_request({"method": "GET", "endpoint": None}, "/y", {"statements": 99, "db_time": 0.0})
+    assert metrics._valores["db_query_budget_exceeded_total"] == {}
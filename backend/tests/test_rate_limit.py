@@ -0,0 +1,35 @@
+from starlette.requests import Request
+import rate_limit
+
+
+def _request(*xff: str, cliente: str = "10.0.0.9") -> Request:
+    headers = [(b"x-forwarded-for", v.encode()) for v in xff]
+    return Request({"type": "http", "headers": headers, "client": (cliente, 1234)})
+
+
+def test_ip_del_proxy_de_confianza(monkeypatch):
+    monkeypatch.setattr(rate_limit, "FORWARDED_TRUSTED_HOPS", 2)
+    # ingress anotó al cliente, el frontend anotó al ingress
+    assert rate_limit.ip_cliente(_request("203.0.113.9, 10.0.0.5")) == "203.0.113.9"
+
+
+def test_xff_falsificado_no_elige_la_ip(monkeypatch):
+    monkeypatch.setattr(rate_limit, "FORWARDED_TRUSTED_HOPS", 2)
+    assert rate_limit.ip_cliente(_request("1.2.3.4, 203.0.113.9, 10.0.0.5")) == "203.0.113.9"
+
+
+def test_varias_cabeceras_xff_se_unen(monkeypatch):
+    monkeypatch.setattr(rate_limit, "FORWARDED_TRUSTED_HOPS", 2)
+    # la primera cabecera la eligió el cliente; solo cuentan los saltos del final
+    req = _request("1.2.3.4, 203.0.113.9", "198.51.100.7, 10.0.0.5")
+    assert rate_limit.ip_cliente(req) == "198.51.100.7"
+
+
+def test_menos_saltos_que_los_de_confianza(monkeypatch):
+    monkeypatch.setattr(rate_limit, "FORWARDED_TRUSTED_HOPS", 2)
+    assert rate_limit.ip_cliente(_request("1.2.3.4")) == "10.0.0.9"
+
+
+def test_sin_proxies_de_confianza_ignora_xff(monkeypatch):
+    monkeypatch.setattr(rate_limit, "FORWARDED_TRUSTED_HOPS", 0)
+    assert rate_limit.ip_cliente(_request("1.2.3.4")) == "10.0.0.9"
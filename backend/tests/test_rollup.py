@@ -0,0 +1,81 @@
+import asyncio
+from datetime import date, datetime
+from types import SimpleNamespace
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.selectable import CompoundSelect
+import crud
+import rollup
+from models import PacienteORM
+
+
+def _sql(expr) -> str:
+    return str(expr.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_dias_por_rango_sargable():
+    sql = _sql(rollup._en_dias([date(2024, 3, 2), date(2024, 3, 1), date(2024, 3, 5)]))
+    # días consecutivos se unen en un rango; nunca cast(fecha AS DATE)
+    assert "CAST" not in sql.upper()
+    assert sql.count(">=") == 2
+    assert "'2024-03-01 00:00:00'" in sql and "'2024-03-03 00:00:00'" in sql
+    assert "'2024-03-05 00:00:00'" in sql and "'2024-03-06 00:00:00'" in sql
+
+
+def test_marcar_dias_no_duplica():
+    sql = _sql(rollup.marcar_dias(rollup.AtencionORM.id == 1))
+    assert "rollup_dia_pendiente" in sql and "ON CONFLICT DO NOTHING" in sql
+
+
+class SesionFalsa:
+    """Registra el SQL de cada sentencia. Para rollup.actualizar devuelve
+    los días cambiados y los pendientes que recibe."""
+
+    def __init__(self, cambiados=(), pendientes=()):
+        self.sql = []
+        self.cambiados = list(cambiados)
+        self.pendientes = list(pendientes)
+
+    async def execute(self, stmt, params=None):
+        if isinstance(stmt, TextClause):  # advisory lock
+            return SimpleNamespace(scalar=lambda: True)
+        self.sql.append(_sql(stmt))
+        if isinstance(stmt, CompoundSelect):
+            return SimpleNamespace(scalars=lambda: self.cambiados)
+        if stmt.is_delete and stmt.table.name == "rollup_dia_pendiente":
+            return SimpleNamespace(scalars=lambda: self.pendientes)
+        return SimpleNamespace(scalar=lambda: 2)
+
+    async def get(self, modelo, clave):
+        return SimpleNamespace(procesado_hasta=datetime(2025, 1, 10))
+
+    async def commit(self):
+        pass
+
+
+def test_atencion_movida_registra_el_dia_anterior_antes_del_update():
+    db = SesionFalsa()
+    version = asyncio.run(crud.actualizar_atencion(db, 1, 1, 1, {"fecha_hora_atencion": datetime(2025, 1, 3, 8)}))
+    assert version == 2
+    pendiente, edicion = db.sql
+    assert pendiente.startswith("INSERT INTO historia_clinica.rollup_dia_pendiente")
+    assert edicion.startswith("UPDATE historia_clinica.atencion")
+    assert "actualizado_en=now()" in edicion
+
+
+def test_edicion_de_paciente_renueva_actualizado_en():
+    sql = _sql(update(PacienteORM).where(PacienteORM.id == 2).values(entidad_pertenece="EPS C"))
+    assert "actualizado_en=now()" in sql
+
+
+def test_actualizar_recalcula_cambiados_y_pendientes():
+    # 1/3: atención o paciente editado; 1/1: día que dejó una atención movida
+    db = SesionFalsa(cambiados=[date(2025, 1, 3)], pendientes=[date(2025, 1, 1)])
+    resultado = asyncio.run(rollup.actualizar(db))
+    assert resultado["modo"] == "incremental" and resultado["dias"] == 2
+    cambiados = next(s for s in db.sql if " UNION " in s)
+    assert "atencion.actualizado_en >" in cambiados and "paciente.actualizado_en >" in cambiados
+    recalculo = db.sql[-1]
+    assert recalculo.startswith("INSERT INTO historia_clinica.atencion_rollup_diario")
+    assert "'2025-01-01 00:00:00'" in recalculo and "'2025-01-03 00:00:00'" in recalculo
@@ -0,0 +1,80 @@
+import os
+import asyncio
+from datetime import date, datetime
+import pytest
+from sqlalchemy import insert, select, update, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import crud
+import rollup
+from database import Base
+from models import PacienteORM, AtencionORM, AtencionRollupORM as R
+
+# Integración contra un PostgreSQL descartable: crea y borra el esquema
+# historia_clinica. Sin TEST_DATABASE_URL (postgresql+asyncpg://...) se omite.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="requiere TEST_DATABASE_URL")
+
+
+async def _preparar(engine):
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE SCHEMA IF NOT EXISTS historia_clinica"))
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(PacienteORM), [
+            {"id": 1, "numero_documento": "1", "entidad_pertenece": "EPS A", "regimen_afiliacion": "contributivo"},
+            {"id": 2, "numero_documento": "2", "entidad_pertenece": "EPS B", "regimen_afiliacion": "subsidiado"},
+        ])
+        await conn.execute(insert(AtencionORM), [
+            {"id": 1, "paciente_id": 1, "fecha_hora_atencion": datetime(2025, 1, 1, 8), "tipo_atencion": "consulta"},
+            {"id": 2, "paciente_id": 1, "fecha_hora_atencion": datetime(2025, 1, 2, 9), "tipo_atencion": "consulta"},
+            {"id": 3, "paciente_id": 2, "fecha_hora_atencion": datetime(2025, 1, 2, 10), "tipo_atencion": "urgencia"},
+            {"id": 4, "paciente_id": 2, "fecha_hora_atencion": None, "tipo_atencion": "consulta"},
+        ])
+
+
+async def _filas(db):
+    return sorted(
+        tuple(r) for r in (await db.execute(
+            select(R.dia, R.tipo_atencion, R.entidad_pertenece, R.regimen_afiliacion, R.atenciones)
+        )).all()
+    )
+
+
+def test_incremental_igual_a_reconstruccion():
+    async def correr():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        sesion = async_sessionmaker(engine, expire_on_commit=False)
+        try:
+            await _preparar(engine)
+            async with sesion() as db:
+                await rollup.reconstruir(db)
+
+            async with sesion() as db:
+                # atención movida de día: el 1/1 debe quedar solo con la nueva
+                await crud.actualizar_atencion(db, 1, 1, 1, {"fecha_hora_atencion": datetime(2025, 1, 3, 8)})
+                # cambio de dimensión en el paciente, sin tocar sus atenciones;
+                # actualizado_en lo pone el onupdate del modelo
+                await db.execute(update(PacienteORM).where(PacienteORM.id == 2).values(entidad_pertenece="EPS C"))
+                await db.execute(insert(AtencionORM).values(
+                    id=5, paciente_id=1, fecha_hora_atencion=datetime(2025, 1, 1, 12), tipo_atencion="control",
+                ))
+                await db.commit()
+
+            async with sesion() as db:
+                resultado = await rollup.actualizar(db)
+                assert resultado["modo"] == "incremental"
+                incremental = await _filas(db)
+                await rollup.reconstruir(db)
+                reconstruido = await _filas(db)
+        finally:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+            await engine.dispose()
+
+        assert incremental == reconstruido
+        assert (date(2025, 1, 1), "control", "EPS A", "contributivo", 1) in incremental
+        assert not any(f[0] == date(2025, 1, 1) and f[1] == "consulta" for f in incremental)
+        assert not any(f[2] == "EPS B" for f in incremental)
+
+    asyncio.run(correr())
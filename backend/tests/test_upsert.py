@@ -0,0 +1,113 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+from pydantic import ValidationError
+import crud
+from schemas import AtencionIn
+
+
+class AlmacenFalso:
+    """Atenciones en memoria: {(id, paciente_id): fila}. Reemplaza los
+    helpers de crud que hablan con la base; upsert_atenciones no cambia."""
+
+    def __init__(self, existentes):
+        self.filas = {clave: {"version": v} for clave, v in existentes.items()}
+        self.siguiente_id = 100
+
+    async def ids(self, db, n):
+        ids = list(range(self.siguiente_id, self.siguiente_id + n))
+        self.siguiente_id += n
+        return ids
+
+    async def insertar(self, db, filas):
+        for f in filas:
+            self.filas[(f["id"], f["paciente_id"])] = {**f, "version": 1}
+        return [SimpleNamespace(id=f["id"], paciente_id=f["paciente_id"], version=1) for f in filas]
+
+    async def editar(self, db, filas):
+        rows = []
+        for f in filas:
+            clave = (f["id"], f["paciente_id"])
+            fila = self.filas.get(clave)
+            if fila and fila["version"] == f["version"]:
+                fila.update(f, version=fila["version"] + 1)
+                rows.append(SimpleNamespace(id=clave[0], paciente_id=clave[1], version=fila["version"]))
+        return rows
+
+    async def versiones(self, db, claves):
+        return {c: self.filas[c]["version"] for c in claves if c in self.filas}
+
+
+class SesionFalsa:
+    @asynccontextmanager
+    async def begin_nested(self):
+        yield
+
+    async def execute(self, stmt, params=None):
+        # solo llega el registro de días pendientes del rollup
+        assert stmt.table.name == "rollup_dia_pendiente"
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def almacen(monkeypatch):
+    def crear(existentes):
+        alm = AlmacenFalso(existentes)
+
+        async def un_shard(db, paciente_ids):
+            return {p: 0 for p in paciente_ids}
+
+        monkeypatch.setattr(crud, "_agrupar_por_shard", un_shard)
+        monkeypatch.setattr(crud, "_ids_atencion", alm.ids)
+        monkeypatch.setattr(crud, "_insertar_atenciones", alm.insertar)
+        monkeypatch.setattr(crud, "_editar_atenciones", alm.editar)
+        monkeypatch.setattr(crud, "_versiones_atencion", alm.versiones)
+        return alm
+    return crear
+
+
+def _item(**kw):
+    return AtencionIn(paciente_id=1, fecha_hora_atencion=datetime(2025, 1, 1, 8), tipo_atencion="consulta", **kw)
+
+
+def test_id_desconocido_no_se_inserta(almacen):
+    alm = almacen({(5, 1): 3})
+    resultados = asyncio.run(crud.upsert_atenciones(SesionFalsa(), [_item(), _item(id=5, version=3), _item(id=999, version=1)]))
+    assert [r["estado"] for r in resultados] == ["creado", "actualizado", "no_encontrado"]
+    assert resultados[0]["atencion_id"] == 100
+    assert resultados[1]["version"] == 4
+    assert resultados[2]["version"] is None
+    # solo el item sin id se crea, con un id de la secuencia
+    assert set(alm.filas) == {(5, 1), (100, 1)}
+    assert alm.filas[(5, 1)]["version"] == 4
+
+
+def test_id_de_otro_paciente_no_se_actualiza(almacen):
+    alm = almacen({(5, 2): 1})
+    [resultado] = asyncio.run(crud.upsert_atenciones(SesionFalsa(), [_item(id=5, version=1)]))
+    assert resultado["estado"] == "no_encontrado"
+    assert alm.filas == {(5, 2): {"version": 1}}
+
+
+def test_version_vieja_es_conflicto(almacen):
+    alm = almacen({(5, 1): 3})
+    [resultado] = asyncio.run(crud.upsert_atenciones(SesionFalsa(), [_item(id=5, version=2)]))
+    assert (resultado["estado"], resultado["version"]) == ("conflicto", 3)
+    assert alm.filas[(5, 1)] == {"version": 3}
+
+
+def test_solo_se_envian_los_campos_recibidos(almacen):
+    alm = almacen({(5, 1): 1})
+    alm.filas[(5, 1)]["alergias"] = "penicilina"
+    asyncio.run(crud.upsert_atenciones(SesionFalsa(), [_item(id=5, version=1, motivo_consulta="dolor")]))
+    assert alm.filas[(5, 1)]["alergias"] == "penicilina"
+    assert alm.filas[(5, 1)]["motivo_consulta"] == "dolor"
+
+
+def test_version_obligatoria_con_id():
+    with pytest.raises(ValidationError):
+        _item(id=5)
@@ -0,0 +1,79 @@
+import os
+import asyncio
+from datetime import datetime
+import pytest
+from sqlalchemy import insert, select, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import crud
+from database import Base
+from models import PacienteORM, AtencionORM
+from schemas import AtencionIn
+
+# Integración contra un PostgreSQL descartable (ver test_rollup_db.py):
+# el UPDATE ... FROM (VALUES ...) del lote solo se puede probar en PostgreSQL.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="requiere TEST_DATABASE_URL")
+
+
+async def _preparar(engine):
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE SCHEMA IF NOT EXISTS historia_clinica"))
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(PacienteORM), [{"id": 1}, {"id": 2}])
+        await conn.execute(insert(AtencionORM), [
+            {"id": 1, "paciente_id": 1, "fecha_hora_atencion": datetime(2025, 1, 1, 8), "tipo_atencion": "consulta",
+             "alergias": None},
+            {"id": 2, "paciente_id": 2, "fecha_hora_atencion": datetime(2025, 1, 2, 9), "tipo_atencion": "consulta",
+             "alergias": "penicilina"},
+        ])
+        # los ids explícitos no avanzan la secuencia
+        await conn.execute(text("SELECT setval('historia_clinica.atencion_id_seq', 10)"))
+
+
+def test_lote_inserta_actualiza_y_detecta_conflictos():
+    async def correr():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        sesion = async_sessionmaker(engine, expire_on_commit=False)
+        try:
+            await _preparar(engine)
+            async with sesion() as db:
+                resultados = await crud.upsert_atenciones(db, [
+                    AtencionIn(paciente_id=1, fecha_hora_atencion=datetime(2025, 2, 1, 8), tipo_atencion="control"),
+                    AtencionIn(id=1, paciente_id=1, version=1, fecha_hora_atencion=datetime(2025, 1, 3, 8),
+                               tipo_atencion="consulta", motivo_consulta="dolor"),
+                    # alergias no viene: conserva "penicilina"
+                    AtencionIn(id=2, paciente_id=2, version=1, fecha_hora_atencion=datetime(2025, 1, 2, 9),
+                               tipo_atencion="urgencia"),
+                    AtencionIn(id=2, paciente_id=1, version=1, fecha_hora_atencion=datetime(2025, 1, 2, 9),
+                               tipo_atencion="consulta"),
+                ])
+                [conflicto] = await crud.upsert_atenciones(db, [
+                    AtencionIn(id=1, paciente_id=1, version=1, fecha_hora_atencion=datetime(2025, 1, 4, 8),
+                               tipo_atencion="consulta"),
+                ])
+            async with sesion() as db:
+                filas = {
+                    (r.id, r.paciente_id): r for r in (await db.execute(
+                        select(AtencionORM.id, AtencionORM.paciente_id, AtencionORM.tipo_atencion,
+                               AtencionORM.motivo_consulta, AtencionORM.alergias, AtencionORM.version)
+                    )).all()
+                }
+        finally:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+            await engine.dispose()
+
+        assert [(r["estado"], r["version"]) for r in resultados] == [
+            ("creado", 1), ("actualizado", 2), ("actualizado", 2), ("no_encontrado", None),
+        ]
+        assert resultados[0]["atencion_id"] == 11
+        assert filas[(1, 1)].motivo_consulta == "dolor"
+        assert filas[(2, 2)].tipo_atencion == "urgencia"
+        assert filas[(2, 2)].alergias == "penicilina"
+        assert (conflicto["estado"], conflicto["version"]) == ("conflicto", 2)
+        assert filas[(1, 1)].version == 2
+        assert (2, 1) not in filas
+
+    asyncio.run(correr())
@@ -1,13 +1,29 @@
+import os
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from jinja2 import StrictUndefined
+from starlette.background import BackgroundTask
 import httpx
+import assets
 #rom auth import router as auth_router  # 🔹 incluir router del backend
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+# Estáticos con huella y precomprimidos (ver assets.py)
+assets.cargar_manifest()
+templates.env.globals["static_url"] = assets.static_url
+app.mount("/static", assets.PrecompressedStaticFiles(directory=assets.BUILD_DIR), name="static")
+
+# Las páginas no dependen del usuario: se renderizan una vez al arrancar.
+# StrictUndefined: una variable por petición ({{ paciente_id }}) rompe el
+# arranque en vez de salir vacía; esos datos van en la query y los lee el JS.
+_plantillas_estaticas = templates.env.overlay(undefined=StrictUndefined)
+PAGINAS = {
+    nombre: assets.PaginaEstatica(_plantillas_estaticas.get_template(f"{nombre}.html").render(error=None))
+    for nombre in ("login", "register", "paciente", "admisionista", "medico", "secretaria")
+}
 
 # 🔹 Incluir router de auth del backend
 #pp.include_router(auth_router, prefix="/auth")
@@ -18,30 +34,131 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 @app.get("/", response_class=HTMLResponse)
 @app.get("/login", response_class=HTMLResponse)
 async def login(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request, "error": None})
+    return PAGINAS["login"].response(request.headers)
 
 # ============================
 # PÁGINA DE REGISTRO (Frontend)
 # ============================
 @app.get("/register", response_class=HTMLResponse)
 async def register(request: Request):
-    return templates.TemplateResponse("register.html", {"request": request, "error": None})   
+    return PAGINAS["register"].response(request.headers)
 
 # ============================
 # VISTAS POR ROL
 # ============================
 @app.get("/paciente", response_class=HTMLResponse)
 async def paciente(request: Request):
-    return templates.TemplateResponse("paciente.html", {"request": request})
+    return PAGINAS["paciente"].response(request.headers)
 
 @app.get("/admisionista", response_class=HTMLResponse)
 async def admisionista(request: Request):
-    return templates.TemplateResponse("admisionista.html", {"request": request})
+    return PAGINAS["admisionista"].response(request.headers)
 
 @app.get("/medico", response_class=HTMLResponse)
 async def medico(request: Request):
-    return templates.TemplateResponse("medico.html", {"request": request})
+    return PAGINAS["medico"].response(request.headers)
 
 @app.get("/secretaria", response_class=HTMLResponse)
 async def secretaria(request: Request):
-    return templates.TemplateResponse("secretaria.html", {"request": request})
+    return PAGINAS["secretaria"].response(request.headers)
+
+# ============================
+# PROXY /api/* → BACKEND
+# ============================
+# Los templates llaman a /api/... en el mismo origen (sin CORS ni preflight)
+# y el frontend reenvía al backend con un único cliente httpx compartido:
+# conexiones keep-alive reutilizadas y cuerpos en streaming en ambos sentidos.
+# HTTP/2 se negocia por ALPN, así que aplica cuando BACKEND_URL es https.
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8001").rstrip("/")
+PROXY_HTTP2 = os.getenv("PROXY_HTTP2", "true").lower() == "true"
+PROXY_MAX_CONNECTIONS = int(os.getenv("PROXY_MAX_CONNECTIONS", "100"))
+PROXY_MAX_KEEPALIVE = int(os.getenv("PROXY_MAX_KEEPALIVE", "20"))
+PROXY_KEEPALIVE_EXPIRY = float(os.getenv("PROXY_KEEPALIVE_EXPIRY", "30"))
+PROXY_CONNECT_TIMEOUT = float(os.getenv("PROXY_CONNECT_TIMEOUT", "5"))
+PROXY_READ_TIMEOUT = float(os.getenv("PROXY_READ_TIMEOUT", "60"))
+PROXY_WRITE_TIMEOUT = float(os.getenv("PROXY_WRITE_TIMEOUT", "60"))
+PROXY_POOL_TIMEOUT = float(os.getenv("PROXY_POOL_TIMEOUT", "5"))
+
+# Cabeceras hop-by-hop (RFC 9110 §7.6.1): no se reenvían
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host",
+}
+# Las X-Forwarded-* del cliente se descartan y se reenvía una sola de cada
+# una: el backend toma la IP a FORWARDED_TRUSTED_HOPS desde el final de la
+# cadena, así que un valor inventado por el navegador queda a la izquierda.
+FORWARDED = {"x-forwarded-for", "x-forwarded-proto", "x-forwarded-host"}
+NO_REENVIAR = HOP_BY_HOP | FORWARDED
+
+
+@app.on_event("startup")
+async def startup():
+    app.state.backend = httpx.AsyncClient(
+        base_url=BACKEND_URL,
+        http2=PROXY_HTTP2,
+        limits=httpx.Limits(
+            max_connections=PROXY_MAX_CONNECTIONS,
+            max_keepalive_connections=PROXY_MAX_KEEPALIVE,
+            keepalive_expiry=PROXY_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=PROXY_CONNECT_TIMEOUT,
+            read=PROXY_READ_TIMEOUT,
+            write=PROXY_WRITE_TIMEOUT,
+            pool=PROXY_POOL_TIMEOUT,
+        ),
+    )
+    print(f"🔀 Proxy /api → {BACKEND_URL} (http2={PROXY_HTTP2})")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await app.state.backend.aclose()
+
+
+@app.api_route("/api/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+async def proxy_api(request: Request, path: str):
+    headers = [
+        (k, v) for k, v in request.headers.raw
+        if k.decode("latin-1").lower() not in NO_REENVIAR
+    ]
+    cliente = request.client.host if request.client else ""
+    cadena = [
+        ip.strip()
+        for valor in request.headers.getlist("x-forwarded-for")
+        for ip in valor.split(",") if ip.strip()
+    ]
+    headers += [
+        (b"x-forwarded-for", ", ".join(cadena + [cliente]).encode("latin-1")),
+        (b"x-forwarded-proto", request.url.scheme.encode()),
+        (b"x-forwarded-host", request.headers.get("host", "").encode()),
+    ]
+
+    # solo se envía cuerpo si el navegador mandó uno (evita chunked en GET)
+    tiene_cuerpo = "content-length" in request.headers or "transfer-encoding" in request.headers
+    upstream_req = app.state.backend.build_request(
+        request.method,
+        "/" + path,
+        params=request.query_params.multi_items(),
+        headers=headers,
+        content=request.stream() if tiene_cuerpo else None,
+    )
+    try:
+        upstream = await app.state.backend.send(upstream_req, stream=True)
+    except httpx.TimeoutException:
+        return JSONResponse(status_code=504, content={"detail": "El backend no respondió a tiempo"})
+    except httpx.RequestError as e:
+        print(f"❌ Proxy: error al contactar el backend: {e}")
+        return JSONResponse(status_code=502, content={"detail": "Backend no disponible"})
+
+    response = StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        background=BackgroundTask(upstream.aclose),
+    )
+    # raw_headers conserva cabeceras repetidas (p. ej. varios Set-Cookie)
+    response.raw_headers = [
+        (k, v) for k, v in upstream.headers.raw
+        if k.decode("latin-1").lower() not in HOP_BY_HOP
+    ]
+    return response
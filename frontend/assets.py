@@ -0,0 +1,169 @@
+# assets.py
+import os
+import gzip
+import json
+import shutil
+import hashlib
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:  # sin brotli solo se generan las variantes .gz
+    brotli = None
+
+# ============================
+# BUILD DE ESTÁTICOS
+# ============================
+# `python assets.py` (o el arranque, si falta el manifiesto) copia static/
+# a BUILD_DIR con dos nombres por archivo: el original y uno con huella
+# (style.<hash>.css). Cada uno va acompañado de .gz y .br precomprimidos.
+# Los templates usan static_url("style.css") → /static/style.<hash>.css,
+# que se puede cachear como inmutable: si el contenido cambia, cambia la URL.
+STATIC_DIR = os.getenv("STATIC_DIR", "static")
+BUILD_DIR = os.getenv("ASSETS_BUILD_DIR", "build/static")
+MANIFEST = "manifest.json"
+COMPRIMIBLES = {".css", ".js", ".html", ".svg", ".json", ".txt", ".map"}
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "no-cache"
+
+_manifest: dict[str, str] = {}
+
+
+def _con_huella(nombre: str, contenido: bytes) -> str:
+    base, ext = os.path.splitext(nombre)
+    return f"{base}.{hashlib.sha256(contenido).hexdigest()[:10]}{ext}"
+
+
+def _precomprimir(ruta: str, contenido: bytes):
+    with open(ruta + ".gz", "wb") as f:
+        f.write(gzip.compress(contenido, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(ruta + ".br", "wb") as f:
+            f.write(brotli.compress(contenido, quality=11))
+
+
+def build(static_dir: str = STATIC_DIR, build_dir: str = BUILD_DIR) -> dict:
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    manifest = {}
+    for raiz, _, archivos in os.walk(static_dir):
+        for archivo in archivos:
+            origen = os.path.join(raiz, archivo)
+            relativo = os.path.relpath(origen, static_dir).replace(os.sep, "/")
+            with open(origen, "rb") as f:
+                contenido = f.read()
+
+            hasheado = _con_huella(relativo, contenido)
+            manifest[relativo] = hasheado
+            for nombre in (relativo, hasheado):
+                destino = os.path.join(build_dir, nombre)
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                with open(destino, "wb") as f:
+                    f.write(contenido)
+                if os.path.splitext(nombre)[1] in COMPRIMIBLES and contenido:
+                    _precomprimir(destino, contenido)
+
+    with open(os.path.join(build_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def cargar_manifest(build_dir: str = BUILD_DIR) -> dict:
+    """Lee el manifiesto del build; si no existe (desarrollo) lo genera."""
+    global _manifest
+    try:
+        with open(os.path.join(build_dir, MANIFEST)) as f:
+            _manifest = json.load(f)
+    except FileNotFoundError:
+        _manifest = build(build_dir=build_dir)
+        print(f"📦 Estáticos generados en {build_dir} ({len(_manifest)} archivos)")
+    return _manifest
+
+
+def static_url(nombre: str) -> str:
+    return "/static/" + _manifest.get(nombre, nombre)
+
+
+def _acepta(headers: Headers) -> list[tuple[str, str]]:
+    """[(content-encoding, sufijo)] aceptados, en orden de preferencia."""
+    aceptados = headers.get("accept-encoding", "")
+    opciones = []
+    if brotli is not None and "br" in aceptados:
+        opciones.append(("br", ".br"))
+    if "gzip" in aceptados:
+        opciones.append(("gzip", ".gz"))
+    return opciones
+
+
+# ============================
+# SERVIDOR DE ESTÁTICOS
+# ============================
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles que sirve la variante .br/.gz si el cliente la acepta y
+    marca como inmutables los archivos con huella."""
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code not in (200, 304):
+            return response
+
+        nombre = path.replace(os.sep, "/")
+        inmutable = nombre in _manifest.values()
+        request_headers = Headers(scope=scope)
+
+        if response.status_code == 200:
+            for encoding, sufijo in _acepta(request_headers):
+                comprimido, stat = self.lookup_path(path + sufijo)
+                if not comprimido:
+                    continue
+                response = FileResponse(
+                    comprimido,
+                    stat_result=stat,
+                    media_type=response.media_type,
+                    headers={"Content-Encoding": encoding},
+                )
+                if self.is_not_modified(response.headers, request_headers):
+                    response = NotModifiedResponse(response.headers)
+                break
+
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = CACHE_INMUTABLE if inmutable else CACHE_REVALIDAR
+        return response
+
+
+# ============================
+# PÁGINAS PRE-RENDERIZADAS
+# ============================
+class PaginaEstatica:
+    """HTML renderizado una sola vez, en memoria con sus variantes comprimidas."""
+
+    def __init__(self, html: str):
+        self.cuerpo = html.encode()
+        self.etag = f'"{hashlib.sha256(self.cuerpo).hexdigest()[:16]}"'
+        self.variantes = {"gzip": gzip.compress(self.cuerpo, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variantes["br"] = brotli.compress(self.cuerpo, quality=11)
+
+    def response(self, request_headers: Headers) -> Response:
+        encoding = next((e for e, _ in _acepta(request_headers) if e in self.variantes), None)
+        # la ETag distingue cada representación comprimida
+        etag = self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": CACHE_REVALIDAR, "Vary": "Accept-Encoding"}
+
+        if_none_match = request_headers.get("if-none-match", "")
+        if etag in [e.strip().removeprefix("W/") for e in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(self.cuerpo, media_type="text/html", headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(self.variantes[encoding], media_type="text/html", headers=headers)
+
+
+if __name__ == "__main__":
+    manifest = build()
+    print(f"📦 {len(manifest)} estáticos en {BUILD_DIR} (brotli={'sí' if brotli else 'no'})")
+    for original, hasheado in manifest.items():
+        print(f"   {original} → {hasheado}")
@@ -0,0 +1,12 @@
+// Las páginas se renderizan una sola vez al arrancar el frontend: los datos
+// de la visita (paciente_id, atencion_id...) vienen en la query string.
+// Cada <input data-query="nombre"> toma el valor del parámetro "nombre".
+document.addEventListener("DOMContentLoaded", function () {
+  var params = new URLSearchParams(window.location.search);
+  document.querySelectorAll("input[data-query]").forEach(function (input) {
+    var valor = params.get(input.dataset.query);
+    if (valor !== null) {
+      input.value = valor;
+    }
+  });
+});
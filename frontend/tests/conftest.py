@@ -0,0 +1,7 @@
+import os
+import sys
+
+# app.py resuelve templates/ y static/ relativos al directorio del frontend
+FRONTEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FRONTEND_DIR)
+os.chdir(FRONTEND_DIR)
@@ -0,0 +1,24 @@
+import asyncio
+import httpx
+import app as frontend
+
+
+def _get(url):
+    async def pedir():
+        transport = httpx.ASGITransport(app=frontend.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://front") as c:
+            return await c.get(url)
+    return asyncio.run(pedir())
+
+
+def test_medico_lee_los_ids_de_la_query():
+    html = _get("/medico?paciente_id=7&atencion_id=3").text
+    # pre-renderada: ningún value vacío fijo, los completa scripts.js
+    assert 'value=""' not in html
+    assert 'data-query="paciente_id"' in html and 'data-query="atencion_id"' in html
+    assert frontend.assets.static_url("scripts.js") in html
+
+
+def test_script_de_query_se_sirve():
+    r = _get(frontend.assets.static_url("scripts.js"))
+    assert r.status_code == 200 and "data-query" in r.text
@@ -0,0 +1,45 @@
+import asyncio
+import httpx
+import app as frontend
+
+
+def _proxy(headers: list[tuple[str, str]]) -> httpx.Request:
+    """Hace una petición a /api/... y devuelve la que llegó al backend."""
+    recibidas = []
+
+    def backend(request: httpx.Request) -> httpx.Response:
+        recibidas.append(request)
+        return httpx.Response(200, stream=httpx.ByteStream(b"{}"))
+
+    async def correr():
+        frontend.app.state.backend = httpx.AsyncClient(
+            base_url="http://backend", transport=httpx.MockTransport(backend)
+        )
+        transport = httpx.ASGITransport(app=frontend.app, client=("198.51.100.7", 5000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://front") as c:
+            r = await c.get("/api/users/me", headers=headers)
+        await frontend.app.state.backend.aclose()
+        assert r.status_code == 200
+
+    asyncio.run(correr())
+    return recibidas[0]
+
+
+def test_xff_falsificado_queda_a_la_izquierda():
+    req = _proxy([("X-Forwarded-For", "1.2.3.4, 203.0.113.9")])
+    valores = req.headers.get_list("x-forwarded-for")
+    assert valores == ["1.2.3.4, 203.0.113.9, 198.51.100.7"]
+    # el backend confía en el último salto: la IP real del par TCP
+    assert valores[0].split(", ")[-1] == "198.51.100.7"
+
+
+def test_xff_repetido_se_fusiona_en_una_cabecera():
+    req = _proxy([("X-Forwarded-For", "1.2.3.4"), ("X-Forwarded-For", "5.6.7.8")])
+    assert req.headers.get_list("x-forwarded-for") == ["1.2.3.4, 5.6.7.8, 198.51.100.7"]
+
+
+def test_sin_xff_solo_el_cliente():
+    req = _proxy([("X-Forwarded-Proto", "ftp"), ("X-Forwarded-Host", "evil")])
+    assert req.headers.get_list("x-forwarded-for") == ["198.51.100.7"]
+    assert req.headers.get_list("x-forwarded-proto") == ["http"]
+    assert req.headers.get_list("x-forwarded-host") == ["front"]
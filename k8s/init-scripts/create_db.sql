@@ -3,17 +3,83 @@
 -- ==========================================
 
 -- Eliminar tablas existentes si las hay
+DROP TABLE IF EXISTS historia_clinica.auditoria CASCADE;
+DROP TABLE IF EXISTS historia_clinica.atencion_rollup_diario CASCADE;
+DROP TABLE IF EXISTS historia_clinica.rollup_marca CASCADE;
+DROP TABLE IF EXISTS historia_clinica.rollup_dia_pendiente CASCADE;
 DROP TABLE IF EXISTS historia_clinica.cierre_historia CASCADE;
+DROP TABLE IF EXISTS historia_clinica.observacion CASCADE;
 DROP TABLE IF EXISTS historia_clinica.atencion CASCADE;
+DROP TABLE IF EXISTS historia_clinica.paciente_documento CASCADE;
+DROP TABLE IF EXISTS historia_clinica.paciente_usuario CASCADE;
 DROP TABLE IF EXISTS historia_clinica.paciente CASCADE;
 DROP TABLE IF EXISTS historia_clinica.profesional CASCADE;
+DROP TABLE IF EXISTS historia_clinica.usuario_rol CASCADE;
+DROP TABLE IF EXISTS historia_clinica.rol CASCADE;
 DROP TABLE IF EXISTS historia_clinica.usuario CASCADE;
 
 -- Crear esquema
 CREATE SCHEMA IF NOT EXISTS historia_clinica;
 
+-- Búsqueda difusa de pacientes (Citus propaga la extensión a los workers)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- ==========================================
+-- 🔹 DISEÑO DE DISTRIBUCIÓN
+-- ==========================================
+-- Toda la historia de un paciente vive en un solo shard:
+--   paciente        → distribuida por id
+--   atencion        → distribuida por paciente_id (colocada con paciente)
+--   cierre_historia → distribuida por paciente_id (colocada con paciente)
+--   observacion     → distribuida por paciente_id (colocada con paciente)
+-- Usuarios, roles y profesionales son pequeños y se consultan en cada
+-- login: quedan como tablas de referencia (replicadas en cada worker).
+
+-- ==========================================
+-- 🔹 TABLAS DE REFERENCIA: USUARIO Y ROLES (para login y roles)
+-- ==========================================
+CREATE TABLE historia_clinica.usuario (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    email VARCHAR(150) UNIQUE NOT NULL,
+    hashed_password VARCHAR(255) NOT NULL,
+    nombre_completo VARCHAR(200),
+    activo BOOLEAN DEFAULT TRUE,
+    fecha_creacion TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE historia_clinica.rol (
+    id SERIAL PRIMARY KEY,
+    nombre VARCHAR(50) UNIQUE NOT NULL
+);
+
+CREATE TABLE historia_clinica.usuario_rol (
+    usuario_id INT REFERENCES historia_clinica.usuario(id),
+    rol_id INT REFERENCES historia_clinica.rol(id),
+    PRIMARY KEY (usuario_id, rol_id)
+);
+
+SELECT create_reference_table('historia_clinica.usuario');
+SELECT create_reference_table('historia_clinica.rol');
+SELECT create_reference_table('historia_clinica.usuario_rol');
+
 -- ==========================================
--- 🔹 TABLA DE REFERENCIA: PACIENTE
+-- 🔹 TABLA DE REFERENCIA: PROFESIONAL
+-- ==========================================
+CREATE TABLE historia_clinica.profesional (
+    id SERIAL PRIMARY KEY,
+    nombre_profesional VARCHAR(150),
+    tipo_profesional VARCHAR(50),
+    registro_medico VARCHAR(100),
+    cargo_servicio VARCHAR(100),
+    firma_profesional TEXT,
+    usuario_id INT REFERENCES historia_clinica.usuario(id)
+);
+
+SELECT create_reference_table('historia_clinica.profesional');
+
+-- ==========================================
+-- 🔹 TABLA DISTRIBUIDA: PACIENTE
 -- ==========================================
 CREATE TABLE historia_clinica.paciente (
     id SERIAL PRIMARY KEY,
@@ -25,7 +91,7 @@ CREATE TABLE historia_clinica.paciente (
     segundo_nombre VARCHAR(100),
     fecha_nacimiento DATE,
     edad INT,
-    sexo VARCHAR(10),
+    sexo VARCHAR(20),
     genero VARCHAR(50),
     grupo_sanguineo VARCHAR(5),
     factor_rh VARCHAR(5),
@@ -36,14 +102,57 @@ CREATE TABLE historia_clinica.paciente (
     telefono VARCHAR(50),
     celular VARCHAR(50),
     correo_electronico VARCHAR(150),
-    ocupacion VARCHAR(100),
-    entidad_pertenece VARCHAR(100),
+    ocupacion VARCHAR(150),
+    entidad_pertenece VARCHAR(150),
     regimen_afiliacion VARCHAR(50),
-    tipo_usuario VARCHAR(50)
+    tipo_usuario VARCHAR(50),
+    usuario_id INT REFERENCES historia_clinica.usuario(id),
+    actualizado_en TIMESTAMPTZ NOT NULL DEFAULT NOW()  -- marca para el rollup
 );
 
--- Convertir en tabla de referencia
-SELECT create_reference_table('historia_clinica.paciente');
+-- En una tabla distribuida los UNIQUE deben incluir la columna de
+-- distribución: numero_documento y usuario_id se indexan aquí y su
+-- unicidad la dan paciente_documento / paciente_usuario (más abajo).
+CREATE INDEX ix_paciente_numero_documento ON historia_clinica.paciente (numero_documento);
+CREATE INDEX ix_paciente_usuario_id ON historia_clinica.paciente (usuario_id);
+
+-- Búsqueda del mostrador de admisión: prefijo en documento/teléfonos y
+-- trigramas sobre el nombre completo (misma expresión que models.py)
+CREATE INDEX ix_paciente_documento_prefijo
+    ON historia_clinica.paciente (numero_documento varchar_pattern_ops);
+CREATE INDEX ix_paciente_telefono_prefijo
+    ON historia_clinica.paciente (telefono varchar_pattern_ops);
+CREATE INDEX ix_paciente_celular_prefijo
+    ON historia_clinica.paciente (celular varchar_pattern_ops);
+CREATE INDEX ix_paciente_nombre_trgm
+    ON historia_clinica.paciente USING gin (
+        lower(coalesce(primer_nombre, '') || ' ' || coalesce(segundo_nombre, '') || ' '
+              || coalesce(primer_apellido, '') || ' ' || coalesce(segundo_apellido, ''))
+        gin_trgm_ops
+    );
+
+-- Exportación de historias por aseguradora
+CREATE INDEX ix_paciente_entidad
+    ON historia_clinica.paciente (entidad_pertenece, id);
+CREATE INDEX ix_paciente_actualizado_en
+    ON historia_clinica.paciente (actualizado_en);
+
+SELECT create_distributed_table('historia_clinica.paciente', 'id');
+
+-- Tablas de búsqueda con la clave única como columna de distribución: el
+-- backend las inserta en la misma transacción que el paciente, así un
+-- documento o usuario repetido hace fallar el alta completa.
+CREATE TABLE historia_clinica.paciente_documento (
+    numero_documento VARCHAR(50) PRIMARY KEY,
+    paciente_id INT NOT NULL
+);
+SELECT create_distributed_table('historia_clinica.paciente_documento', 'numero_documento');
+
+CREATE TABLE historia_clinica.paciente_usuario (
+    usuario_id INT PRIMARY KEY REFERENCES historia_clinica.usuario(id),
+    paciente_id INT NOT NULL
+);
+SELECT create_distributed_table('historia_clinica.paciente_usuario', 'usuario_id');
 
 -- ==========================================
 -- 🔹 TABLA DISTRIBUIDA: ATENCION
@@ -77,66 +186,154 @@ CREATE TABLE historia_clinica.atencion (
     educacion_paciente TEXT,
     referencia_contrareferencia TEXT,
     estado_egreso VARCHAR(50),
+    version INT NOT NULL DEFAULT 1,  -- concurrencia optimista
+    actualizado_en TIMESTAMPTZ NOT NULL DEFAULT NOW(),  -- marca para el rollup
     PRIMARY KEY (id, paciente_id)
 );
 
--- Convertir en tabla distribuida
-SELECT create_distributed_table('historia_clinica.atencion', 'paciente_id');
+CREATE INDEX ix_atencion_paciente_fecha
+    ON historia_clinica.atencion (paciente_id, fecha_hora_atencion DESC NULLS LAST, id DESC);
+CREATE INDEX ix_atencion_actualizado_en
+    ON historia_clinica.atencion (actualizado_en);
+-- recálculo de días del rollup por rango sobre la fecha
+CREATE INDEX ix_atencion_fecha
+    ON historia_clinica.atencion (fecha_hora_atencion);
+
+-- Convertir en tabla distribuida (colocada con paciente)
+SELECT create_distributed_table('historia_clinica.atencion', 'paciente_id',
+                                colocate_with => 'historia_clinica.paciente');
+
+ALTER TABLE historia_clinica.atencion
+    ADD CONSTRAINT fk_atencion_paciente
+    FOREIGN KEY (paciente_id) REFERENCES historia_clinica.paciente(id);
 
 -- ==========================================
--- 🔹 TABLA LOCAL: PROFESIONAL
+-- 🔹 TABLA DISTRIBUIDA: OBSERVACION (bitácora, solo INSERT)
 -- ==========================================
-CREATE TABLE historia_clinica.profesional (
-    id SERIAL PRIMARY KEY,
-    nombre_profesional VARCHAR(150),
-    tipo_profesional VARCHAR(50),
-    registro_medico VARCHAR(100),
-    cargo_servicio VARCHAR(100),
-    firma_profesional TEXT
+CREATE TABLE historia_clinica.observacion (
+    id SERIAL,
+    paciente_id INT NOT NULL,
+    fecha_hora TIMESTAMP NOT NULL DEFAULT NOW(),
+    autor VARCHAR(200),
+    texto TEXT NOT NULL,
+    PRIMARY KEY (id, paciente_id)
 );
 
+CREATE INDEX ix_observacion_paciente_fecha
+    ON historia_clinica.observacion (paciente_id, fecha_hora DESC, id DESC);
+
+-- Colocada con paciente: las notas de un paciente viven en su mismo shard
+SELECT create_distributed_table('historia_clinica.observacion', 'paciente_id',
+                                colocate_with => 'historia_clinica.paciente');
+
+ALTER TABLE historia_clinica.observacion
+    ADD CONSTRAINT fk_observacion_paciente
+    FOREIGN KEY (paciente_id) REFERENCES historia_clinica.paciente(id);
+
 -- ==========================================
 -- 🔹 TABLA DISTRIBUIDA: CIERRE_HISTORIA
 -- ==========================================
+-- Lleva paciente_id para quedar en el shard de su atención: el JOIN
+-- atencion ⋈ cierre_historia se resuelve localmente en un worker.
 CREATE TABLE historia_clinica.cierre_historia (
     id SERIAL,
     atencion_id INT NOT NULL,
+    paciente_id INT NOT NULL,
     firma_paciente TEXT,
     fecha_hora_cierre TIMESTAMP,
     responsable_registro VARCHAR(150),
-    PRIMARY KEY (id, atencion_id)
+    version INT NOT NULL DEFAULT 1,  -- concurrencia optimista
+    PRIMARY KEY (id, paciente_id)
 );
 
--- Convertir en tabla distribuida
-SELECT create_distributed_table('historia_clinica.cierre_historia', 'atencion_id');
+CREATE INDEX ix_cierre_historia_atencion
+    ON historia_clinica.cierre_historia (paciente_id, atencion_id);
+
+-- Convertir en tabla distribuida (colocada con paciente)
+SELECT create_distributed_table('historia_clinica.cierre_historia', 'paciente_id',
+                                colocate_with => 'historia_clinica.paciente');
+
+ALTER TABLE historia_clinica.cierre_historia
+    ADD CONSTRAINT fk_cierre_atencion
+    FOREIGN KEY (atencion_id, paciente_id) REFERENCES historia_clinica.atencion(id, paciente_id);
 
 -- ==========================================
--- 🔹 TABLA DE USUARIOS (para login y roles)
+-- 🔹 TABLA LOCAL: AUDITORIA (bitácora de accesos, solo INSERT)
 -- ==========================================
-CREATE TABLE historia_clinica.usuario (
-    id SERIAL PRIMARY KEY,
-    username VARCHAR(50) UNIQUE NOT NULL,
-    email VARCHAR(150) UNIQUE,
-    hashed_password VARCHAR(255) NOT NULL,
-    rol VARCHAR(20) NOT NULL, -- Roles: medico, admisionista, paciente, resultados
-    nombre_completo VARCHAR(200),
-    activo BOOLEAN DEFAULT TRUE,
-    fecha_creacion TIMESTAMP DEFAULT NOW()
+-- La llena audit.py por lotes con COPY. Queda en el coordinador (sin
+-- distribuir): búsquedas y exportaciones por entidad no tienen paciente_id.
+CREATE TABLE historia_clinica.auditoria (
+    id BIGSERIAL PRIMARY KEY,
+    ts TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    usuario_id INT,
+    username VARCHAR(50),
+    accion VARCHAR(20) NOT NULL,
+    recurso VARCHAR(30) NOT NULL,
+    paciente_id INT,
+    recurso_id INT,
+    metodo VARCHAR(10),
+    ruta VARCHAR(200),
+    status SMALLINT,
+    ip VARCHAR(64),
+    detalle TEXT
+);
+
+CREATE INDEX ix_auditoria_paciente_ts ON historia_clinica.auditoria (paciente_id, ts);
+CREATE INDEX ix_auditoria_usuario_ts ON historia_clinica.auditoria (usuario_id, ts);
+
+-- ==========================================
+-- 🔹 TABLAS LOCALES: ROLLUPS PARA TABLEROS
+-- ==========================================
+-- Las mantiene rollup.py a partir de atencion.actualizado_en,
+-- paciente.actualizado_en y rollup_dia_pendiente; el tablero las lee sin
+-- hacer GROUP BY sobre los shards.
+CREATE TABLE historia_clinica.atencion_rollup_diario (
+    dia DATE NOT NULL,
+    tipo_atencion VARCHAR(50) NOT NULL,
+    entidad_pertenece VARCHAR(150) NOT NULL,
+    regimen_afiliacion VARCHAR(50) NOT NULL,
+    atenciones BIGINT NOT NULL,
+    PRIMARY KEY (dia, tipo_atencion, entidad_pertenece, regimen_afiliacion)
+);
+
+CREATE TABLE historia_clinica.rollup_dia_pendiente (
+    dia DATE PRIMARY KEY
+);
+
+CREATE TABLE historia_clinica.rollup_marca (
+    nombre VARCHAR(50) PRIMARY KEY,
+    procesado_hasta TIMESTAMPTZ NOT NULL
 );
 
--- Insertar usuarios de ejemplo
-INSERT INTO historia_clinica.usuario (username, email, hashed_password, rol, nombre_completo, activo)
-VALUES 
-('admin', 'admin@example.com', '<hash_admin>', 'admisionista', 'Administrador', true),
-('medico1', 'medico1@example.com', '<hash_medico>', 'medico', 'Dr. Juan Perez', true),
-('paciente1', 'paciente1@example.com', '<hash_paciente>', 'paciente', 'Carlos Gomez', true),
-('resultados1', 'resultados1@example.com', '<hash_resultados>', 'resultados', 'Encargado Resultados', true);
+-- ==========================================
+-- 🔹 DATOS DE EJEMPLO
+-- ==========================================
+INSERT INTO historia_clinica.rol (nombre)
+VALUES ('admisionista'), ('medico'), ('paciente'), ('secretaria');
+
+INSERT INTO historia_clinica.usuario (username, email, hashed_password, nombre_completo, activo)
+VALUES
+('admin', 'admin@example.com', '<hash_admin>', 'Administrador', true),
+('medico1', 'medico1@example.com', '<hash_medico>', 'Dr. Juan Perez', true),
+('paciente1', 'paciente1@example.com', '<hash_paciente>', 'Carlos Gomez', true),
+('secretaria1', 'secretaria1@example.com', '<hash_secretaria>', 'Encargada PDF', true);
+
+INSERT INTO historia_clinica.usuario_rol (usuario_id, rol_id)
+SELECT u.id, r.id
+FROM historia_clinica.usuario u
+JOIN historia_clinica.rol r ON r.nombre = CASE u.username
+    WHEN 'admin' THEN 'admisionista'
+    WHEN 'medico1' THEN 'medico'
+    WHEN 'paciente1' THEN 'paciente'
+    WHEN 'secretaria1' THEN 'secretaria'
+END;
 
 -- ==========================================
 -- 🔹 LISTADO DE TABLAS
 -- ==========================================
--- Tablas distribuidas
-SELECT * FROM citus_tables WHERE distribution_column IS NOT NULL;
+-- Tablas distribuidas (todas deben compartir colocation_id)
+SELECT table_name, distribution_column, colocation_id
+FROM citus_tables WHERE distribution_column <> '<none>';
 
 -- Tablas de referencia
-SELECT * FROM citus_tables WHERE distribution_column IS NULL;
+SELECT table_name FROM citus_tables WHERE citus_table_type = 'reference';